@@ -1,12 +1,43 @@
 """ Main api entry point """
 
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI
 from api.routers.users import USERS_ROUTER
 from api.routers.cities import CITIES_ROUTER
+from api.routers.stats import STATS_ROUTER
+from internal.database.cache import _registry_cache_di_factory
+from internal.database.manager import RedisPool, _pubsub_hub_di_factory
+from internal.queue_manager import _queue_transport_di_factory
+from internal.settings import _api_settings_builder
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """Open shared resources on startup and release them on shutdown"""
+
+    settings = _api_settings_builder()
+    redis_pool = RedisPool(settings)
+    redis_pool.open()
+    cache = _registry_cache_di_factory(settings)
+    listener = asyncio.create_task(cache.listen(redis_pool.client()))
+    hub = _pubsub_hub_di_factory(settings)
+    queue_conn = _queue_transport_di_factory(settings)
+    await queue_conn.connect()
+    yield
+    await queue_conn.close()
+    await hub.close()
+    listener.cancel()
+    with suppress(asyncio.CancelledError):
+        await listener
+
+    await redis_pool.close()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.include_router(USERS_ROUTER)
+app.include_router(STATS_ROUTER)
 app.include_router(CITIES_ROUTER)
 
 if __name__ == "__main__":
@@ -1,8 +1,10 @@
 """ Manage and create users """
 
+from contextlib import aclosing
 from datetime import datetime
 
-from fastapi import Response, status, HTTPException
+from fastapi import Body, Query, Response, status, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.routing import APIRouter
 
 from internal.database.repositories import (
@@ -11,40 +13,193 @@ from internal.database.repositories import (
     UserCityDataRepositoryDI,
 )
 from internal.queue_manager import QueueManagerDI
-from internal.models import UserCityData
+from internal.models import User, UserCityData, UserCityDataPage
+from internal.settings import ApiSettingsDI
 
 CITIES_ROUTER = APIRouter()
+JOB_ID_HEADER = "X-Job-Id"
+
+
+async def _enqueue_requests(
+    users: list[User],
+    settings: ApiSettingsDI,
+    user_repo: UserRepositoryDI,
+    user_city_data_repo: UserCityDataRepositoryDI,
+    city_info_repo: CityInfoRepositoryDI,
+    queue_manager: QueueManagerDI,
+) -> dict[int, str]:
+    """
+    Enqueue users requests, split in cities chunks when enabled so the\
+        request is processed by many consumers at same time. Users with a\
+        pending or running job are not enqueued again.
+    Return user index to its in flight job id.
+    """
+
+    jobs = await user_repo.acquire_jobs(users, settings.queue_job_ttl)
+    users = [user for user in users if jobs[user.index][1]]
+    job_ids = {index: job_id for index, (job_id, _) in jobs.items()}
+    if not users:
+        return job_ids
+
+    try:
+        requested_at = datetime.now().isoformat()
+        for user in users:
+            user.requested_at = requested_at
+            # previous request progress is never reported for this one
+            await user_repo.start_processing(user)
+            await user_repo.update_user(user)
+
+        chunk_size = settings.queue_job_chunk_size
+        if not chunk_size:
+            await queue_manager.enqueue_users(users, job_ids=job_ids)
+            return job_ids
+
+        # chunks can't reset request data, so it's done before enqueue
+        for user in users:
+            await user_city_data_repo.remove_all_user_city_data(user)
+
+        await queue_manager.enqueue_users(
+            users, await city_info_repo.total_of_cities(), chunk_size, job_ids
+        )
+    except Exception:
+        # jobs never queued must not hold back the next requests
+        for user in users:
+            await user_repo.release_job(user.index, job_ids[user.index])
+
+        raise
+
+    return job_ids
+
+
+@CITIES_ROUTER.post("/requests", status_code=status.HTTP_204_NO_CONTENT)
+async def request_start_process_cities_batch(
+    settings: ApiSettingsDI,
+    user_repo: UserRepositoryDI,
+    user_city_data_repo: UserCityDataRepositoryDI,
+    city_info_repo: CityInfoRepositoryDI,
+    queue_manager: QueueManagerDI,
+    users_ids: list[int] = Body(min_length=1, max_length=1000),
+) -> None:
+    """Start cities request for many users in one call."""
+    users_ids = list(dict.fromkeys(users_ids))
+    users = await user_repo.get_users(*users_ids)
+    if len(users) != len(users_ids):
+        raise HTTPException(status.HTTP_404_NOT_FOUND)
+
+    await _enqueue_requests(
+        users,
+        settings,
+        user_repo,
+        user_city_data_repo,
+        city_info_repo,
+        queue_manager,
+    )
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @CITIES_ROUTER.post("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def request_start_process_cities(
-    user_id: int, user_repo: UserRepositoryDI, queue_manager: QueueManagerDI
+    user_id: int,
+    settings: ApiSettingsDI,
+    user_repo: UserRepositoryDI,
+    user_city_data_repo: UserCityDataRepositoryDI,
+    city_info_repo: CityInfoRepositoryDI,
+    queue_manager: QueueManagerDI,
 ) -> None:
-    """Start cities request for specified user."""
+    """
+    Start cities request for specified user, a repeated request while the\
+        previous one is in flight returns the same job.
+    """
     user = await user_repo.get_user(user_id)
-    user.requested_at = datetime.now().isoformat()
-    await user_repo.update_user(user)
-    await queue_manager.enqueue_user(user)
+    job_ids = await _enqueue_requests(
+        [user],
+        settings,
+        user_repo,
+        user_city_data_repo,
+        city_info_repo,
+        queue_manager,
+    )
+
+    return Response(
+        status_code=status.HTTP_204_NO_CONTENT,
+        headers={JOB_ID_HEADER: job_ids[user.index]},
+    )
 
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+def _processed_percentage(user: User, total_of_cities: int) -> int:
+    """User request processed cities percentage"""
+
+    if total_of_cities <= 0 or not user.processed:
+        return 0
+
+    return int((user.processed / total_of_cities) * 100.0)
 
 
 @CITIES_ROUTER.get("/{user_id}")
 async def monitore_request_processed_percentage(
-    user_id: int,
-    user_repo: UserRepositoryDI,
-    city_info_repo: CityInfoRepositoryDI,
+    user_id: int, user_repo: UserRepositoryDI
 ) -> int:
     """Check user request process status."""
 
-    if (TOTAL_OF_CITIES := await city_info_repo.total_of_cities()) <= 0:
-        return 0
+    USER, TOTAL_OF_CITIES = await user_repo.get_user_with_total_cities(user_id)
+
+    return _processed_percentage(USER, TOTAL_OF_CITIES)
+
+
+@CITIES_ROUTER.get("/{user_id}/progress/stream")
+async def stream_request_processed_percentage(
+    user_id: int, user_repo: UserRepositoryDI
+) -> StreamingResponse:
+    """Push user request process status as Server-Sent Events."""
+
+    USER, TOTAL_OF_CITIES = await user_repo.get_user_with_total_cities(user_id)
+
+    async def events():
+        percentage = _processed_percentage(USER, TOTAL_OF_CITIES)
+        yield f"data: {percentage}\n\n"
+
+        user, total = USER, TOTAL_OF_CITIES
+        if user.processed_at is not None or percentage >= 100:
+            return
+
+        # closed on return, releasing the channel subscription at once
+        async with aclosing(user_repo.iter_progress(user_id)) as progress:
+            async for processed in progress:
+                if processed is None:
+                    # no news in a while, resync in case an update was missed
+                    user, total = await user_repo.get_user_with_total_cities(
+                        user_id
+                    )
+                    yield ": keep-alive\n\n"
+                else:
+                    user.processed = processed
+
+                current = _processed_percentage(user, total)
+                if current != percentage:
+                    percentage = current
+                    yield f"data: {percentage}\n\n"
+
+                if user.processed_at is not None or percentage >= 100:
+                    return
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+async def _get_processed_user(
+    user_id: int, user_repo: UserRepositoryDI
+) -> User:
+    """Fetch user, fails if his request was not processed yet"""
 
     USER = await user_repo.get_user(user_id)
-    if not USER.processed:
-        return 0
+    if USER.processed_at is None:
+        raise HTTPException(status.HTTP_425_TOO_EARLY)
 
-    return int((USER.processed / TOTAL_OF_CITIES) * 100.0)
+    return USER
 
 
 @CITIES_ROUTER.get("/{user_id}/result")
@@ -55,8 +210,44 @@ async def get_user_citie_request(
 ) -> list[UserCityData]:
     """Check user request process status."""
 
-    USER = await user_repo.get_user(user_id)
-    if USER.processed_at is None:
-        raise HTTPException(status.HTTP_425_TOO_EARLY)
+    USER = await _get_processed_user(user_id, user_repo)
 
     return await user_city_data.get_all_user_city_data(USER)
+
+
+@CITIES_ROUTER.get("/{user_id}/result/page")
+async def get_user_citie_request_page(
+    user_id: int,
+    user_repo: UserRepositoryDI,
+    user_city_data: UserCityDataRepositoryDI,
+    cursor: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+) -> UserCityDataPage:
+    """Get user request result one page at time."""
+
+    USER = await _get_processed_user(user_id, user_repo)
+    items, next_cursor = await user_city_data.page_user_city_data(
+        USER, cursor, limit
+    )
+
+    return UserCityDataPage(items=items, next_cursor=next_cursor)
+
+
+@CITIES_ROUTER.get("/{user_id}/result/stream")
+async def stream_user_citie_request(
+    user_id: int,
+    user_repo: UserRepositoryDI,
+    user_city_data: UserCityDataRepositoryDI,
+    chunk_size: int = Query(100, ge=1, le=1000),
+) -> StreamingResponse:
+    """Stream user request result as NDJSON, one city data per line."""
+
+    USER = await _get_processed_user(user_id, user_repo)
+
+    async def ndjson_lines():
+        async for registry in user_city_data.iter_user_city_data(
+            USER, chunk_size
+        ):
+            yield registry.model_dump_json() + "\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
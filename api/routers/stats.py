@@ -0,0 +1,20 @@
+""" Expose runtime statistics """
+
+from fastapi.routing import APIRouter
+from internal.database.cache import _registry_cache_di_factory
+from internal.database.manager import RedisPool
+from internal.database.repositories import UserRepositoryDI
+from internal.settings import ApiSettingsDI
+
+STATS_ROUTER = APIRouter()
+
+
+@STATS_ROUTER.get("/stats")
+async def get_stats(
+    settings: ApiSettingsDI, user_repo: UserRepositoryDI
+) -> dict:
+    return {
+        "redis_pool": RedisPool(settings).stats(),
+        "registry_cache": _registry_cache_di_factory(settings).stats(),
+        "user_jobs": await user_repo.job_stats(),
+    }
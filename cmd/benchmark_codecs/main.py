@@ -0,0 +1,104 @@
+"""script for compare storage codecs size and speed"""
+
+import time
+
+import click
+
+import sys
+from pathlib import Path
+
+# type: ignore
+sys.path.append(str(Path(Path(__file__).parent, "..", "..").absolute()))
+
+from internal.database.codecs import CODECS, RegistryCodec, decode_registry
+from internal.models import UserCityData
+
+SAMPLE_PAYLOAD = {
+    "coord": {"lon": -46.6361, "lat": -23.5475},
+    "weather": [
+        {"id": 800, "main": "Clear", "description": "clear sky", "icon": "01d"}
+    ],
+    "base": "stations",
+    "main": {
+        "temp": 296.15,
+        "feels_like": 296.21,
+        "temp_min": 294.82,
+        "temp_max": 297.04,
+        "pressure": 1017,
+        "humidity": 64,
+    },
+    "visibility": 10000,
+    "wind": {"speed": 3.6, "deg": 150},
+    "clouds": {"all": 0},
+    "dt": 1723420800,
+    "sys": {"type": 1, "id": 8394, "country": "BR"},
+    "timezone": -10800,
+    "id": 3448439,
+    "name": "São Paulo",
+    "cod": 200,
+}
+
+
+def _timeit(func, rounds: int) -> float:
+    """mean microseconds per call"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+
+    return (time.perf_counter() - start) / rounds * 1_000_000
+
+
+def _stored_size(mapping: dict) -> int:
+    return sum(
+        len(key) + len(value if isinstance(value, bytes) else str(value))
+        for key, value in mapping.items()
+    )
+
+
+def _as_stored(mapping: dict) -> dict[bytes, bytes]:
+    return {
+        key.encode(): (
+            value if isinstance(value, bytes) else str(value).encode()
+        )
+        for key, value in mapping.items()
+    }
+
+
+def _benchmark(codec: RegistryCodec, rounds: int) -> tuple:
+    registry = UserCityData.build_from(1, SAMPLE_PAYLOAD)
+    registry.index = 1
+    fields = registry.storage_dump()
+    mapping = codec.encode(fields)
+    stored = _as_stored(mapping)
+    payload = codec.dumps(SAMPLE_PAYLOAD)
+
+    return (
+        _stored_size(mapping),
+        _timeit(lambda: codec.encode(fields), rounds),
+        _timeit(lambda: UserCityData(**decode_registry(stored)), rounds),
+        len(payload),
+        _timeit(lambda: codec.dumps(SAMPLE_PAYLOAD), rounds),
+        _timeit(lambda: codec.loads(payload), rounds),
+    )
+
+
+@click.command("benchmark-codecs")
+@click.option("--rounds", default=10_000, show_default=True, type=int)
+def main(rounds: int) -> None:
+    """bytes per record and encode/decode time (µs) of each codec"""
+
+    click.echo(
+        f"{'codec':8} {'record B':>9} {'enc µs':>8} {'dec µs':>8}"
+        f" {'payload B':>10} {'enc µs':>8} {'dec µs':>8}"
+    )
+    for name, codec in CODECS.items():
+        rec_size, rec_enc, rec_dec, size, enc, dec = _benchmark(codec, rounds)
+        click.echo(
+            f"{click.style(f'{name:8}', fg='green')} {rec_size:>9} "
+            f"{rec_enc:>8.2f} {rec_dec:>8.2f} {size:>10} "
+            f"{enc:>8.2f} {dec:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""script for keep cities weather cache warm"""
+
+import asyncio
+from datetime import datetime
+
+import click
+
+import sys
+from pathlib import Path
+
+# type: ignore
+sys.path.append(str(Path(Path(__file__).parent, "..", "..").absolute()))
+
+from internal.database.cache import _registry_cache_di_factory
+from internal.database.manager import AsyncDbManager, RedisPool
+from internal.database.repositories import CityInfoRepository
+from internal.services import CitiesCacheWarmer, _cities_fetch_service_builder
+from internal.settings import _consumer_settings_builder
+from internal.utils import stop_on_signals
+
+
+async def run_warmer(once: bool) -> None:
+    """Refresh expiring cities until SIGTERM/SIGINT, or once"""
+
+    settings = _consumer_settings_builder()
+    redis_pool = RedisPool(settings)
+    redis = redis_pool.client()
+    manager = AsyncDbManager(redis, _registry_cache_di_factory(settings))
+    fetch_service = _cities_fetch_service_builder(settings, redis)
+    warmer = CitiesCacheWarmer(
+        fetch_service,
+        CityInfoRepository(manager),
+        settings.weather_cache_refresh_margin,
+    )
+    try:
+        if once:
+            click.echo(f"{await warmer.warm()} cities refreshed")
+        else:
+            await warmer.run(stop_on_signals())
+    finally:
+        await fetch_service.close()
+        await redis_pool.close()
+
+
+@click.command("cache-warmer")
+@click.option("--once", is_flag=True, help="refresh expiring cities and exit")
+def main(once: bool) -> None:
+    """refresh cities weather cache before it expires"""
+
+    click.echo(f'{click.style("Running", fg="green")} cache-warmer', nl=False)
+    date = click.style(
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"), fg="yellow"
+    )
+    click.echo(f' {click.style("at", fg="green")} "{date}" ...')
+    asyncio.run(run_warmer(once))
+    click.echo(click.style("\nDone!", fg="green"))
+
+
+if __name__ == "__main__":
+    main()
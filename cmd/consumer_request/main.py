@@ -1,6 +1,9 @@
 """script for process user request"""
 
 import asyncio
+import multiprocessing
+import os
+import signal
 from datetime import datetime
 
 import click
@@ -11,3 +14,135 @@ from pathlib import Path
 print(Path(__file__).parent.parent.parent.absolute())
 # type: ignore
 sys.path.append(str(Path(Path(__file__).parent, "..", "..").absolute()))
+
+from internal.database.cache import _registry_cache_di_factory
+from internal.database.manager import AsyncDbManager, RedisPool
+from internal.database.repositories import (
+    CityInfoRepository,
+    UserCityDataRepository,
+    UserRepository,
+)
+from internal.queue_manager import (
+    ConsumerStats,
+    QueueManager,
+    _queue_transport_di_factory,
+)
+from internal.services import (
+    UserCitiesRequestService,
+    _cities_fetch_service_builder,
+)
+from internal.settings import _consumer_settings_builder
+
+
+async def run_worker(concurrency: int, prefetch_count: int) -> None:
+    """Consume user requests until SIGTERM/SIGINT, then drain and exit"""
+
+    settings = _consumer_settings_builder()
+    redis_pool = RedisPool(settings)
+    redis = redis_pool.client()
+    manager = AsyncDbManager(redis, _registry_cache_di_factory(settings))
+    queue_conn = _queue_transport_di_factory(settings)
+    user_repo = UserRepository(manager)
+    fetch_service = _cities_fetch_service_builder(settings, redis)
+    weather_api = fetch_service.request_service
+    process_request = UserCitiesRequestService(
+        fetch_service,
+        user_repo,
+        CityInfoRepository(manager),
+        UserCityDataRepository(manager),
+        settings.write_buffer_size,
+        settings.write_buffer_delay,
+        settings.queue_job_ttl,
+    )
+    stats = ConsumerStats()
+    try:
+        await QueueManager(queue_conn).process_user_job_message(
+            process_request,
+            user_repo.get_users,
+            settings.queue_load_delay,
+            prefetch_count=prefetch_count,
+            concurrency=concurrency,
+            stats=stats,
+        )
+    finally:
+        await queue_conn.close()
+        await fetch_service.close()
+        await redis_pool.close()
+        click.echo(f"worker {os.getpid()} stopped: {stats.stats()}")
+        click.echo(f"worker {os.getpid()} weather api: {weather_api.stats()}")
+        click.echo(
+            f"worker {os.getpid()} cities fetch: {fetch_service.stats()}"
+        )
+
+
+def _worker_main(concurrency: int, prefetch_count: int) -> None:
+    asyncio.run(run_worker(concurrency, prefetch_count))
+
+
+@click.command("consumer-request")
+@click.option(
+    "--workers",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="worker processes",
+)
+@click.option(
+    "--concurrency",
+    default=None,
+    type=click.IntRange(min=1),
+    help="concurrent jobs per worker [default: queue_consumer_concurrency]",
+)
+def main(workers: int, concurrency: int | None) -> None:
+    """consume and process users cities requests"""
+
+    settings = _consumer_settings_builder()
+    concurrency = concurrency or settings.queue_consumer_concurrency
+    prefetch_count = max(settings.amqp_prefetch_count, concurrency)
+
+    click.echo(
+        f'{click.style("Running", fg="green")} consumer-request', nl=False
+    )
+    date = click.style(
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"), fg="yellow"
+    )
+    click.echo(f' {click.style("at", fg="green")} "{date}" ...')
+    click.echo(
+        f"{workers} worker(s) x {concurrency} job(s) ="
+        f" {click.style(str(workers * concurrency), fg='green')}"
+        f" concurrent jobs (prefetch {prefetch_count} per worker)"
+    )
+
+    if workers == 1:
+        _worker_main(concurrency, prefetch_count)
+        click.echo(click.style("\nDone!", fg="green"))
+        return
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=_worker_main,
+            args=(concurrency, prefetch_count),
+            name=f"consumer-request-{idx}",
+        )
+        for idx in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    def forward_stop(signum, _frame) -> None:
+        click.echo(f"\nStopping {workers} worker(s), draining jobs ...")
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, forward_stop)
+    signal.signal(signal.SIGINT, forward_stop)
+    for process in processes:
+        process.join()
+
+    click.echo(click.style("\nDone!", fg="green"))
+
+
+if __name__ == "__main__":
+    main()
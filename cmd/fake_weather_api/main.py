@@ -0,0 +1,117 @@
+"""script for serve a fake weather api, for load and latency tests"""
+
+from datetime import datetime
+
+import click
+from aiohttp import web
+
+import sys
+from pathlib import Path
+
+# type: ignore
+sys.path.append(str(Path(Path(__file__).parent, "..", "..").absolute()))
+
+from internal.fake_weather_api import GROUP_PATH, WEATHER_PATH, FakeWeatherApi
+from internal.settings import RATE_LIMIT_PERIODS
+
+
+@click.command("fake-weather-api")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8080, show_default=True, type=int)
+@click.option(
+    "--latency",
+    default=0.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="median latency in milliseconds",
+)
+@click.option(
+    "--latency-sigma",
+    default=0.5,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="log-normal latency spread, 0 for fixed latency",
+)
+@click.option(
+    "--error-rate",
+    default=0.0,
+    show_default=True,
+    type=click.FloatRange(0, 1),
+    help="share of requests answered with 500",
+)
+@click.option(
+    "--throttle-rate",
+    default=0.0,
+    show_default=True,
+    type=click.FloatRange(0, 1),
+    help="share of requests answered with 429",
+)
+@click.option(
+    "--rate-limit",
+    default=None,
+    help='enforced quota, as "60/minute" [default: no limit]',
+)
+@click.option("--burst", default=1, show_default=True, type=click.IntRange(1))
+@click.option(
+    "--retry-after",
+    default=1,
+    show_default=True,
+    type=click.IntRange(0),
+    help="Retry-After seconds of random 429s",
+)
+@click.option("--token", default=None, help="required appid [default: any]")
+@click.option("--seed", default=None, type=int, help="random seed")
+def main(
+    host: str,
+    port: int,
+    latency: float,
+    latency_sigma: float,
+    error_rate: float,
+    throttle_rate: float,
+    rate_limit: str | None,
+    burst: int,
+    retry_after: int,
+    token: str | None,
+    seed: int | None,
+) -> None:
+    """serve weather api stand-in with latency, errors and rate limit"""
+
+    rate = 0.0
+    if rate_limit is not None:
+        try:
+            amount, period = rate_limit.split("/")
+            rate = float(amount) / RATE_LIMIT_PERIODS[period]
+        except (KeyError, ValueError):
+            raise click.BadParameter(rate_limit, param_hint="--rate-limit")
+
+    api = FakeWeatherApi(
+        latency / 1000,
+        latency_sigma,
+        error_rate,
+        throttle_rate,
+        rate,
+        burst,
+        retry_after,
+        token,
+        seed,
+    )
+
+    click.echo(
+        f'{click.style("Running", fg="green")} fake-weather-api', nl=False
+    )
+    date = click.style(
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"), fg="yellow"
+    )
+    click.echo(f' {click.style("at", fg="green")} "{date}" ...')
+    click.echo(f"WEATHER_API_ENDPOINT=http://{host}:{port}{WEATHER_PATH}")
+    click.echo(f"WEATHER_API_GROUP_ENDPOINT=http://{host}:{port}{GROUP_PATH}")
+    web.run_app(api.build_app(), host=host, port=port, print=None)
+    click.echo(
+        f"fake weather api: {api.requests} requests,"
+        f" {api.errors} errors, {api.throttled} throttled"
+    )
+    click.echo(click.style("\nDone!", fg="green"))
+
+
+if __name__ == "__main__":
+    main()
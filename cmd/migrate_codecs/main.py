@@ -0,0 +1,33 @@
+"""script for rewrite stored registries with their model codec"""
+
+import asyncio
+from datetime import datetime
+
+import click
+
+import sys
+from pathlib import Path
+
+# type: ignore
+sys.path.append(str(Path(Path(__file__).parent, "..", "..").absolute()))
+
+from internal.database.repositories import migrate_codecs
+
+
+@click.command("migrate-codecs")
+def main() -> None:
+    """rewrite every stored registry using codec declared by its model"""
+
+    click.echo(
+        f'{click.style("Running", fg="green")} migrate-codecs', nl=False
+    )
+    date = click.style(
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"), fg="yellow"
+    )
+    click.echo(f' {click.style("at", fg="green")} "{date}" ...')
+    asyncio.run(migrate_codecs())
+    click.echo(click.style("\nDone!", fg="green"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""script for rebuild database secondary indexes"""
+
+import asyncio
+from datetime import datetime
+
+import click
+
+import sys
+from pathlib import Path
+
+# type: ignore
+sys.path.append(str(Path(Path(__file__).parent, "..", "..").absolute()))
+
+from internal.database.repositories import rebuild_indexes
+
+
+@click.command("rebuild-indexes")
+def main() -> None:
+    """rebuild secondary field indexes from already stored registries"""
+
+    click.echo(
+        f'{click.style("Running", fg="green")} rebuild-indexes', nl=False
+    )
+    date = click.style(
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"), fg="yellow"
+    )
+    click.echo(f' {click.style("at", fg="green")} "{date}" ...')
+    asyncio.run(rebuild_indexes())
+    click.echo(click.style("\nDone!", fg="green"))
+
+
+if __name__ == "__main__":
+    main()
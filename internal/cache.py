@@ -0,0 +1,112 @@
+"""
+Cache module - in-process caches shared by api and consumer.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LruTtlCache:
+    """
+    **LruTtlCache**: bounded in-process LRU cache with per entry TTL and\
+        hit/miss/eviction counters.
+
+    :param max_size: max entries kept, 0 disables storage. (default 1024)
+    :param ttl: seconds each entry stays valid. (default 1s)
+    :param max_bytes: max sum of entries sizes, 0 is unbounded. (default 0)
+    """
+
+    def __init__(
+        self, max_size: int = 1024, ttl: float = 1.0, max_bytes: int = 0
+    ) -> None:
+        self.max_size = max(max_size, 0)
+        self.ttl = ttl
+        self.max_bytes = max(max_bytes, 0)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any, int]] = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get valid entry value, refreshing its LRU position"""
+        if (entry := self._data.get(key)) is None:
+            self.misses += 1
+            return default
+
+        expires_at, value, _ = entry
+        if expires_at < time.monotonic():
+            self._pop(key)
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        size: int = 0,
+        ttl: float | None = None,
+    ) -> None:
+        """
+        Store entry of size bytes, evicting least recently used ones when\
+            full. A given ttl can only shorten the cache ttl.
+        """
+        if self.max_size == 0:
+            return
+
+        if ttl is not None:
+            ttl = min(ttl, self.ttl)
+            if ttl <= 0:
+                return
+
+        self._pop(key)
+        self._data[key] = (
+            time.monotonic() + (self.ttl if ttl is None else ttl),
+            value,
+            size,
+        )
+        self.bytes += size
+        while len(self._data) > self.max_size or (
+            self.max_bytes and self.bytes > self.max_bytes
+        ):
+            self._pop(next(iter(self._data)))
+            self.evictions += 1
+
+    def invalidate(self, *keys: Hashable) -> None:
+        """Drop entries by key"""
+        for key in keys:
+            self._pop(key)
+
+    def clear(self) -> None:
+        """Drop all entries"""
+        self._data.clear()
+        self.bytes = 0
+
+    def _pop(self, key: Hashable) -> None:
+        if (entry := self._data.pop(key, None)) is not None:
+            self.bytes -= entry[2]
+
+    def stats(self) -> dict[str, int | float]:
+        """Cache usage statistics"""
+        lookups = self.hits + self.misses
+
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
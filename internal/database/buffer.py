@@ -0,0 +1,148 @@
+"""
+Buffer module - write-behind coalescing of database writes.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from internal.database.manager import AsyncDbManager, M
+from internal.models import Base
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    **WriteBehindBuffer**: collects registries inserts and counters\
+        increments and flushes them as one pipeline when size limit or\
+        deadline is reached.
+
+    usage:
+    ```python
+
+    async with WriteBehindBuffer(manager) as buffer:
+        await buffer.insert(UserCityData.build_from(user.index, payload))
+        await buffer.increment(User, user.index, "processed")
+    ```
+
+    :param manager: database manager used to flush writes.
+    :param max_size: pending registries that force a flush. (default 50)
+    :param max_delay: max seconds a write waits for flush. (default 100ms)
+    :param on_flush: async callback receiving counters values after flush.
+    """
+
+    def __init__(
+        self,
+        manager: AsyncDbManager,
+        max_size: int = 50,
+        max_delay: float = 0.1,
+        on_flush: (
+            Callable[[dict[str, dict[str, int]]], Awaitable[None]] | None
+        ) = None,
+    ) -> None:
+        self.manager = manager
+        self.max_size = max(max_size, 1)
+        self.max_delay = max_delay
+        self.on_flush = on_flush
+        self._registries: list[Base] = []
+        self._increments: dict[str, dict[str, int]] = {}
+        self._timer: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._registries) + sum(
+            len(fields) for fields in self._increments.values()
+        )
+
+    async def insert(self, registry: Base) -> None:
+        """Queue new registry to be inserted"""
+
+        self._registries.append(registry)
+        await self._on_write()
+
+    async def increment(
+        self, model: M, idx: int, field_name: str, amount: int = 1
+    ) -> None:
+        """Queue registry counter increment, coalesced with pending ones"""
+
+        fields = self._increments.setdefault(
+            self.manager._registry_index_factory(model, idx), {}
+        )
+        fields[field_name] = fields.get(field_name, 0) + amount
+        await self._on_write()
+
+    async def flush(self) -> dict[str, dict[str, int]]:
+        """
+        Write all pending data in one pipeline, kept pending when it fails.
+        Return counters values after increments.
+        """
+
+        async with self._lock:
+            self._cancel_timer()
+            registries, self._registries = self._registries, []
+            increments, self._increments = self._increments, {}
+
+            try:
+                counters = await self.manager.write_batch(
+                    registries, increments
+                )
+            except BaseException:
+                self._restore(registries, increments)
+                raise
+
+            if counters and self.on_flush is not None:
+                await self.on_flush(counters)
+
+            return counters
+
+    async def close(self) -> None:
+        """Flush pending writes, must be called on job end or shutdown"""
+
+        await self.flush()
+
+    async def __aenter__(self) -> "WriteBehindBuffer":
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    async def _on_write(self) -> None:
+        if len(self._registries) >= self.max_size:
+            await self.flush()
+            return
+
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+            self._timer.add_done_callback(self._flushed_later)
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.max_delay)
+        await self.flush()
+
+    def _flushed_later(self, task: asyncio.Task) -> None:
+        # writes stay pending, next flush or close retries them
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(
+                "Deadline flush failed, retrying on next flush",
+                exc_info=task.exception(),
+            )
+
+    def _restore(
+        self, registries: list[Base], increments: dict[str, dict[str, int]]
+    ) -> None:
+        """Put back writes of a failed flush before newer ones"""
+        self._registries[:0] = registries
+        for key, fields in increments.items():
+            pending = self._increments.setdefault(key, {})
+            for field_name, amount in fields.items():
+                pending[field_name] = pending.get(field_name, 0) + amount
+
+    def _cancel_timer(self) -> None:
+        if (
+            self._timer is not None
+            and self._timer is not asyncio.current_task()
+        ):
+            self._timer.cancel()
+
+        self._timer = None
@@ -0,0 +1,52 @@
+"""
+Cache module - registries read-through cache for database manager.
+"""
+
+from redis import asyncio as async_redis
+
+from internal.cache import LruTtlCache
+from internal.settings import ApiSettingsDI
+from internal.utils import build_singleton
+
+INVALIDATION_CHANNEL = "registry:invalidate"
+
+
+class RegistryCache(LruTtlCache):
+    """
+    **RegistryCache**: in-process registries cache. Writes made by any\
+        worker are published in redis channel, so every worker listening\
+        it drops stale entries.
+
+    :param max_size: max entries kept, 0 only publish invalidations.
+    :param ttl: seconds each entry stays valid.
+    :param channel: redis pub/sub channel used for invalidations.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl: float = 1.0,
+        channel: str = INVALIDATION_CHANNEL,
+    ) -> None:
+        super().__init__(max_size, ttl)
+        self.channel = channel
+
+    async def listen(self, redis: async_redis.Redis) -> None:
+        """Invalidate entries published by other workers, runs forever"""
+
+        async with redis.pubsub() as pubsub:
+            await pubsub.subscribe(self.channel)
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+
+                self.invalidate(*message["data"].decode().split())
+
+
+@build_singleton
+def _registry_cache_di_factory(settings: ApiSettingsDI) -> RegistryCache:
+    return RegistryCache(
+        settings.registry_cache_size,
+        settings.registry_cache_ttl,
+        settings.registry_cache_channel,
+    )
@@ -0,0 +1,227 @@
+"""
+Codecs module - how registries and cached payloads are stored in redis.
+
+Registries are always redis hashes: the "hash" codec keeps one hash field\
+    per model field (required by counters updated with HINCRBY), blob codecs\
+    keep the whole registry in a single field tagged with codec name.
+"""
+
+import json
+import struct
+import zlib
+from typing import Any
+
+CODEC_FIELD = "_codec"
+BLOB_FIELD = "_blob"
+INT_FORMATS = (
+    (b"b", "<b", 2**7),
+    (b"h", "<h", 2**15),
+    (b"i", "<i", 2**31),
+    (b"q", "<q", 2**63),
+)
+
+
+class RegistryCodec:
+    """Store registry as plain hash and payloads as json text"""
+
+    name = "hash"
+    tag = b""
+
+    def encode(self, data: dict[str, Any]) -> dict[str, Any]:
+        """Encode registry fields into redis hash mapping"""
+
+        return {key: value for key, value in data.items() if value is not None}
+
+    def decode(self, raw: dict[bytes, bytes]) -> dict[str, Any]:
+        """Decode redis hash into registry fields"""
+
+        return {key.decode(): value.decode() for key, value in raw.items()}
+
+    def dumps(self, payload: Any) -> bytes:
+        """Encode payload into bytes"""
+
+        return json.dumps(payload, separators=(",", ":")).encode()
+
+    def loads(self, data: bytes) -> Any:
+        """Decode payload bytes"""
+
+        return json.loads(data)
+
+
+class BlobRegistryCodec(RegistryCodec):
+    """Store whole registry in a single tagged hash field"""
+
+    def encode(self, data: dict[str, Any]) -> dict[str, Any]:
+        return {
+            CODEC_FIELD: self.name,
+            BLOB_FIELD: self.dumps(super().encode(data)),
+        }
+
+    def decode(self, raw: dict[bytes, bytes]) -> dict[str, Any]:
+        return self.loads(raw[BLOB_FIELD.encode()])
+
+
+class ZlibJsonCodec(BlobRegistryCodec):
+    """zlib compressed compact json"""
+
+    name = "zlib"
+    tag = b"\x78"  # zlib stream header
+
+    def dumps(self, payload: Any) -> bytes:
+        return zlib.compress(super().dumps(payload))
+
+    def loads(self, data: bytes) -> Any:
+        return super().loads(zlib.decompress(data))
+
+
+class PackedCodec(BlobRegistryCodec):
+    """
+    Tagged binary packing of json-like values (None, bool, int, float, str,\
+        list and dict with str keys).
+    """
+
+    name = "packed"
+    tag = b"\x01"
+
+    def dumps(self, payload: Any) -> bytes:
+        chunks = [self.tag]
+        self._pack(payload, chunks)
+
+        return b"".join(chunks)
+
+    def loads(self, data: bytes) -> Any:
+        value, _ = self._unpack(memoryview(data), 1)
+
+        return value
+
+    def _pack(self, value: Any, chunks: list[bytes]) -> None:
+        if value is None:
+            chunks.append(b"N")
+        elif value is True or value is False:
+            chunks.append(b"T" if value else b"F")
+        elif isinstance(value, int) and -(2**63) <= value < 2**63:
+            for kind, fmt, limit in INT_FORMATS:
+                if -limit <= value < limit:
+                    chunks.append(kind + struct.pack(fmt, value))
+                    break
+        elif isinstance(value, int):
+            # arbitrary precision, signed little endian bytes
+            encoded = value.to_bytes(
+                value.bit_length() // 8 + 1, "little", signed=True
+            )
+            chunks.append(b"n")
+            self._pack_size(len(encoded), chunks)
+            chunks.append(encoded)
+        elif isinstance(value, float):
+            chunks.append(b"d" + struct.pack("<d", value))
+        elif isinstance(value, (list, tuple)):
+            chunks.append(b"l")
+            self._pack_size(len(value), chunks)
+            for item in value:
+                self._pack(item, chunks)
+        elif isinstance(value, dict):
+            chunks.append(b"m")
+            self._pack_size(len(value), chunks)
+            for key, item in value.items():
+                self._pack_str(str(key), chunks)
+                self._pack(item, chunks)
+        else:
+            chunks.append(b"s")
+            self._pack_str(str(value), chunks)
+
+    def _pack_str(self, value: str, chunks: list[bytes]) -> None:
+        encoded = value.encode()
+        self._pack_size(len(encoded), chunks)
+        chunks.append(encoded)
+
+    def _pack_size(self, size: int, chunks: list[bytes]) -> None:
+        if size < 0xFF:
+            chunks.append(bytes((size,)))
+            return
+
+        chunks.append(b"\xff" + struct.pack("<I", size))
+
+    def _unpack(self, data: memoryview, pos: int) -> tuple[Any, int]:
+        kind, pos = data[pos : pos + 1].tobytes(), pos + 1
+        match kind:
+            case b"N":
+                return None, pos
+            case b"T" | b"F":
+                return kind == b"T", pos
+            case b"b" | b"h" | b"i" | b"q":
+                fmt = "<" + kind.decode()
+                return (
+                    struct.unpack_from(fmt, data, pos)[0],
+                    pos + struct.calcsize(fmt),
+                )
+            case b"n":
+                size, pos = self._unpack_size(data, pos)
+                return (
+                    int.from_bytes(
+                        data[pos : pos + size], "little", signed=True
+                    ),
+                    pos + size,
+                )
+            case b"d":
+                return struct.unpack_from("<d", data, pos)[0], pos + 8
+            case b"s":
+                return self._unpack_str(data, pos)
+            case b"l":
+                size, pos = self._unpack_size(data, pos)
+                result = []
+                for _ in range(size):
+                    item, pos = self._unpack(data, pos)
+                    result.append(item)
+
+                return result, pos
+            case b"m":
+                size, pos = self._unpack_size(data, pos)
+                result = {}
+                for _ in range(size):
+                    key, pos = self._unpack_str(data, pos)
+                    result[key], pos = self._unpack(data, pos)
+
+                return result, pos
+
+        raise ValueError(f"Invalid packed data type {kind!r}")
+
+    def _unpack_str(self, data: memoryview, pos: int) -> tuple[str, int]:
+        size, pos = self._unpack_size(data, pos)
+
+        return bytes(data[pos : pos + size]).decode(), pos + size
+
+    def _unpack_size(self, data: memoryview, pos: int) -> tuple[int, int]:
+        if (size := data[pos]) < 0xFF:
+            return size, pos + 1
+
+        return struct.unpack_from("<I", data, pos + 1)[0], pos + 5
+
+
+CODECS: dict[str, RegistryCodec] = {
+    codec.name: codec
+    for codec in (RegistryCodec(), PackedCodec(), ZlibJsonCodec())
+}
+
+
+def get_codec(name: str) -> RegistryCodec:
+    """Get codec by name"""
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec {name!r}, use one of {list(CODECS)}")
+
+    return CODECS[name]
+
+
+def decode_registry(raw: dict[bytes, bytes]) -> dict[str, Any]:
+    """Decode stored registry whatever codec was used to store it"""
+    codec = raw.get(CODEC_FIELD.encode(), b"hash").decode()
+
+    return get_codec(codec).decode(raw)
+
+
+def loads_payload(data: bytes) -> Any:
+    """Decode payload bytes whatever codec was used to encode it"""
+    for codec in CODECS.values():
+        if codec.tag and data.startswith(codec.tag):
+            return codec.loads(data)
+
+    return CODECS["hash"].loads(data)
@@ -2,22 +2,127 @@
 Manager module - manage all app async operations.
 """
 
+from contextlib import aclosing
 from typing import Annotated, TypeVar, Self
 
 from fastapi import Depends, HTTPException
 from redis import asyncio as async_redis
-
+from redis.exceptions import WatchError
+
+from internal.database.codecs import (
+    CODEC_FIELD,
+    decode_registry,
+    get_codec,
+)
+from internal.database.cache import (
+    RegistryCache,
+    _registry_cache_di_factory,
+)
+from internal.database.pubsub import PubSubHub
 from internal.models import Base, User
 from internal.utils import build_singleton, chunk_stream
-from internal.settings import ApiSettingsDI
+from internal.settings import ApiSettings, ApiSettingsDI
 
 TABLE_DATA_ITEM_TOTAL_KEY = "item_total"
+FIELD_INDEX_KEY_PREFIX = "field_index"
+DELETE_IF_EQUAL_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
 
 M = TypeVar("M", Base, User)
 
 
+class CountingConnectionPool(async_redis.BlockingConnectionPool):
+    """
+    **CountingConnectionPool**: blocking connection pool that counts\
+        connections handed out, so stats don't rely on redis-py internals.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.handed_out: set[int] = set()
+
+    @property
+    def in_use(self) -> int:
+        return len(self.handed_out)
+
+    async def get_connection(self, command_name, *keys, **options):
+        connection = await super().get_connection(
+            command_name, *keys, **options
+        )
+        self.handed_out.add(id(connection))
+
+        return connection
+
+    async def release(self, connection) -> None:
+        # redis-py also releases connections failing their checkout, which
+        # were never handed out
+        self.handed_out.discard(id(connection))
+        await super().release(connection)
+
+
+@build_singleton
+class RedisPool:
+    """
+    Process wide redis connection pool, every client built by\
+        _redis_di_factory shares it. Opened and closed by app lifespan.
+    """
+
+    def __init__(self, settings: ApiSettings) -> None:
+        self.settings = settings
+        self.pool: CountingConnectionPool | None = None
+
+    def open(self) -> CountingConnectionPool:
+        """Create connection pool if not created yet"""
+        if self.pool is not None:
+            return self.pool
+
+        self.pool = CountingConnectionPool.from_url(
+            self.settings.redis_dsn,
+            max_connections=self.settings.redis_max_connections,
+            timeout=self.settings.redis_socket_timeout,
+            socket_timeout=self.settings.redis_socket_timeout,
+            socket_connect_timeout=self.settings.redis_socket_connect_timeout,
+            health_check_interval=self.settings.redis_health_check_interval,
+        )
+
+        return self.pool
+
+    def client(self) -> async_redis.Redis:
+        """Build redis client over shared connection pool"""
+
+        return async_redis.Redis(connection_pool=self.open())
+
+    async def close(self) -> None:
+        """Disconnect all pool connections"""
+        if self.pool is None:
+            return
+
+        await self.pool.aclose()
+        self.pool = None
+
+    def stats(self) -> dict[str, int]:
+        """Pool usage statistics"""
+        if self.pool is None:
+            return {"max_connections": 0, "in_use": 0, "available": 0}
+
+        return {
+            "max_connections": self.pool.max_connections,
+            "in_use": self.pool.in_use,
+            "available": self.pool.max_connections - self.pool.in_use,
+        }
+
+
 def _redis_di_factory(settings: ApiSettingsDI) -> async_redis.Redis:
-    return async_redis.from_url(settings.redis_dsn)
+    return RedisPool(settings).client()
+
+
+@build_singleton
+def _pubsub_hub_di_factory(settings: ApiSettingsDI) -> PubSubHub:
+    return PubSubHub(RedisPool(settings).client())
 
 
 @build_singleton
@@ -25,56 +130,473 @@ class AsyncDbManager:
     """Assincronous database manage - Deal with all assincronous database operation"""
 
     def __init__(
-        self, redis: Annotated[async_redis.Redis, Depends(_redis_di_factory)]
+        self,
+        redis: Annotated[async_redis.Redis, Depends(_redis_di_factory)],
+        cache: Annotated[
+            RegistryCache | None, Depends(_registry_cache_di_factory)
+        ] = None,
+        hub: Annotated[
+            PubSubHub | None, Depends(_pubsub_hub_di_factory)
+        ] = None,
     ) -> None:
         self.redis = redis
+        self.cache = cache
+        self.hub = hub
 
     async def insert_registry(self, registry: Base) -> None:
         """Method insert_registry - create object in database"""
         registry.index = await self._pipeline_create_resgistry_index(registry)
         await self._pipeline_set_resgistry_fields(registry)
+        await self._pipeline_update_field_indexes(registry)
+        await self._invalidate(f"table_data:{registry.table_name()}")
+
+    async def insert_many(self, registries: list[Base]) -> None:
+        """
+        Method insert_many - create many objects in database, reserving one\
+            contiguous index block per model and writing every registry in\
+            a single transaction
+        """
+        await self.write_batch(registries)
+
+    async def write_batch(
+        self,
+        registries: list[Base],
+        increments: dict[str, dict[str, int]] | None = None,
+    ) -> dict[str, dict[str, int]]:
+        """
+        Method write_batch - insert registries and apply counters increments\
+            (registry key -> field -> amount) in a single transaction.
+        Return counters values after increments.
+        """
+        increments = increments or {}
+        if len(registries) == 0 and len(increments) == 0:
+            return {}
+
+        changed_keys = await self._reserve_indexes(registries)
+        changed_keys.extend(increments)
+        async with self.redis.pipeline() as pipe:
+            self._queue_batch(pipe, registries, increments, changed_keys)
+            results = await pipe.execute()
+
+        if self.cache is not None:
+            self.cache.invalidate(*changed_keys)
+
+        return self._batch_counters(results, increments)
+
+    async def write_batch_once(
+        self,
+        key: str,
+        member: str,
+        ttl: int,
+        registries: list[Base],
+        increments: dict[str, dict[str, int]] | None = None,
+    ) -> tuple[bool, set[str], dict[str, dict[str, int]]]:
+        """
+        Method write_batch_once - write_batch guarded by a set member: the\
+            batch is written and member added to set (expiring in ttl\
+            seconds) in a single transaction, nothing is written when member\
+            was already added.
+        Return if batch was written, all set members and counters values\
+            after increments.
+        """
+        increments = increments or {}
+        changed_keys = await self._reserve_indexes(registries)
+        changed_keys.extend(increments)
+        async with self.redis.pipeline() as pipe:
+            await pipe.watch(key)
+            if await pipe.sismember(key, member):
+                members = await pipe.smembers(key)
+                return False, {item.decode() for item in members}, {}
+
+            pipe.multi()
+            pipe.sadd(key, member)
+            pipe.expire(key, ttl)
+            pipe.smembers(key)
+            self._queue_batch(pipe, registries, increments, changed_keys)
+            try:
+                _, _, members, *results = await pipe.execute()
+            except WatchError:
+                # member added meanwhile, by another delivery of the batch
+                members = await self.redis.smembers(key)
+                return False, {item.decode() for item in members}, {}
+
+        if self.cache is not None:
+            self.cache.invalidate(*changed_keys)
+
+        return (
+            True,
+            {item.decode() for item in members},
+            self._batch_counters(results, increments),
+        )
+
+    async def _reserve_indexes(self, registries: list[Base]) -> list[str]:
+        """
+        Set registries indexes, one contiguous block per model.
+        Return table data keys changed.
+        """
+        tables: dict[str, list[Base]] = {}
+        for registry in registries:
+            tables.setdefault(registry.table_name(), []).append(registry)
+
+        for table_name, group in tables.items():
+            last_index = await self.redis.hincrby(
+                f"table_data:{table_name}",
+                TABLE_DATA_ITEM_TOTAL_KEY,
+                len(group),
+            )
+            for offset, registry in enumerate(group, 1):
+                registry.index = int(last_index) - len(group) + offset
+
+        return [f"table_data:{table}" for table in tables]
+
+    def _queue_batch(
+        self,
+        pipe,
+        registries: list[Base],
+        increments: dict[str, dict[str, int]],
+        changed_keys: list[str],
+    ) -> None:
+        """queue registries, invalidation and counters increments"""
+        for registry in registries:
+            self._queue_registry_write(pipe, registry)
+
+        if self.cache is not None:
+            pipe.publish(self.cache.channel, " ".join(changed_keys))
+
+        for key, fields in increments.items():
+            for field_name, amount in fields.items():
+                pipe.hincrby(key, field_name, amount)
+
+    def _batch_counters(
+        self, results: list, increments: dict[str, dict[str, int]]
+    ) -> dict[str, dict[str, int]]:
+        """counters results are the last ones queued by _queue_batch"""
+        total_counters = sum(len(fields) for fields in increments.values())
+        counters = iter(results[len(results) - total_counters :])
+
+        return {
+            key: {field_name: int(next(counters)) for field_name in fields}
+            for key, fields in increments.items()
+        }
+
+    async def increment_field(
+        self, model: M, idx: int, field_name: str, amount: int = 1
+    ) -> int:
+        """Atomically increment registry integer field, return new value"""
+        if model.storage_codec != "hash":
+            raise HTTPException(400)
+
+        key = self._registry_index_factory(model, idx)
+        if self.cache is None:
+            return int(await self.redis.hincrby(key, field_name, amount))
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hincrby(key, field_name, amount)
+            pipe.publish(self.cache.channel, key)
+            value, _ = await pipe.execute()
+
+        self.cache.invalidate(key)
+
+        return int(value)
+
+    async def set_fields(self, model: M, idx: int, **fields) -> None:
+        """
+        Set only given registry fields, fields set to None are removed.
+        Only for models stored with hash codec.
+        """
+        if model.storage_codec != "hash":
+            raise HTTPException(400)
+
+        key = self._registry_index_factory(model, idx)
+        mapping = {k: v for k, v in fields.items() if v is not None}
+        removed = [k for k, v in fields.items() if v is None]
+        async with self.redis.pipeline() as pipe:
+            if mapping:
+                pipe.hset(key, mapping=mapping)
+
+            if removed:
+                pipe.hdel(key, *removed)
+
+            await pipe.execute()
+
+        await self._invalidate(key)
 
     async def update_registry(self, registry: Base) -> None:
         """Method update_registry - save object data in datababase"""
         if registry.index is None:
             raise HTTPException(400)
 
+        previous = await self._fetch_indexed_values(registry)
         await self._pipeline_set_resgistry_fields(registry)
+        await self._pipeline_update_field_indexes(registry, previous)
+        await self._invalidate(registry.db_index())
 
     async def find_registry(self, model_class: M, idx: int) -> M:
         """
         Method find_registry - get item object from database
         """
-        result = await self._fetch_registry_by_key(
-            f"{model_class.table_name()}_{idx}"
-        )
+        key = f"{model_class.table_name()}_{idx}"
+        if self.cache is not None and (result := self.cache.get(key)):
+            return model_class(**result)
+
+        result = await self._fetch_registry_by_key(key)
+        if self.cache is not None:
+            self.cache.set(key, result)
 
         return model_class(**result)
 
+    async def find_registry_with_total(
+        self, model_class: M, idx: int, total_model: M
+    ) -> tuple[M, int]:
+        """
+        Method find_registry_with_total - get item object and total of\
+            registries from another model in one round trip
+        """
+        key = f"{model_class.table_name()}_{idx}"
+        total_key = f"table_data:{total_model.table_name()}"
+        if self.cache is not None:
+            result, total = self.cache.get(key), self.cache.get(total_key)
+            if result and total is not None:
+                return model_class(**result), total
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(key)
+            pipe.hget(total_key, TABLE_DATA_ITEM_TOTAL_KEY)
+            stored, total = await pipe.execute()
+
+        if not stored:
+            raise HTTPException(404)
+
+        result, total = decode_registry(stored), int(total or 0)
+        if self.cache is not None:
+            self.cache.set(key, result)
+            self.cache.set(total_key, total)
+
+        return model_class(**result), total
+
+    async def publish(self, channel: str, message: str) -> None:
+        """Publish message in redis channel"""
+
+        await self.redis.publish(channel, message)
+
+    async def subscribe(self, channel: str, timeout: float = 15.0):
+        """
+        Async generator of messages published in channel, yield None when\
+            nothing arrives in timeout seconds (useful for heartbeats).
+        Subscribers share the pub/sub connection of hub when given.
+        """
+        if self.hub is not None:
+            async with aclosing(
+                self.hub.subscribe(channel, timeout)
+            ) as stream:
+                async for message in stream:
+                    yield message
+
+            return
+
+        async with self.redis.pubsub() as pubsub:
+            await pubsub.subscribe(channel)
+            while True:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=timeout
+                )
+                yield None if message is None else message["data"].decode()
+
+    async def set_many_if_absent(
+        self, values: dict[str, str], ttl: int
+    ) -> dict[str, tuple[bool, str]]:
+        """
+        Set keys not set yet expiring in ttl seconds, in one transaction.
+        Return for each key if it was set and its current value.
+        """
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for key, value in values.items():
+                pipe.set(key, value, nx=True, ex=ttl)
+                pipe.get(key)
+
+            result = await pipe.execute()
+
+        return {
+            key: (bool(result[2 * pos]), result[2 * pos + 1].decode())
+            for pos, key in enumerate(values)
+        }
+
+    async def get_value(self, key: str) -> str | None:
+        """Get plain key value"""
+        value = await self.redis.get(key)
+
+        return None if value is None else value.decode()
+
+    async def delete_if_equal(self, key: str, value: str) -> bool:
+        """Atomically delete key only if it still holds value"""
+
+        return bool(
+            await self.redis.eval(DELETE_IF_EQUAL_SCRIPT, 1, key, value)
+        )
+
+    async def is_set_member(self, key: str, member: str) -> bool:
+        """Check if member was added to set"""
+
+        return bool(await self.redis.sismember(key, member))
+
+    async def increment_counters(self, key: str, **amounts: int) -> None:
+        """Increment many counters of a statistics hash"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for field, amount in amounts.items():
+                pipe.hincrby(key, field, amount)
+
+            await pipe.execute()
+
+    async def get_counters(self, key: str) -> dict[str, int]:
+        """Get all counters of a statistics hash"""
+
+        return {
+            field.decode(): int(value)
+            for field, value in (await self.redis.hgetall(key)).items()
+        }
+
+    async def _invalidate(self, *keys: str) -> None:
+        """Drop keys from local cache and publish them to other workers"""
+        if self.cache is None or len(keys) == 0:
+            return
+
+        self.cache.invalidate(*keys)
+        await self.redis.publish(self.cache.channel, " ".join(keys))
+
+    async def find_registries(self, model_class: M, *indexes: int) -> list[M]:
+        """
+        Method find_registries - get many item objects in one pipeline.
+        Missing registries are skipped.
+        """
+        if len(indexes) == 0:
+            return []
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for idx in indexes:
+                pipe.hgetall(self._registry_index_factory(model_class, idx))
+
+            results = await pipe.execute()
+
+        return [
+            model_class(**decode_registry(result))
+            for result in results
+            if result
+        ]
+
     async def _fetch_registry_by_key(self, key: str) -> dict[str, str]:
         """Fetch set by key given"""
         if not (result := await self.redis.hgetall(key)):
             raise HTTPException(404)
 
-        return {k.decode(): v.decode() for k, v in result.items()}
+        return decode_registry(result)
 
     async def _pipeline_set_resgistry_fields(self, registry: Base) -> None:
         """
         Method _pipeline_set_resgistry_fields - save entity registry data to redis
         """
         reg_index = registry.db_index()
-        reg_dict = registry.model_dump()
+        reg_dict = registry.storage_dump()
         async with self.redis.pipeline() as pipe:
             await pipe.watch(reg_index)
 
-            for key, value in reg_dict.items():
-                if value is None:
-                    continue
+            if registry.storage_codec != "hash":
+                codec = get_codec(registry.storage_codec)
+                await pipe.hset(reg_index, mapping=codec.encode(reg_dict))
+            else:
+                for key, value in reg_dict.items():
+                    if value is None:
+                        continue
 
-                await pipe.hset(reg_index, key, value)
+                    await pipe.hset(reg_index, key, value)
 
             await pipe.unwatch()
 
+    def _queue_registry_write(self, pipe, registry: Base) -> None:
+        """queue new registry fields and its field indexes in pipeline"""
+        reg_index = registry.db_index()
+        codec = get_codec(registry.storage_codec)
+        pipe.hset(reg_index, mapping=codec.encode(registry.storage_dump()))
+        for field in registry.indexed_fields:
+            if (value := getattr(registry, field)) is None:
+                continue
+
+            pipe.zadd(
+                self._field_index_key(registry, field, value),
+                {registry.index: registry.index},
+            )
+
+    def _field_index_key(self, model: M, field_name: str, value) -> str:
+        """build secondary index key for model field value"""
+
+        return f"{FIELD_INDEX_KEY_PREFIX}:{model.table_name()}:{field_name}:{value}"
+
+    async def _fetch_indexed_values(self, registry: Base) -> dict[str, str]:
+        """Fetch indexed fields values currently stored for registry"""
+        if not registry.indexed_fields:
+            return {}
+
+        if registry.storage_codec == "hash":
+            stored = await self.redis.hmget(
+                registry.db_index(), *registry.indexed_fields
+            )
+        else:
+            stored = await self.redis.hgetall(registry.db_index())
+
+        return self._indexed_values(registry, stored)
+
+    def _queue_indexed_values_read(self, pipe, model: M, key: str) -> None:
+        """queue read of registry indexed fields values in pipeline"""
+        if model.storage_codec == "hash":
+            pipe.hmget(key, *model.indexed_fields)
+            return
+
+        pipe.hgetall(key)
+
+    def _indexed_values(self, model: M, stored) -> dict[str, str]:
+        """decode indexed fields values read by _queue_indexed_values_read"""
+        if model.storage_codec == "hash":
+            values = [
+                None if value is None else value.decode() for value in stored
+            ]
+        else:
+            data = decode_registry(stored) if stored else {}
+            values = [data.get(field) for field in model.indexed_fields]
+
+        return {
+            field: str(value)
+            for field, value in zip(model.indexed_fields, values)
+            if value is not None
+        }
+
+    async def _pipeline_update_field_indexes(
+        self, registry: Base, previous: dict[str, str] | None = None
+    ) -> None:
+        """
+        Method _pipeline_update_field_indexes - keep secondary indexes of\
+            registry in sync with its fields values
+        """
+        if not registry.indexed_fields:
+            return
+
+        previous = previous or {}
+        current = registry.model_dump(include=set(registry.indexed_fields))
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for field in registry.indexed_fields:
+                old, new = previous.get(field), current.get(field)
+                if old is not None and old != str(new):
+                    pipe.zrem(
+                        self._field_index_key(registry, field, old),
+                        registry.index,
+                    )
+
+                if new is not None:
+                    pipe.zadd(
+                        self._field_index_key(registry, field, new),
+                        {registry.index: registry.index},
+                    )
+
+            await pipe.execute()
+
     async def _pipeline_create_resgistry_index(self, registry: Base) -> int:
         """
         Method _pipeline_create_resgistry_index - Get new key for new item in database
@@ -112,6 +634,7 @@ class AsyncDbManager:
             await self.remove_registries(model, *chunk)
 
         await self.redis.delete(f"table_data:{model.table_name()}")
+        await self._invalidate(f"table_data:{model.table_name()}")
 
     async def remove_registries(self, model: M, *indexes: int) -> None:
         """remove one or more registries by index"""
@@ -122,7 +645,27 @@ class AsyncDbManager:
         if len(FINAL_INDEXES) == 0:
             return
 
-        await self.redis.delete(*FINAL_INDEXES)
+        if not model.indexed_fields:
+            await self.redis.delete(*FINAL_INDEXES)
+            await self._invalidate(*FINAL_INDEXES)
+            return
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in FINAL_INDEXES:
+                self._queue_indexed_values_read(pipe, model, key)
+
+            stored_values = await pipe.execute()
+
+        async with self.redis.pipeline() as pipe:
+            pipe.delete(*FINAL_INDEXES)
+            for idx, stored in zip(indexes, stored_values):
+                values = self._indexed_values(model, stored)
+                for field, value in values.items():
+                    pipe.zrem(self._field_index_key(model, field, value), idx)
+
+            await pipe.execute()
+
+        await self._invalidate(*FINAL_INDEXES)
 
     def _registry_index_factory(self, model: M, index: int) -> str:
         """build index for entities"""
@@ -133,6 +676,21 @@ class AsyncDbManager:
         self, model: M, field_name: str, value: str
     ) -> list[M]:
         """Search all registries by field value from entity"""
+        if field_name in model.indexed_fields:
+            indexes = await self.find_indexes_by_field(
+                model, field_name, value
+            )
+
+            return await self.find_registries(model, *indexes)
+
+        if model.storage_codec != "hash":
+            return [
+                registry
+                async for registry in self.iter_all_by_field(
+                    model, field_name, value
+                )
+            ]
+
         result = []
         async for key in self.redis.scan_iter(f"{model.table_name()}_*"):
             if await self.redis.type(key) != b"hash":
@@ -147,15 +705,194 @@ class AsyncDbManager:
 
         return result
 
-    async def model_total_registries(self, model: M) -> int:
-        """Total quantity of registries from model in db"""
+    async def find_indexes_by_field(
+        self, model: M, field_name: str, value: str
+    ) -> list[int]:
+        """All registries indexes with indexed field value"""
+        if field_name not in model.indexed_fields:
+            raise HTTPException(400)
 
-        return int(
-            await self.redis.hget(
-                f"table_data:{model.table_name()}", TABLE_DATA_ITEM_TOTAL_KEY
-            )
-            or 0
+        indexes = await self.redis.zrange(
+            self._field_index_key(model, field_name, value), 0, -1
+        )
+
+        return [int(idx) for idx in indexes]
+
+    async def page_by_field(
+        self,
+        model: M,
+        field_name: str,
+        value: str,
+        cursor: int = 0,
+        limit: int = 100,
+    ) -> tuple[list[M], int | None]:
+        """
+        Fetch one page of registries by indexed field value, ordered by\
+            index. Return page and next cursor (None on last page).
+        """
+        if field_name not in model.indexed_fields:
+            raise HTTPException(400)
+
+        indexes = await self.redis.zrangebyscore(
+            self._field_index_key(model, field_name, value),
+            f"({cursor}",
+            "+inf",
+            start=0,
+            num=limit,
         )
+        registries = await self.find_registries(model, *map(int, indexes))
+        next_cursor = int(indexes[-1]) if len(indexes) == limit else None
+
+        return registries, next_cursor
+
+    async def iter_all_by_field(
+        self, model: M, field_name: str, value: str, chunk_size: int = 100
+    ):
+        """
+        Async generator version of find_all_by_field, registries are fetched\
+            in pipelined chunks and yielded as they arrive
+        """
+        if field_name in model.indexed_fields:
+            cursor = 0
+            while cursor is not None:
+                registries, cursor = await self.page_by_field(
+                    model, field_name, value, cursor, chunk_size
+                )
+                for registry in registries:
+                    yield registry
+
+            return
+
+        async for keys in self._scan_chunks(
+            f"{model.table_name()}_*", chunk_size
+        ):
+            if model.storage_codec != "hash":
+                for registry in await self.find_registries(
+                    model, *(int(key.rsplit("_", 1)[-1]) for key in keys)
+                ):
+                    if str(getattr(registry, field_name)) == str(value):
+                        yield registry
+
+                continue
+
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.hget(key, field_name)
+
+                values = await pipe.execute()
+
+            matches = [
+                int(key.rsplit("_", 1)[-1])
+                for key, stored in zip(keys, values)
+                if stored == str(value).encode()
+            ]
+            for registry in await self.find_registries(model, *matches):
+                yield registry
+
+    async def rebuild_field_indexes(
+        self, model: M, batch_size: int = 100
+    ) -> int:
+        """
+        Drop and rebuild all secondary indexes from model, scanning stored\
+            registries. Return total of registries indexed.
+        """
+        if not model.indexed_fields:
+            return 0
+
+        async for keys in self._scan_chunks(
+            f"{FIELD_INDEX_KEY_PREFIX}:{model.table_name()}:*", batch_size
+        ):
+            await self.redis.delete(*keys)
+
+        total = 0
+        async for keys in self._scan_chunks(
+            f"{model.table_name()}_*", batch_size
+        ):
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    self._queue_indexed_values_read(pipe, model, key)
+
+                stored_values = await pipe.execute()
+
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, stored in zip(keys, stored_values):
+                    idx = int(key.rsplit("_", 1)[-1])
+                    values = self._indexed_values(model, stored)
+                    for field, value in values.items():
+                        pipe.zadd(
+                            self._field_index_key(model, field, value),
+                            {idx: idx},
+                        )
+
+                await pipe.execute()
+
+            total += len(keys)
+
+        return total
+
+    async def migrate_codec(self, model: M, batch_size: int = 100) -> int:
+        """
+        Rewrite stored registries from model using its declared codec.
+        Return total of registries rewritten.
+        """
+        codec = get_codec(model.storage_codec)
+        total = 0
+        async for keys in self._scan_chunks(
+            f"{model.table_name()}_*", batch_size
+        ):
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.hgetall(key)
+
+                stored_values = await pipe.execute()
+
+            migrated = []
+            async with self.redis.pipeline() as pipe:
+                for key, stored in zip(keys, stored_values):
+                    stored_codec = stored.get(CODEC_FIELD.encode(), b"hash")
+                    if not stored or stored_codec.decode() == codec.name:
+                        continue
+
+                    registry = model(**decode_registry(stored))
+                    pipe.delete(key)
+                    pipe.hset(
+                        key, mapping=codec.encode(registry.storage_dump())
+                    )
+                    migrated.append(key)
+
+                await pipe.execute()
+
+            total += len(migrated)
+            await self._invalidate(*migrated)
+
+        return total
+
+    async def _scan_chunks(self, pattern: str, batch_size: int):
+        """Iterate over keys matching pattern in chunks of decoded keys"""
+        chunk = []
+        async for key in self.redis.scan_iter(pattern, count=batch_size):
+            chunk.append(key.decode())
+            if len(chunk) == batch_size:
+                yield chunk
+                chunk = []
+
+        if len(chunk) > 0:
+            yield chunk
+
+    async def model_total_registries(self, model: M) -> int:
+        """Total quantity of registries from model in db"""
+        key = f"table_data:{model.table_name()}"
+        if (
+            self.cache is not None
+            and (total := self.cache.get(key)) is not None
+        ):
+            return total
+
+        total = int(await self.redis.hget(key, TABLE_DATA_ITEM_TOTAL_KEY) or 0)
+        if self.cache is not None:
+            self.cache.set(key, total)
+
+        return total
 
 
 AsyncDbManagerDI = Annotated[AsyncDbManager, Depends(AsyncDbManager)]
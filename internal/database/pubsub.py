@@ -0,0 +1,121 @@
+"""
+PubSub module - one redis pub/sub connection per worker shared by every\
+    in-process subscriber.
+"""
+
+import asyncio
+import logging
+from contextlib import suppress
+
+from redis import asyncio as async_redis
+from redis.asyncio.client import PubSub
+
+logger = logging.getLogger(__name__)
+
+
+class PubSubHub:
+    """
+    **PubSubHub**: fan out messages of a single redis pub/sub connection to\
+        in-process queues, so open subscribers (SSE streams) never hold\
+        connections of the shared pool. Channels are subscribed while at\
+        least one local subscriber listens them.
+
+    :param redis: async redis client used to open the pub/sub connection.
+    :param queue_size: messages kept per slow subscriber, the oldest are\
+        dropped first. (default 100)
+    """
+
+    def __init__(
+        self, redis: async_redis.Redis, queue_size: int = 100
+    ) -> None:
+        self.redis = redis
+        self.queue_size = queue_size
+        self.subscribers: dict[str, set[asyncio.Queue[str]]] = {}
+        self.pubsub: PubSub | None = None
+        self.reader: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    async def subscribe(self, channel: str, timeout: float = 15.0):
+        """
+        Async generator of messages published in channel, yield None when\
+            nothing arrives in timeout seconds (useful for heartbeats)
+        """
+        queue: asyncio.Queue[str] = asyncio.Queue(self.queue_size)
+        await self._add(channel, queue)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            await self._remove(channel, queue)
+
+    async def close(self) -> None:
+        """Stop reading and release pub/sub connection"""
+        if self.reader is not None:
+            self.reader.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.reader
+
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+
+        self.reader, self.pubsub = None, None
+        self.subscribers.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "channels": len(self.subscribers),
+            "subscribers": sum(map(len, self.subscribers.values())),
+        }
+
+    async def _add(self, channel: str, queue: asyncio.Queue[str]) -> None:
+        async with self._lock:
+            if channel not in self.subscribers:
+                if self.pubsub is None:
+                    self.pubsub = self.redis.pubsub()
+
+                await self.pubsub.subscribe(channel)
+                self.subscribers[channel] = set()
+
+            self.subscribers[channel].add(queue)
+            if self.reader is None:
+                self.reader = asyncio.create_task(self._read())
+
+    async def _remove(self, channel: str, queue: asyncio.Queue[str]) -> None:
+        async with self._lock:
+            queues = self.subscribers.get(channel)
+            if queues is None:
+                return
+
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[channel]
+                if self.pubsub is not None:
+                    await self.pubsub.unsubscribe(channel)
+
+    async def _read(self) -> None:
+        """Dispatch published messages to local subscribers, runs forever"""
+        while True:
+            try:
+                message = await self.pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Failed reading pub/sub message", exc_info=True)
+                await asyncio.sleep(1.0)
+                continue
+
+            if message is None or message["type"] != "message":
+                continue
+
+            data = message["data"].decode()
+            for queue in self.subscribers.get(message["channel"].decode(), ()):
+                if queue.full():
+                    # slow subscriber, keep latest messages
+                    queue.get_nowait()
+
+                queue.put_nowait(data)
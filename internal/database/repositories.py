@@ -1,6 +1,8 @@
 """Module for querie and save data"""
 
 import json
+import uuid
+from contextlib import aclosing
 from datetime import datetime
 from typing import Annotated
 
@@ -8,12 +10,20 @@ import click
 from fastapi import Depends
 
 from internal.settings import _api_settings_builder
+from internal.database.cache import _registry_cache_di_factory
 from internal.database.manager import (
     AsyncDbManagerDI,
     AsyncDbManager,
+    RedisPool,
     _redis_di_factory,
 )
 from internal.models import User, UserCityData, CityInfo, Base
+from internal.utils import chunk_stream
+
+PROGRESS_CHANNEL = "progress:{user_id}"
+USER_JOB_KEY = "user_job:{user_id}"
+USER_JOB_STATS_KEY = "stats:user_jobs"
+USER_JOB_CHUNKS_KEY = "user_job:{user_id}:chunks:{job_id}"
 
 
 class BaseRepository:
@@ -27,6 +37,11 @@ class BaseRepository:
 
         await self.database_manager.insert_registry(registry)
 
+    async def insert_many(self, registries: list[Base]) -> None:
+        """Save many registries in database at once"""
+
+        await self.database_manager.insert_many(registries)
+
     async def update(self, registry: Base) -> None:
         """Update user city data request in database"""
 
@@ -49,6 +64,176 @@ class UserRepository(BaseRepository):
         """Fecth user data"""
         return await self.database_manager.find_registry(User, index)
 
+    async def update_user(self, user: User) -> None:
+        """Save user data"""
+        await self.update(user)
+
+    async def start_processing(self, user: User) -> None:
+        """Reset user request progress before processing it"""
+        user.processed, user.processed_at = 0, None
+        await self.database_manager.set_fields(
+            User, user.index, processed=0, processed_at=None
+        )
+
+    async def finish_processing(self, user: User) -> None:
+        """Mark user request as processed"""
+        user.processed_at = datetime.now().isoformat()
+        await self.database_manager.set_fields(
+            User, user.index, processed_at=user.processed_at
+        )
+
+    async def get_users(self, *indexes: int) -> list[User]:
+        """Fetch many users data at once, missing users are skipped"""
+        return await self.database_manager.find_registries(User, *indexes)
+
+    async def get_user_with_total_cities(self, index: int) -> tuple[User, int]:
+        """Fetch user data and total of cities in one round trip"""
+        return await self.database_manager.find_registry_with_total(
+            User, index, CityInfo
+        )
+
+    async def increment_processed(self, user: User, amount: int = 1) -> int:
+        """Atomically increment user processed cities, return new total"""
+        user.processed = await self.database_manager.increment_field(
+            User, user.index, "processed", amount
+        )
+        await self.notify_progress(user.index, user.processed)
+
+        return user.processed
+
+    async def notify_progress(self, index: int, processed: int) -> None:
+        """Publish user processed cities to progress listeners"""
+        await self.database_manager.publish(
+            PROGRESS_CHANNEL.format(user_id=index), str(processed)
+        )
+
+    async def iter_progress(self, index: int, heartbeat: float = 15.0):
+        """
+        Stream user processed cities published by consumers, yield None\
+            each heartbeat seconds without updates
+        """
+        async with aclosing(
+            self.database_manager.subscribe(
+                PROGRESS_CHANNEL.format(user_id=index), heartbeat
+            )
+        ) as messages:
+            async for message in messages:
+                yield None if message is None else int(message)
+
+    async def acquire_jobs(
+        self, users: list[User], ttl: int
+    ) -> dict[int, tuple[str, bool]]:
+        """
+        Register one in flight job per user, users with a pending or running\
+            job keep it. Return user index to job id and if it is new.
+        """
+        keys = {
+            USER_JOB_KEY.format(user_id=user.index): (
+                user.index,
+                uuid.uuid4().hex,
+            )
+            for user in users
+        }
+        acquired = await self.database_manager.set_many_if_absent(
+            {key: job_id for key, (_, job_id) in keys.items()}, ttl
+        )
+        result = {
+            keys[key][0]: (job_id, is_new)
+            for key, (is_new, job_id) in acquired.items()
+        }
+        duplicated = sum(not is_new for _, is_new in result.values())
+        await self.database_manager.increment_counters(
+            USER_JOB_STATS_KEY,
+            requested=len(result),
+            deduplicated=duplicated,
+        )
+
+        return result
+
+    async def is_current_job(self, index: int, job_id: str) -> bool:
+        """Check if job is still the user in flight job"""
+        current = await self.database_manager.get_value(
+            USER_JOB_KEY.format(user_id=index)
+        )
+
+        return current == job_id
+
+    async def release_job(self, index: int, job_id: str) -> None:
+        """Drop user in flight job, allowing new requests"""
+        await self.database_manager.delete_if_equal(
+            USER_JOB_KEY.format(user_id=index), job_id
+        )
+
+    async def complete_chunk(
+        self,
+        index: int,
+        job_id: str,
+        cities: list[int],
+        total: int,
+        ttl: int,
+        registries: list[UserCityData] | None = None,
+    ) -> bool:
+        """
+        Store a job chunk of cities data and mark it as completed in one\
+            transaction, counting the stored cities as processed. A chunk is\
+            stored once however many times it is delivered.
+        Return if it completed the whole job.
+        """
+        registries = registries or []
+        user_key = self.database_manager._registry_index_factory(User, index)
+        added, chunks, counters = await self.database_manager.write_batch_once(
+            USER_JOB_CHUNKS_KEY.format(user_id=index, job_id=job_id),
+            f"{cities[0]}-{cities[-1]}",
+            ttl,
+            registries,
+            {user_key: {"processed": len(registries)}} if registries else {},
+        )
+        if user_key in counters:
+            await self.notify_progress(index, counters[user_key]["processed"])
+
+        completed = sum(
+            int(stop) - int(start) + 1
+            for start, stop in (chunk.split("-") for chunk in chunks)
+        )
+
+        return added and completed >= total
+
+    async def is_chunk_completed(
+        self, index: int, job_id: str, cities: list[int]
+    ) -> bool:
+        """Check if a job chunk of cities was already completed"""
+
+        return await self.database_manager.is_set_member(
+            USER_JOB_CHUNKS_KEY.format(user_id=index, job_id=job_id),
+            f"{cities[0]}-{cities[-1]}",
+        )
+
+    async def fail_chunk(self) -> None:
+        """Count a job chunk dropped after failing"""
+        await self.database_manager.increment_counters(
+            USER_JOB_STATS_KEY, failed_chunks=1
+        )
+
+    async def skip_stale_job(self) -> None:
+        """Count a queued duplicated job skipped by consumer"""
+        await self.database_manager.increment_counters(
+            USER_JOB_STATS_KEY, skipped=1
+        )
+
+    async def job_stats(self) -> dict[str, int | float]:
+        """Requested, deduplicated and skipped jobs counters"""
+        counters = await self.database_manager.get_counters(USER_JOB_STATS_KEY)
+        requested = counters.get("requested", 0)
+        deduplicated = counters.get("deduplicated", 0)
+
+        return {
+            "requested": requested,
+            "deduplicated": deduplicated,
+            "skipped": counters.get("skipped", 0),
+            "failed_chunks": counters.get("failed_chunks", 0),
+            "dedupe_ratio": deduplicated / requested if requested else 0.0,
+        }
+
     async def remove_all_users(self) -> None:
         """Clear all users saved in database"""
         await self.database_manager.clear_model_registries(User)
@@ -64,6 +249,32 @@ class UserCityDataRepository(BaseRepository):
             UserCityData, "user_id", user.index
         )
 
+    async def remove_all_user_city_data(self, user: User) -> None:
+        """Remove city data from previous user requests"""
+
+        indexes = await self.database_manager.find_indexes_by_field(
+            UserCityData, "user_id", user.index
+        )
+        for chunk in chunk_stream(indexes, 500):
+            await self.database_manager.remove_registries(UserCityData, *chunk)
+
+    async def page_user_city_data(
+        self, user: User, cursor: int = 0, limit: int = 100
+    ) -> tuple[list[UserCityData], int | None]:
+        """Get one page of user city data, and the next page cursor"""
+
+        return await self.database_manager.page_by_field(
+            UserCityData, "user_id", user.index, cursor, limit
+        )
+
+    async def iter_user_city_data(self, user: User, chunk_size: int = 100):
+        """Stream all user city data fetching it in chunks"""
+
+        async for registry in self.database_manager.iter_all_by_field(
+            UserCityData, "user_id", user.index, chunk_size
+        ):
+            yield registry
+
 
 class CityInfoRepository(BaseRepository):
     """Repository to store Cities ids to request"""
@@ -71,14 +282,28 @@ class CityInfoRepository(BaseRepository):
     async def new_cities(self, /, *identifiers) -> list[CityInfo]:
         """Create one or more cities ids and store in db"""
 
+        result = [CityInfo(api_id=idx) for idx in identifiers]
+        await self.insert_many(result)
+
+        return result
+
+    async def all_cities(self, chunk_size: int = 500) -> list[CityInfo]:
+        """All cities stored in database"""
+
         result = []
-        for idx in identifiers:
-            city = CityInfo(api_id=idx)
-            await self.insert(city)
-            result.append(city)
+        total = await self.total_of_cities()
+        for chunk in chunk_stream(range(1, total + 1), chunk_size):
+            result.extend(
+                await self.database_manager.find_registries(CityInfo, *chunk)
+            )
 
         return result
 
+    async def get_cities(self, *indexes: int) -> list[CityInfo]:
+        """Fetch many cities at once, missing cities are skipped"""
+
+        return await self.database_manager.find_registries(CityInfo, *indexes)
+
     async def total_of_cities(self) -> int:
         """Total of cities in database"""
 
@@ -86,12 +311,15 @@ class CityInfoRepository(BaseRepository):
 
 
 async def base_startup():
-    redis = _redis_di_factory(_api_settings_builder())
-    manager = AsyncDbManager(redis)
+    settings = _api_settings_builder()
+    manager = AsyncDbManager(
+        _redis_di_factory(settings), _registry_cache_di_factory(settings)
+    )
     repo = CityInfoRepository(manager)
     if await repo.total_of_cities() != 0:
         click.echo(f'Fixtures already loaded {click.style('...', fg="green")}')
         click.echo("Nothing to do!")
+        await RedisPool(_api_settings_builder()).close()
 
         return
     with open("config/city_list/sample.json") as f:
@@ -100,6 +328,42 @@ async def base_startup():
         click.echo(f"Saving data in database {click.style('...', fg="green")}")
         await repo.new_cities(*data)
 
+    await RedisPool(_api_settings_builder()).close()
+
+
+async def rebuild_indexes():
+    settings = _api_settings_builder()
+    manager = AsyncDbManager(
+        _redis_di_factory(settings), _registry_cache_di_factory(settings)
+    )
+    for model in (User, UserCityData, CityInfo):
+        if not model.indexed_fields:
+            continue
+
+        fields = ", ".join(model.indexed_fields)
+        click.echo(
+            f"Rebuilding {model.__name__} ({fields}) indexes {click.style('...', fg="green")}"
+        )
+        total = await manager.rebuild_field_indexes(model)
+        click.echo(f"{total} registries indexed")
+
+    await RedisPool(_api_settings_builder()).close()
+
+
+async def migrate_codecs():
+    settings = _api_settings_builder()
+    manager = AsyncDbManager(
+        _redis_di_factory(settings), _registry_cache_di_factory(settings)
+    )
+    for model in (User, UserCityData, CityInfo):
+        click.echo(
+            f"Migrating {model.__name__} to {model.storage_codec} codec {click.style('...', fg="green")}"
+        )
+        total = await manager.migrate_codec(model)
+        click.echo(f"{total} registries rewritten")
+
+    await RedisPool(settings).close()
+
 
 CityInfoRepositoryDI = Annotated[
     CityInfoRepository, Depends(CityInfoRepository)
@@ -0,0 +1,201 @@
+"""
+Fake weather api - local stand-in of the upstream weather service, for\
+    load and latency testing without hitting the real api
+"""
+
+import asyncio
+import math
+import random
+import time
+
+from aiohttp import web
+
+WEATHER_PATH = "/data/2.5/weather"
+GROUP_PATH = "/data/2.5/group"
+STATS_PATH = "/stats"
+
+
+class FakeWeatherApi:
+    """
+    **FakeWeatherApi**: answers single city and group requests with the\
+        shape of the real api, after a log-normal latency. Requests fail\
+        with **500** at error_rate, with **429** at throttle_rate and when\
+        over the rate limit, always sending Retry-After.
+
+    usage:
+    ```python
+
+    api = FakeWeatherApi(latency=0.05, error_rate=0.01, rate=100)
+    web.run_app(api.build_app(), port=8080)
+    ```
+
+    :param latency: median response latency, in seconds. (default 0.0)
+    :param latency_sigma: log-normal spread, 0 for a fixed latency.\
+        (default 0.5)
+    :param error_rate: share of requests answered with 500. (default 0.0)
+    :param throttle_rate: share of requests answered with 429. (default 0.0)
+    :param rate: requests per second accepted, 0 for no limit. (default 0)
+    :param burst: requests accepted at once over rate. (default 1)
+    :param retry_after: Retry-After seconds of random 429s. (default 1)
+    :param token: appid required, any when None. (default None)
+    :param seed: random seed for reproducible runs. (default None)
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        latency_sigma: float = 0.5,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        rate: float = 0.0,
+        burst: int = 1,
+        retry_after: int = 1,
+        token: str | None = None,
+        seed: int | None = None,
+    ) -> None:
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate = rate
+        self.burst = burst
+        self.retry_after = retry_after
+        self.token = token
+        self.random = random.Random(seed)
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(WEATHER_PATH, self.weather)
+        app.router.add_get(GROUP_PATH, self.group)
+        app.router.add_get(STATS_PATH, self.stats)
+
+        return app
+
+    async def weather(self, request: web.Request) -> web.Response:
+        """Single city, ?id={city_id}&appid={token}"""
+        cities_ids = await self._handle(request)
+
+        return web.json_response(city_payload(cities_ids[0]))
+
+    async def group(self, request: web.Request) -> web.Response:
+        """Many cities, ?id={city_id},{city_id}&appid={token}"""
+        cities_ids = await self._handle(request)
+
+        return web.json_response(
+            {
+                "cnt": len(cities_ids),
+                "list": [city_payload(city_id) for city_id in cities_ids],
+            }
+        )
+
+    async def stats(self, _: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "requests": self.requests,
+                "errors": self.errors,
+                "throttled": self.throttled,
+            }
+        )
+
+    async def _handle(self, request: web.Request) -> list[int]:
+        """Validate query and play latency and failures, return cities ids"""
+        self.requests += 1
+        if self.token is not None and request.query.get("appid") != self.token:
+            raise web.HTTPUnauthorized()
+
+        try:
+            cities_ids = [
+                int(city_id) for city_id in request.query["id"].split(",")
+            ]
+        except (KeyError, ValueError):
+            raise web.HTTPBadRequest()
+
+        wait = self._take()
+        if wait:
+            self.throttled += 1
+            raise web.HTTPTooManyRequests(
+                headers={"Retry-After": str(math.ceil(wait))}
+            )
+
+        if self.latency:
+            await asyncio.sleep(
+                self.random.lognormvariate(
+                    math.log(self.latency), self.latency_sigma
+                )
+            )
+
+        draw = self.random.random()
+        if draw < self.throttle_rate:
+            self.throttled += 1
+            raise web.HTTPTooManyRequests(
+                headers={"Retry-After": str(self.retry_after)}
+            )
+
+        if draw < self.throttle_rate + self.error_rate:
+            self.errors += 1
+            raise web.HTTPInternalServerError()
+
+        return cities_ids
+
+    def _take(self) -> float:
+        """Take a rate limit token, seconds until next one when empty"""
+        if not self.rate:
+            return 0.0
+
+        now = time.monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+
+        return (1 - self.tokens) / self.rate
+
+
+def city_payload(city_id: int) -> dict:
+    """Deterministic weather payload of city, same fields as real api"""
+    seeded = random.Random(city_id)
+    temp = round(seeded.uniform(250.0, 310.0), 2)
+
+    return {
+        "coord": {
+            "lon": round(seeded.uniform(-180, 180), 4),
+            "lat": round(seeded.uniform(-90, 90), 4),
+        },
+        "weather": [
+            {
+                "id": 800,
+                "main": "Clear",
+                "description": "clear sky",
+                "icon": "01d",
+            }
+        ],
+        "base": "stations",
+        "main": {
+            "temp": temp,
+            "feels_like": temp,
+            "temp_min": round(temp - 1.5, 2),
+            "temp_max": round(temp + 1.5, 2),
+            "pressure": seeded.randint(980, 1040),
+            "humidity": seeded.randint(10, 100),
+        },
+        "visibility": 10000,
+        "wind": {
+            "speed": round(seeded.uniform(0, 15), 1),
+            "deg": seeded.randint(0, 359),
+        },
+        "clouds": {"all": seeded.randint(0, 100)},
+        "dt": int(time.time()),
+        "sys": {"type": 1, "id": city_id, "country": "XX"},
+        "timezone": 0,
+        "id": city_id,
+        "name": f"City {city_id}",
+        "cod": 200,
+    }
@@ -4,8 +4,9 @@ import functools
 import hashlib
 import json
 from datetime import datetime
+from typing import ClassVar
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, computed_field, model_validator
 
 from internal.utils import build_singleton
 
@@ -32,6 +33,11 @@ class ModelTableNameFactory:
 class Base(BaseModel):
     """Base from all models used by api"""
 
+    # fields kept in secondary indexes (sorted sets) by the database manager
+    indexed_fields: ClassVar[tuple[str, ...]] = ()
+    # codec used to store registries, see internal.database.codecs
+    storage_codec: ClassVar[str] = "hash"
+
     index: int | None = Field(None, json_schema_extra={"minimum": 1})
 
     @classmethod
@@ -42,6 +48,10 @@ class Base(BaseModel):
     def db_index(self) -> str:
         return f'{self.table_name()}_{self.index or "0"}'
 
+    def storage_dump(self) -> dict:
+        """Fields as stored by the model codec"""
+        return self.model_dump()
+
 
 class User(Base):
     created_at: str = Field(min_length=10)
@@ -51,21 +61,66 @@ class User(Base):
 
 
 class UserCityData(Base):
+    """
+    City weather of a user request. Blob codecs store payload as is, the\
+        data json text is only built for api output (and hash codec).
+    """
+
+    indexed_fields: ClassVar[tuple[str, ...]] = ("user_id",)
+    storage_codec: ClassVar[str] = "zlib"
+
     user_id: int = Field(json_schema_extra={"minimun": 1})
     request_time: str = Field(min_length=10)
-    data: str = Field(min_length=2)
+    payload: dict = Field(exclude=True)
+
+    @model_validator(mode="before")
+    @classmethod
+    def load_data(cls, values):
+        """Accept payload as json text, as stored by hash codec"""
+        if isinstance(values, dict) and "payload" not in values:
+            if (data := values.get("data")) is not None:
+                values = {**values, "payload": json.loads(data)}
+
+        return values
+
+    @computed_field
+    @functools.cached_property
+    def data(self) -> str:
+        return json.dumps(self.payload)
 
     @classmethod
     def build_from(cls, user_id: int, payload: dict):
         return cls(
             user_id=user_id,
             request_time=datetime.now().isoformat(),
-            data=json.dumps(payload),
+            payload=payload,
         )
 
-    @property
-    def payload(self) -> dict:
-        return json.loads(self.data)
+    def storage_dump(self) -> dict:
+        if self.storage_codec == "hash":
+            return self.model_dump()
+
+        return {**self.model_dump(exclude={"data"}), "payload": self.payload}
+
+
+class UserCityDataPage(BaseModel):
+    """One page of user city data, use next_cursor to fetch next page"""
+
+    items: list[UserCityData]
+    next_cursor: int | None = None
+
+
+class UserJob(BaseModel):
+    """
+    User request queue message, job_id identifies the user request in\
+        flight, cities holds the CityInfo indexes of one job chunk (None\
+        means all cities) and total the job cities count.
+    """
+
+    user: User
+    job_id: str | None = None
+    cities: list[int] | None = None
+    total: int | None = Field(None, ge=0)
 
 
 class CityInfo(Base):
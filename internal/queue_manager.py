@@ -4,84 +4,310 @@ Module for dealing if queue
 
 import asyncio
 import json
-from typing import Annotated, Awaitable, Callable
+import logging
+from typing import Annotated, Awaitable, Callable, Iterable
 
 import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractRobustConnection
+from aio_pika.pool import Pool
 from fastapi import Depends
 
-from internal.models import User
+from internal.models import User, UserJob
+from internal.queue_transports import (
+    ConsumerStats,
+    QueueTransport,
+    RedisStreamTransport,
+)
 from internal.settings import ApiSettingsDI
+from internal.utils import BatchLoader, build_singleton, chunk_stream
 
 
 USER_QUEUE = "process_user_request"
+JOB_USER_FIELD = "u"
+JOB_ID_FIELD = "j"
+JOB_CITIES_FIELD = "c"
+JOB_TOTAL_FIELD = "t"
 
+logger = logging.getLogger(__name__)
 
-class QueueConn:
-    """Manages connection with queue"""
+
+@build_singleton
+class QueueConn(QueueTransport):
+    """
+    Manages long-lived AMQP connection with queue, opened and closed by\
+        app lifespan. Publishes through a pool of confirm-enabled channels.
+    """
 
     def __init__(self, settings: ApiSettingsDI) -> None:
-        self.settings = settings
-        self.conn = None
+        super().__init__(settings)
+        self.conn: AbstractRobustConnection | None = None
+        self.channels: Pool[AbstractChannel] | None = None
+        self.declared_queues: set[str] = set()
+        self._lock = asyncio.Lock()
+
+    async def connect(self) -> None:
+        """Open connection and channel pool if not opened yet"""
+        async with self._lock:
+            if self.conn is not None:
+                return
+
+            self.conn = await aio_pika.connect_robust(self.settings.amqp_dsn)
+            self.channels = Pool(
+                self._open_channel,
+                max_size=self.settings.amqp_channel_pool_size,
+            )
+
+    async def close(self) -> None:
+        """Close channel pool and connection"""
+        if self.channels is not None:
+            await self.channels.close()
 
-    async def _connect(self) -> None:
         if self.conn is not None:
+            await self.conn.close()
+
+        self.conn, self.channels = None, None
+        self.declared_queues.clear()
+
+    async def _open_channel(self) -> AbstractChannel:
+        return await self.conn.channel(publisher_confirms=True)
+
+    async def _declare_queue(
+        self, channel: AbstractChannel, queue_name: str
+    ) -> None:
+        if queue_name in self.declared_queues:
             return
 
-        self.conn = await aio_pika.connect_robust(self.settings.amqp_dsn)
+        await channel.declare_queue(queue_name)
+        self.declared_queues.add(queue_name)
 
-    async def send_message(self, queue_name: str, message: str) -> None:
-        """Send any message to queue"""
+    async def send_messages(
+        self, queue_name: str, messages: Iterable[str]
+    ) -> None:
+        """
+        Send many messages to queue, publishes are pipelined in one channel\
+            and broker confirms awaited together
+        """
 
-        await self._connect()
-        async with self.conn:
-            channel = await self.conn.channel()
-            queue = await channel.declare_queue(queue_name)
-            await channel.default_exchange.publish(
-                aio_pika.Message(message.encode()), routing_key=queue.name
+        await self.connect()
+        async with self.channels.acquire() as channel:
+            await self._declare_queue(channel, queue_name)
+            await asyncio.gather(
+                *(
+                    channel.default_exchange.publish(
+                        aio_pika.Message(message.encode()),
+                        routing_key=queue_name,
+                    )
+                    for message in messages
+                )
             )
 
     async def process_message(
-        self, queue_name: str, func: Callable[[str], Awaitable[None]]
+        self,
+        queue_name: str,
+        func: Callable[[str], Awaitable[None]],
+        prefetch_count: int | None = None,
+        concurrency: int | None = None,
+        stop: asyncio.Event | None = None,
+        stats: ConsumerStats | None = None,
     ) -> None:
-        """Process sended message"""
+        """
+        Process sended messages running up to concurrency handlers at once,\
+            until stop is set (default: on SIGTERM or SIGINT). Then stop\
+            consuming, wait in-flight handlers for queue_drain_timeout and\
+            nack the unfinished ones back to queue.
+        """
 
-        await self._connect()
+        await self.connect()
+        prefetch_count, semaphore, stop, stats = self._consumer_defaults(
+            prefetch_count, concurrency, stop, stats
+        )
+        handlers: set[asyncio.Task] = set()
 
         async def on_message(message: aio_pika.IncomingMessage) -> None:
-            async with message.process():
-                await func(message.body.decode())
+            task = asyncio.create_task(
+                self._handle(
+                    queue_name,
+                    func,
+                    message.body.decode(),
+                    semaphore,
+                    stats,
+                    message.ack,
+                    lambda: message.reject(requeue=False),
+                    lambda: message.nack(requeue=True),
+                )
+            )
+            handlers.add(task)
+            task.add_done_callback(handlers.discard)
+
+        channel = await self.conn.channel()
+        await channel.set_qos(prefetch_count=prefetch_count)
+        queue = await channel.declare_queue(queue_name)
+        consumer_tag = await queue.consume(on_message)
+
+        await stop.wait()
+        await queue.cancel(consumer_tag)
+        await self._drain(handlers)
+        await channel.close()
 
-        async with self.conn:
-            channel = await self.conn.channel()
-            queue = await channel.declare_queue(queue_name)
 
-            await queue.consume(on_message)
+TRANSPORTS: dict[str, Callable[..., QueueTransport]] = {
+    "amqp": QueueConn,
+    "redis": RedisStreamTransport,
+}
 
-        await asyncio.Future()
+
+@build_singleton
+def _queue_transport_di_factory(settings: ApiSettingsDI) -> QueueTransport:
+    return TRANSPORTS[settings.queue_transport](settings)
 
 
 class QueueManager:
     """Manage sendind and receive data from queue"""
 
     def __init__(
-        self, connection: Annotated[QueueConn, Depends(QueueConn)]
+        self,
+        connection: Annotated[
+            QueueTransport, Depends(_queue_transport_di_factory)
+        ],
+    ) -> None:
+        self.connection: QueueTransport = connection
+
+    async def enqueue_user(
+        self,
+        user: User,
+        total_of_cities: int | None = None,
+        chunk_size: int | None = None,
+        job_id: str | None = None,
+    ) -> None:
+        """
+        Send user to be processed in async way. With chunk_size, job is\
+            split in one message per chunk of cities, so many consumers can\
+            process it at same time.
+        """
+
+        messages = self._user_job_messages(
+            user, total_of_cities, chunk_size, job_id
+        )
+        if len(messages) == 1:
+            await self.connection.send_message(USER_QUEUE, messages[0])
+            return
+
+        await self.connection.send_messages(USER_QUEUE, messages)
+
+    async def enqueue_users(
+        self,
+        users: Iterable[User],
+        total_of_cities: int | None = None,
+        chunk_size: int | None = None,
+        job_ids: dict[int, str] | None = None,
     ) -> None:
-        self.connection: QueueConn = connection
+        """
+        Send many users to be processed in one batch, job_ids maps user\
+            index to its job id
+        """
+
+        job_ids = job_ids or {}
+
+        await self.connection.send_messages(
+            USER_QUEUE,
+            [
+                message
+                for user in users
+                for message in self._user_job_messages(
+                    user, total_of_cities, chunk_size, job_ids.get(user.index)
+                )
+            ],
+        )
+
+    def _user_job_messages(
+        self,
+        user: User,
+        total_of_cities: int | None,
+        chunk_size: int | None,
+        job_id: str | None = None,
+    ) -> list[str]:
+        """
+        Slim job messages, only user index, job id and the chunk cities\
+            indexes range are sent, consumers load current user state
+        """
+        message = {JOB_USER_FIELD: user.index}
+        if job_id is not None:
+            message[JOB_ID_FIELD] = job_id
 
-    async def enqueue_user(self, user: User) -> None:
-        """Send user to be processed in async way"""
+        if not chunk_size or not total_of_cities:
+            return [json.dumps(message, separators=(",", ":"))]
+
+        return [
+            json.dumps(
+                {
+                    **message,
+                    JOB_CITIES_FIELD: [chunk[0], chunk[-1] + 1],
+                    JOB_TOTAL_FIELD: total_of_cities,
+                },
+                separators=(",", ":"),
+            )
+            for chunk in chunk_stream(
+                range(1, total_of_cities + 1), chunk_size
+            )
+        ]
+
+    async def process_user_job_message(
+        self,
+        func: Callable[[UserJob], Awaitable[None]],
+        load_users: Callable[..., Awaitable[list[User]]] | None = None,
+        load_delay: float = 0.0,
+        **options,
+    ) -> None:
+        """
+        Process all income user jobs in given callback, options are passed\
+            to QueueConn.process_message (prefetch_count, concurrency, stop,\
+            stats). Users of slim messages are loaded by load_users(*indexes)\
+            batching every message received within load_delay seconds.
+        """
 
-        await self.connection.send_message(USER_QUEUE, user.model_dump_json())
+        async def load_many(indexes: list[int]) -> dict[int, User]:
+            return {user.index: user for user in await load_users(*indexes)}
+
+        loader = BatchLoader(load_many, load_delay)
+
+        async def wrapper(income: str) -> None:
+            data = json.loads(income)
+            if JOB_USER_FIELD not in data:
+                # full user snapshot, sent before slim messages
+                await func(
+                    UserJob(**data if "user" in data else {"user": data})
+                )
+                return
+
+            if load_users is None:
+                raise ValueError("slim user job message requires load_users")
+
+            user = await loader.load(data[JOB_USER_FIELD])
+            if user is None:
+                logger.warning("Skipped job of missing user %s", income)
+                return
+
+            cities = data.get(JOB_CITIES_FIELD)
+            await func(
+                UserJob(
+                    user=user,
+                    job_id=data.get(JOB_ID_FIELD),
+                    cities=None if cities is None else list(range(*cities)),
+                    total=data.get(JOB_TOTAL_FIELD),
+                )
+            )
+
+        await self.connection.process_message(USER_QUEUE, wrapper, **options)
 
     async def process_user_queue_message(
-        self, func: Callable[[User], Awaitable[None]]
+        self, func: Callable[[User], Awaitable[None]], **options
     ) -> None:
         """Process all income user messages in given callback"""
 
-        async def wrapper(income: str) -> None:
-            await func(User(**json.loads(income)))
+        async def wrapper(job: UserJob) -> None:
+            await func(job.user)
 
-        await self.connection.process_message(USER_QUEUE, wrapper)
+        await self.process_user_job_message(wrapper, **options)
 
 
 QueueManagerDI = Annotated[QueueManager, Depends(QueueManager)]
@@ -0,0 +1,413 @@
+"""
+Queue transports - brokers QueueManager can send and consume messages from
+"""
+
+import asyncio
+import functools
+from abc import ABC, abstractmethod
+import logging
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Iterable
+
+from redis import asyncio as async_redis
+from redis.exceptions import ResponseError
+
+from internal.database.manager import RedisPool
+from internal.settings import ApiSettings
+from internal.utils import stop_on_signals
+
+
+STREAM_BODY_FIELD = "body"
+
+logger = logging.getLogger(__name__)
+
+
+class ConsumerStats:
+    """Per consumer throughput counters"""
+
+    def __init__(self) -> None:
+        self.started_at = time.monotonic()
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.requeued = 0
+
+    def stats(self) -> dict[str, int | float]:
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+
+        return {
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "failed": self.failed,
+            "requeued": self.requeued,
+            "messages_per_second": self.processed / elapsed,
+        }
+
+
+class QueueTransport(ABC):
+    """
+    Base queue transport. Messages are acked after handler success,\
+        dropped when handler fails and requeued when handler is cancelled\
+        by a drain timeout.
+    """
+
+    def __init__(self, settings: ApiSettings) -> None:
+        self.settings = settings
+
+    async def connect(self) -> None:
+        """Open broker connection"""
+
+    async def close(self) -> None:
+        """Close broker connection"""
+
+    async def send_message(self, queue_name: str, message: str) -> None:
+        """Send any message to queue"""
+
+        await self.send_messages(queue_name, [message])
+
+    @abstractmethod
+    async def send_messages(
+        self, queue_name: str, messages: Iterable[str]
+    ) -> None:
+        """Send many messages to queue in one round trip"""
+
+    @abstractmethod
+    async def process_message(
+        self,
+        queue_name: str,
+        func: Callable[[str], Awaitable[None]],
+        prefetch_count: int | None = None,
+        concurrency: int | None = None,
+        stop: asyncio.Event | None = None,
+        stats: ConsumerStats | None = None,
+    ) -> None:
+        """
+        Process sended messages running up to concurrency handlers at once,\
+            until stop is set (default: on SIGTERM or SIGINT). Then stop\
+            consuming, wait in-flight handlers for queue_drain_timeout and\
+            requeue the unfinished ones.
+        """
+
+    async def _handle(
+        self,
+        queue_name: str,
+        func: Callable[[str], Awaitable[None]],
+        body: str,
+        semaphore: asyncio.Semaphore,
+        stats: ConsumerStats,
+        ack: Callable[[], Awaitable],
+        reject: Callable[[], Awaitable],
+        requeue: Callable[[], Awaitable],
+    ) -> None:
+        stats.in_flight += 1
+        try:
+            async with semaphore:
+                await func(body)
+        except asyncio.CancelledError:
+            await requeue()
+            stats.requeued += 1
+            raise
+        except Exception:
+            logger.exception("Failed processing %s message", queue_name)
+            await reject()
+            stats.failed += 1
+        else:
+            await ack()
+            stats.processed += 1
+        finally:
+            stats.in_flight -= 1
+
+    async def _drain(self, handlers: set[asyncio.Task]) -> None:
+        """Wait in-flight handlers, cancel the ones out of drain timeout"""
+        if not handlers:
+            return
+
+        _, pending = await asyncio.wait(
+            handlers, timeout=self.settings.queue_drain_timeout
+        )
+        for task in pending:
+            task.cancel()
+
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def _consumer_defaults(
+        self,
+        prefetch_count: int | None,
+        concurrency: int | None,
+        stop: asyncio.Event | None,
+        stats: ConsumerStats | None,
+    ) -> tuple[int, asyncio.Semaphore, asyncio.Event, ConsumerStats]:
+        return (
+            prefetch_count or self.settings.amqp_prefetch_count,
+            asyncio.Semaphore(
+                concurrency or self.settings.queue_consumer_concurrency
+            ),
+            stop or stop_on_signals(),
+            stats or ConsumerStats(),
+        )
+
+
+class MemoryTransport(QueueTransport):
+    """
+    In process asyncio queues, for tests and benchmarks only: nothing\
+        consumes it in api process, so it isn't a queue_transport option.
+    """
+
+    def __init__(self, settings: ApiSettings) -> None:
+        super().__init__(settings)
+        self.queues: dict[str, asyncio.Queue[str]] = {}
+
+    def _queue(self, queue_name: str) -> asyncio.Queue[str]:
+        if queue_name not in self.queues:
+            self.queues[queue_name] = asyncio.Queue()
+
+        return self.queues[queue_name]
+
+    async def close(self) -> None:
+        self.queues.clear()
+
+    async def send_messages(
+        self, queue_name: str, messages: Iterable[str]
+    ) -> None:
+        queue = self._queue(queue_name)
+        for message in messages:
+            queue.put_nowait(message)
+
+    async def process_message(
+        self,
+        queue_name: str,
+        func: Callable[[str], Awaitable[None]],
+        prefetch_count: int | None = None,
+        concurrency: int | None = None,
+        stop: asyncio.Event | None = None,
+        stats: ConsumerStats | None = None,
+    ) -> None:
+        prefetch_count, semaphore, stop, stats = self._consumer_defaults(
+            prefetch_count, concurrency, stop, stats
+        )
+        queue = self._queue(queue_name)
+        handlers: set[asyncio.Task] = set()
+        stopped = asyncio.create_task(stop.wait())
+
+        async def noop() -> None:
+            pass
+
+        while not stop.is_set():
+            if len(handlers) >= prefetch_count:
+                await asyncio.wait(
+                    {*handlers, stopped}, return_when=asyncio.FIRST_COMPLETED
+                )
+                continue
+
+            getter = asyncio.create_task(queue.get())
+            await asyncio.wait(
+                {getter, stopped}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not getter.done():
+                getter.cancel()
+                break
+
+            body = getter.result()
+            task = asyncio.create_task(
+                self._handle(
+                    queue_name,
+                    func,
+                    body,
+                    semaphore,
+                    stats,
+                    noop,
+                    noop,
+                    lambda body=body: self.send_message(queue_name, body),
+                )
+            )
+            handlers.add(task)
+            task.add_done_callback(handlers.discard)
+
+        stopped.cancel()
+        await self._drain(handlers)
+
+
+class RedisStreamTransport(QueueTransport):
+    """
+    Redis Streams queue, one stream per queue read by a consumer group.\
+        Messages are read in batches with XREADGROUP, acked with XACK and\
+        messages left pending by dead consumers are taken over with\
+        XAUTOCLAIM after queue_stream_claim_idle seconds. In-flight\
+        messages are claimed again (XCLAIM JUSTID) every third of that\
+        time, so long jobs are never taken over by another consumer.
+    """
+
+    def __init__(
+        self, settings: ApiSettings, redis: async_redis.Redis | None = None
+    ) -> None:
+        super().__init__(settings)
+        self.redis = redis
+        self.consumer_name = (
+            f"{socket.gethostname()}-{os.getpid()}-{id(self):x}"
+        )
+        self.groups: set[str] = set()
+
+    async def connect(self) -> None:
+        if self.redis is None:
+            self.redis = RedisPool(self.settings).client()
+
+    async def close(self) -> None:
+        self.redis = None
+        self.groups.clear()
+
+    async def send_messages(
+        self, queue_name: str, messages: Iterable[str]
+    ) -> None:
+        await self.connect()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for message in messages:
+                pipe.xadd(
+                    queue_name,
+                    {STREAM_BODY_FIELD: message},
+                    maxlen=self.settings.queue_stream_maxlen or None,
+                    approximate=True,
+                )
+
+            await pipe.execute()
+
+    async def _create_group(self, queue_name: str) -> None:
+        if queue_name in self.groups:
+            return
+
+        try:
+            await self.redis.xgroup_create(
+                queue_name,
+                self.settings.queue_stream_group,
+                id="0",
+                mkstream=True,
+            )
+        except ResponseError as error:
+            if "BUSYGROUP" not in str(error):
+                raise
+
+        self.groups.add(queue_name)
+
+    async def _read(
+        self, queue_name: str, count: int
+    ) -> list[tuple[bytes, dict]]:
+        """Claim stuck messages first, then read new ones"""
+        group = self.settings.queue_stream_group
+        _, claimed, *_ = await self.redis.xautoclaim(
+            queue_name,
+            group,
+            self.consumer_name,
+            int(self.settings.queue_stream_claim_idle * 1000),
+            count=count,
+        )
+        if claimed:
+            return claimed
+
+        streams = await self.redis.xreadgroup(
+            group,
+            self.consumer_name,
+            {queue_name: ">"},
+            count=count,
+            block=int(self.settings.queue_stream_block * 1000),
+        )
+
+        return [entry for _, entries in streams or [] for entry in entries]
+
+    async def process_message(
+        self,
+        queue_name: str,
+        func: Callable[[str], Awaitable[None]],
+        prefetch_count: int | None = None,
+        concurrency: int | None = None,
+        stop: asyncio.Event | None = None,
+        stats: ConsumerStats | None = None,
+    ) -> None:
+        prefetch_count, semaphore, stop, stats = self._consumer_defaults(
+            prefetch_count, concurrency, stop, stats
+        )
+        await self.connect()
+        await self._create_group(queue_name)
+        group = self.settings.queue_stream_group
+        handlers: set[asyncio.Task] = set()
+
+        async def ack(message_id: bytes) -> None:
+            await self.redis.xack(queue_name, group, message_id)
+
+        in_flight: dict[asyncio.Task, bytes] = {}
+        heartbeat = asyncio.create_task(self._heartbeat(queue_name, in_flight))
+
+        async def requeue(message_id: bytes, body: str) -> None:
+            """Move drained message to stream tail for another consumer"""
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.xadd(queue_name, {STREAM_BODY_FIELD: body})
+                pipe.xack(queue_name, group, message_id)
+                await pipe.execute()
+
+        while not stop.is_set():
+            if len(handlers) >= prefetch_count:
+                await asyncio.wait(
+                    handlers,
+                    timeout=self.settings.queue_stream_block,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                continue
+
+            for message_id, fields in await self._read(
+                queue_name, prefetch_count - len(handlers)
+            ):
+                if not fields:
+                    # trimmed out of stream while pending
+                    await ack(message_id)
+                    continue
+
+                body = fields[STREAM_BODY_FIELD.encode()].decode()
+                done = functools.partial(ack, message_id)
+                task = asyncio.create_task(
+                    self._handle(
+                        queue_name,
+                        func,
+                        body,
+                        semaphore,
+                        stats,
+                        done,
+                        done,
+                        functools.partial(requeue, message_id, body),
+                    )
+                )
+                handlers.add(task)
+                in_flight[task] = message_id
+                task.add_done_callback(handlers.discard)
+                task.add_done_callback(in_flight.pop)
+
+        try:
+            await self._drain(handlers)
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+
+    async def _heartbeat(
+        self, queue_name: str, in_flight: dict[asyncio.Task, bytes]
+    ) -> None:
+        """Reset idle time of in-flight messages before they are claimable"""
+        interval = self.settings.queue_stream_claim_idle / 3
+        while True:
+            await asyncio.sleep(interval)
+            if not in_flight:
+                continue
+
+            try:
+                await self.redis.xclaim(
+                    queue_name,
+                    self.settings.queue_stream_group,
+                    self.consumer_name,
+                    0,
+                    list(in_flight.values()),
+                    justid=True,
+                )
+            except Exception:
+                logger.warning(
+                    "Failed refreshing %s pending messages",
+                    queue_name,
+                    exc_info=True,
+                )
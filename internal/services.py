@@ -5,39 +5,181 @@ Contain classes and function to execute some services.
 
 import asyncio
 import json
-from typing import Callable, Any
+import logging
+import random
+import sys
+import time
+import uuid
+from collections import deque
+from contextlib import suppress
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Any, Iterable
 
 import aiohttp
 from redis import asyncio as aioredis
 from fastapi import status, HTTPException
 
-from internal.database.manager import _redis_di_factory
+from internal.cache import LruTtlCache
+from internal.database.buffer import WriteBehindBuffer
+from internal.database.codecs import RegistryCodec, get_codec, loads_payload
+from internal.database.manager import (
+    DELETE_IF_EQUAL_SCRIPT,
+    _redis_di_factory,
+)
+from internal.database.repositories import (
+    CityInfoRepository,
+    UserCityDataRepository,
+    UserRepository,
+)
+from internal.models import User, UserCityData, UserJob
 from internal.settings import ConsumerSettings
-from internal.utils import build_singleton
+from internal.utils import (
+    BatchLoader,
+    CircuitBreaker,
+    RedisTokenBucket,
+    TokenBucket,
+    build_singleton,
+    chunk_stream,
+)
 
+CITY_CACHE_KEY = "city:cache:{city_id}"
+CACHE_MGET_SIZE = 500
+CITY_LOCK_KEY = "city:lock:{city_id}"
+CITY_LOCK_POLL_INTERVAL = 0.05
 
-async def make_get_request(endpoint: str) -> dict[str, Any]:
-    """Make get request to any service"""
+logger = logging.getLogger(__name__)
 
-    async with aiohttp.request("GET", endpoint) as response:
+
+async def make_get_request(
+    session: aiohttp.ClientSession, endpoint: str
+) -> dict[str, Any]:
+    """Make get request to any service through a shared session"""
+
+    async with session.get(endpoint) as response:
         if response.status != status.HTTP_200_OK:
-            raise HTTPException(response.status)
+            retry_after = response.headers.get("Retry-After")
+            raise HTTPException(
+                response.status,
+                headers=(
+                    None
+                    if retry_after is None
+                    else {"Retry-After": retry_after}
+                ),
+            )
 
         return await response.json()
 
 
+def is_upstream_unavailable(error: Exception) -> bool:
+    """Throttled, failing or unreachable upstream error"""
+    if isinstance(error, HTTPException):
+        return (
+            error.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+            or error.status_code >= status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a Retry-After header, delay or http date"""
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
 @build_singleton
 class RequestWeatherApiService:
-    """Make requests from weather api service to obtain data"""
+    """
+    Make requests from weather api service to obtain data, reusing the\
+        connections of one long-lived session opened and closed by worker\
+        lifespan.
+
+    5xx responses, timeouts and connection errors are retried with\
+        jittered exponential backoff. A 429 pauses every request of the\
+        process for Retry-After seconds, and a circuit breaker fails fast\
+        with **503** while upstream keeps failing. Every attempt, retries\
+        included, takes a token of rate_limiter.
+    """
 
     def __init__(
         self,
         settings: ConsumerSettings,
-        request_function: Callable[[str], dict] = make_get_request,
+        request_function: Callable[
+            [aiohttp.ClientSession, str], Awaitable[dict]
+        ] = make_get_request,
+        rate_limiter: TokenBucket | RedisTokenBucket | None = None,
     ) -> None:
+        self.settings = settings
         self.api_dsn = settings.weather_api_dsn
+        self.group_api_dsn = settings.weather_api_group_dsn
         self.api_token = settings.weather_api_token
         self.request_function = request_function
+        self.rate_limiter = rate_limiter
+        self.session: aiohttp.ClientSession | None = None
+        self.requests = 0
+        self.in_flight = 0
+        self.failures = 0
+        self.retries = 0
+        self.throttled = 0
+        self.paused_until = 0.0
+        self.breaker = CircuitBreaker(
+            settings.weather_api_breaker_threshold,
+            settings.weather_api_breaker_reset,
+        )
+
+    def open(self) -> aiohttp.ClientSession:
+        """Create session and connection pool if not created yet"""
+        if self.session is not None:
+            return self.session
+
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.settings.weather_api_max_connections,
+                limit_per_host=self.settings.weather_api_connections_per_host,
+                ttl_dns_cache=self.settings.weather_api_dns_cache_ttl,
+                keepalive_timeout=self.settings.weather_api_keepalive_timeout,
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=self.settings.weather_api_timeout,
+                connect=self.settings.weather_api_connect_timeout,
+            ),
+        )
+
+        return self.session
+
+    async def close(self) -> None:
+        """Close session and its connections"""
+        if self.session is None:
+            return
+
+        await self.session.close()
+        self.session = None
+
+    def stats(self) -> dict[str, int]:
+        """Upstream requests and connection pool statistics"""
+        connector = None if self.session is None else self.session.connector
+
+        # in flight requests hold a connection each, counted here instead
+        # of reading aiohttp connector internals
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "circuit": self.breaker.state,
+            "max_connections": 0 if connector is None else connector.limit,
+            "in_use": self.in_flight,
+        }
 
     async def fetch_city(self, city_id: int) -> dict:
         """
@@ -49,9 +191,128 @@ class RequestWeatherApiService:
         :raises fastapi.HTTPException: Any request with code different from **200 OK**.
         """
 
-        endpoint = self.build_endpoint(city_id)
+        return await self._request(self.build_endpoint(city_id))
+
+    async def fetch_group(self, cities_ids: list[int]) -> dict[int, dict]:
+        """
+        fetch weather data from many cities in one request, cities missing\
+            in response are not returned
+
+        :param list[int] cities_ids: External api ids, up to group_size
+
+        :raises fastapi.HTTPException: Any request with code different from **200 OK**.
+        """
+
+        data = await self._request(self.build_group_endpoint(cities_ids))
+
+        return {item["id"]: item for item in data.get("list") or []}
+
+    @property
+    def group_size(self) -> int:
+        """Max cities fetched by request, 1 without group endpoint"""
+        if self.group_api_dsn is None:
+            return 1
+
+        return self.settings.weather_api_group_size
+
+    async def _request(self, endpoint: str) -> dict:
+        """
+        Request endpoint retrying failures up to weather_api_retries times,\
+            throttled requests wait the pause and keep retrying until\
+            weather_api_throttle_timeout seconds
+        """
+        attempt, started = 0, time.monotonic()
+        while True:
+            await self._wait_pause()
+            if not self.breaker.allow():
+                raise HTTPException(
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                    "Weather api circuit is open",
+                )
+
+            try:
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire()
+
+                self.requests += 1
+                self.in_flight += 1
+                try:
+                    data = await self.request_function(self.open(), endpoint)
+                finally:
+                    self.in_flight -= 1
+            except Exception as error:
+                self.failures += 1
+                delay = self._retry_delay(error, attempt)
+                throttled = (
+                    isinstance(error, HTTPException)
+                    and error.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+                )
+                if throttled:
+                    # the pause already backs off, bounded by time instead
+                    exhausted = (
+                        time.monotonic() - started
+                        >= self.settings.weather_api_throttle_timeout
+                    )
+                else:
+                    exhausted = attempt >= self.settings.weather_api_retries
+
+                if delay is None or exhausted:
+                    raise
 
-        return await self.request_function(endpoint, self.api_token)
+                if not throttled:
+                    attempt += 1
+
+                self.retries += 1
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return data
+            finally:
+                # a cancelled or unclassified trial must not hold half open
+                self.breaker.release()
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float | None:
+        """Seconds to wait before retrying error, None when not retryable"""
+        backoff = random.uniform(
+            0,
+            min(
+                self.settings.weather_api_backoff_max,
+                self.settings.weather_api_backoff_base * 2**attempt,
+            ),
+        )
+        if isinstance(error, HTTPException):
+            if error.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+                self.throttled += 1
+                retry_after = parse_retry_after(
+                    (error.headers or {}).get("Retry-After")
+                )
+                self._pause(backoff if retry_after is None else retry_after)
+                if self.breaker.state == self.breaker.HALF_OPEN:
+                    # trial call was throttled, upstream is not back yet
+                    self.breaker.record_failure()
+
+                return 0.0
+
+            if error.status_code < status.HTTP_500_INTERNAL_SERVER_ERROR:
+                # answered, upstream is healthy
+                self.breaker.record_success()
+                return None
+        elif not isinstance(
+            error, (aiohttp.ClientError, asyncio.TimeoutError)
+        ):
+            return None
+
+        self.breaker.record_failure()
+
+        return backoff
+
+    def _pause(self, seconds: float) -> None:
+        """Hold every request of this service for seconds"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def _wait_pause(self) -> None:
+        while (delay := self.paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
 
     def build_endpoint(self, city_id: int) -> str:
         """
@@ -65,10 +326,103 @@ class RequestWeatherApiService:
 
         return f"{self.api_dsn}?id={city_id}&appid={self.api_token}"
 
+    def build_group_endpoint(self, cities_ids: list[int]) -> str:
+        """
+        Build url for many cities api request.
+
+        url format: {group api dsn}?id={city_id},{city_id}&appid={api_key}
+        """
+        ids = ",".join(str(city_id) for city_id in cities_ids)
+
+        return f"{self.group_api_dsn}?id={ids}&appid={self.api_token}"
+
+
+class Projection:
+    """
+    **Projection**: keep only given fields of a payload, compiled once from\
+        dotted paths. Each field is stored with its last path name, or with\
+        an explicit name as "name=path". Missing fields are None.
+
+    usage:
+    ```python
+
+    cleaner = Projection(["id", "main.temp", "wind_speed=wind.speed"])
+    cleaner({"id": 1, "main": {"temp": 290.0}})
+    # {"id": 1, "temp": 290.0, "wind_speed": None}
+    ```
+
+    :param fields: dotted paths of the kept fields.
+    :param measure: count payloads bytes before and after. (default False)
+    """
+
+    def __init__(self, fields: Iterable[str], measure: bool = False) -> None:
+        self.fields = tuple(fields)
+        self.measure = measure
+        self.payloads = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._paths: list[tuple[str, str, tuple[str, ...]]] = []
+        for field in self.fields:
+            name, _, path = field.rpartition("=")
+            head, *tail = path.split(".")
+            self._paths.append(
+                (name or path.split(".")[-1], head, tuple(tail))
+            )
+
+    def __call__(self, data: dict) -> dict:
+        result = {}
+        for name, head, tail in self._paths:
+            value = data.get(head)
+            for key in tail:
+                value = value.get(key) if isinstance(value, dict) else None
+
+            result[name] = value
+
+        if self.measure:
+            self.payloads += 1
+            self.bytes_in += len(json.dumps(data, separators=(",", ":")))
+            self.bytes_out += len(json.dumps(result, separators=(",", ":")))
 
-def city_response_data_cleaner(data: dict) -> dict:
-    """Cleans all unused city fetched data"""
-    raise NotImplementedError
+        return result
+
+    def stats(self) -> dict[str, int | float]:
+        """Bytes saved by projection, when measured"""
+        saved = self.bytes_in - self.bytes_out
+
+        return {
+            "payloads": self.payloads,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved_per_payload": (
+                saved / self.payloads if self.payloads else 0.0
+            ),
+        }
+
+
+CITY_PROJECTION = ("id", "name", "main.temp", "main.humidity")
+
+city_response_data_cleaner = Projection(CITY_PROJECTION)
+
+
+class CacheStats:
+    """Cities cache hits and misses of one job, hits of both tiers"""
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.l1_hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict[str, int | float]:
+        total = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "l1_hits": self.l1_hits,
+            "redis_hits": self.hits - self.l1_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "l1_hit_ratio": self.l1_hits / total if total else 0.0,
+        }
 
 
 class CitiesFetchApiService:
@@ -78,7 +432,14 @@ class CitiesFetchApiService:
     :param request_service: async service to request data from api.
     :param redis: async redis client for cache requested data.
     :param data_cleaner: function used to keep only used fields.
-    :param hold_time: time in seconds to wait next request. (default 300s)
+    :param concurrency: cities groups fetched at same time. (default 10)
+    :param codec: codec used to encode cached data. (default json)
+    :param group_size: cities fetched by upstream request. (default 1)
+    :param lock_ttl: seconds a city fetch is locked for other processes.
+    :param cache_ttl: seconds a cached city is fresh. (default 300)
+    :param stale_ttl: seconds a stale city is served while revalidated.
+    :param l1_cache: in-process cache of decoded cities.
+    :param write_delay: seconds fetched cities wait to be cached together.
     """
 
     def __init__(
@@ -86,24 +447,63 @@ class CitiesFetchApiService:
         request_service: RequestWeatherApiService,
         redis: aioredis.Redis,
         data_cleaner: Callable[[dict], dict] = city_response_data_cleaner,
-        hold_time: int = 1,
+        concurrency: int = 10,
+        codec: RegistryCodec = get_codec("hash"),
+        group_size: int = 1,
+        lock_ttl: float = 0.0,
+        cache_ttl: int = 300,
+        stale_ttl: int = 0,
+        l1_cache: LruTtlCache | None = None,
+        write_delay: float = 0.0,
     ) -> None:
         """
         :param request_service: async service to request data from api.
         :param redis: async redis client for cache requested data.
         :param data_cleaner: function used to keep only used fields.
-        :param hold_time: time in seconds to wait next request. (default 1s)  
+        :param concurrency: cities groups fetched at same time. (default 10)
+        :param codec: codec used to encode cached data. (default json)
+        :param group_size: cities fetched by upstream request. (default 1)
+        :param lock_ttl: seconds a city fetch is locked for other\
+            processes, 0 disables it. (default 0)
+        :param cache_ttl: seconds a cached city is fresh. (default 300)
+        :param stale_ttl: seconds a city is still served after cache_ttl\
+            while it is revalidated. (default 0)
+        :param l1_cache: in-process cache of decoded cities, in front of\
+            redis. Its ttl must be shorter than cache_ttl, entries never\
+            outlive their redis freshness. Cached dicts are shared by every\
+            job and must be treated as read-only. (default None)
+        :param write_delay: seconds cities fetched by concurrent groups wait\
+            to be cached in one pipeline, so a job writes back its misses\
+            in a few round trips whatever the group size. (default 0)
         """
 
         self.request_service = request_service
         self.redis = redis
         self.data_cleaner = data_cleaner
-        self.hold_time = hold_time
+        self.concurrency = concurrency
+        self.codec = codec
+        self.group_size = group_size
+        self.lock_ttl = lock_ttl
+        self.cache_ttl = cache_ttl
+        self.stale_ttl = stale_ttl
+        self.l1_cache = l1_cache
+        self.writer = BatchLoader(self._write_many, write_delay)
+        self.unwritten: dict[int, bytes] = {}
+        self.in_flight: dict[int, asyncio.Future] = {}
+        self.background: set[asyncio.Task] = set()
+        self.coalesced = 0
 
-    async def fetch_all_list_cities(self, cities_list: list[int]):
+    async def fetch_all_list_cities(
+        self,
+        cities_list: list[int],
+        ordered: bool = False,
+        stats: CacheStats | None = None,
+    ):
         """
-        Iterates over list cities and get all data of each city and yield\
-            it await time for next request
+        Resolve all cities against cache in bulk, yield cached cities at\
+            once and fetch the misses in groups of group_size, up to\
+            concurrency groups at same time. Cities are yielded as soon as\
+            available, or in cities_list order if ordered
 
         usage:
         ```python
@@ -115,12 +515,71 @@ class CitiesFetchApiService:
         ```
 
         :param list[int] cities_list: list of ids for fetch in api
+        :param bool ordered: yield results in cities_list order
+        :param CacheStats stats: counts cache hits and misses
 
         :raises HTTPException: everytime that a city request code is not **200 OK**
         """
 
-        for city_id in cities_list:
-            yield await self.fetch_city(city_id)
+        cached = await self._cached_cities(cities_list, stats)
+        misses = [city_id for city_id in cities_list if city_id not in cached]
+        if stats is not None:
+            stats.hits += len(cities_list) - len(misses)
+            stats.misses += len(misses)
+
+        fetched = self._fetch_misses(misses, ordered)
+        try:
+            if ordered:
+                for city_id in cities_list:
+                    if city_id in cached:
+                        yield cached[city_id]
+                    else:
+                        yield await anext(fetched)
+                return
+
+            for weather_data in cached.values():
+                yield weather_data
+
+            async for weather_data in fetched:
+                yield weather_data
+        finally:
+            await fetched.aclose()
+
+    async def _fetch_misses(self, misses: list[int], ordered: bool):
+        """Fetch up to concurrency groups of missing cities at same time"""
+        groups = chunk_stream(misses, self.group_size)
+        in_flight: deque[asyncio.Task] = deque()
+
+        def fill() -> None:
+            for group in groups:
+                in_flight.append(
+                    asyncio.create_task(self.fetch_city_group(group))
+                )
+                if len(in_flight) >= self.concurrency:
+                    return
+
+        try:
+            fill()
+            while in_flight:
+                if ordered:
+                    done = [in_flight.popleft()]
+                    await done[0]
+                else:
+                    done, _ = await asyncio.wait(
+                        in_flight, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        in_flight.remove(task)
+
+                fill()
+                for task in done:
+                    for weather_data in task.result():
+                        yield weather_data
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+            await asyncio.gather(*in_flight, return_exceptions=True)
 
     async def fetch_city(self, city_id: int) -> dict:
         """
@@ -132,14 +591,589 @@ class CitiesFetchApiService:
         :raises fastapi.HTTPException: Any request with code different from **200 OK**.
         """
 
-        CITY_CACHE_KEY = f"city:cache:{city_id}"
+        if cached := await self._cached_cities([city_id]):
+            return cached[city_id]
+
+        return (await self.fetch_city_group([city_id]))[0]
+
+    async def fetch_city_group(self, cities_ids: list[int]) -> list[dict]:
+        """
+        fetch weather data from cities with one upstream request and cache\
+            them in one pipeline, results keep cities_ids order. Cities\
+            already being fetched by another job share its result.
+
+        :raises fastapi.HTTPException: Any request with code different from **200 OK**.
+        """
+
+        loop = asyncio.get_running_loop()
+        shared = {
+            city_id: self.in_flight[city_id]
+            for city_id in cities_ids
+            if city_id in self.in_flight
+        }
+        owned = {
+            city_id: loop.create_future()
+            for city_id in cities_ids
+            if city_id not in shared
+        }
+        self.in_flight.update(owned)
+        self.coalesced += len(shared)
+        try:
+            result = await self._fetch_and_cache(list(owned))
+        except BaseException as error:
+            for future in owned.values():
+                if isinstance(error, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(error)
+                    # retrieved, waiters are optional
+                    future.exception()
+
+            raise
+        else:
+            for city_id, future in owned.items():
+                future.set_result(result[city_id])
+        finally:
+            for city_id in owned:
+                del self.in_flight[city_id]
+
+        if shared:
+            await asyncio.wait(shared.values())
+            retry = [
+                city_id
+                for city_id, future in shared.items()
+                if future.cancelled()
+            ]
+            # fetching job was cancelled, fetch it here
+            if retry:
+                result.update(zip(retry, await self.fetch_city_group(retry)))
+
+            for city_id, future in shared.items():
+                if city_id not in result:
+                    result[city_id] = future.result()
+
+        return [result[city_id] for city_id in cities_ids]
+
+    async def _fetch_and_cache(self, cities_ids: list[int]) -> dict[int, dict]:
+        """
+        Fetch cities from upstream and cache them. With lock_ttl, cities\
+            locked by other processes are awaited in cache instead.
+        """
+        if not cities_ids:
+            return {}
+
+        if not self.lock_ttl:
+            return await self._fetch_and_store(cities_ids)
 
-        if json_str := await self.redis.getex(CITY_CACHE_KEY):
-            return json.loads(json_str)
-        
-        weather_data = await self.request_service.fetch_city(city_id)
-        weather_data = self.data_cleaner(weather_data)
-        await self.redis.setex(CITY_CACHE_KEY, 300, json.dumps(weather_data)) 
-        await asyncio.sleep(self.hold_time)
+        token = uuid.uuid4().hex
+        locks = await self._lock_cities(cities_ids, token)
+        try:
+            result = await self._wait_cached(
+                [city_id for city_id in cities_ids if not locks[city_id]]
+            )
+            fetched = await self._fetch_and_store(
+                [city_id for city_id in cities_ids if city_id not in result]
+            )
+        finally:
+            await self._unlock_cities(
+                [city_id for city_id, locked in locks.items() if locked],
+                token,
+            )
+
+        return {**result, **fetched}
+
+    async def _fetch_and_store(self, cities_ids: list[int]) -> dict[int, dict]:
+        """
+        Fetch cities from upstream and write them to cache, along with\
+            cities fetched by other groups in write_delay seconds. Returns\
+            once they are cached, so lock waiters find them.
+        """
+        fetched = {
+            city_id: self.data_cleaner(weather_data)
+            for city_id, weather_data in (
+                await self._fetch_upstream(cities_ids)
+            ).items()
+        }
+        for city_id, weather_data in fetched.items():
+            encoded = self.unwritten[city_id] = self.codec.dumps(weather_data)
+            if self.l1_cache is not None:
+                self.l1_cache.set(
+                    city_id, weather_data, len(encoded), self.cache_ttl
+                )
+
+        await asyncio.gather(*map(self.writer.load, fetched))
+
+        return fetched
+
+    async def _write_many(self, cities_ids: list[int]) -> dict:
+        """Cache pending cities in one pipeline"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for city_id in cities_ids:
+                pipe.setex(
+                    CITY_CACHE_KEY.format(city_id=city_id),
+                    self.cache_ttl + self.stale_ttl,
+                    self.unwritten.pop(city_id),
+                )
+
+            await pipe.execute()
+
+        return {}
+
+    async def _lock_cities(
+        self, cities_ids: list[int], token: str
+    ) -> dict[int, bool]:
+        """Take cities fetch locks shared by all processes"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for city_id in cities_ids:
+                pipe.set(
+                    CITY_LOCK_KEY.format(city_id=city_id),
+                    token,
+                    nx=True,
+                    px=int(self.lock_ttl * 1000),
+                )
+
+            locked = await pipe.execute()
+
+        return dict(zip(cities_ids, map(bool, locked)))
+
+    async def _unlock_cities(self, cities_ids: list[int], token: str) -> None:
+        """Release cities locks still held by token, expired ones are kept"""
+        if not cities_ids:
+            return
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for city_id in cities_ids:
+                pipe.eval(
+                    DELETE_IF_EQUAL_SCRIPT,
+                    1,
+                    CITY_LOCK_KEY.format(city_id=city_id),
+                    token,
+                )
+
+            await pipe.execute()
+
+    async def _wait_cached(self, cities_ids: list[int]) -> dict[int, dict]:
+        """Wait up to lock_ttl cities fetched by other processes"""
+        result = {}
+        deadline = time.monotonic() + self.lock_ttl
+        while cities_ids and time.monotonic() < deadline:
+            await asyncio.sleep(CITY_LOCK_POLL_INTERVAL)
+            result.update(await self._cached_cities(cities_ids))
+            cities_ids = [
+                city_id for city_id in cities_ids if city_id not in result
+            ]
+
+        return result
+
+    async def close(self) -> None:
+        """Cancel background revalidations, then close request service"""
+        tasks = list(self.background)
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.request_service.close()
+
+    def stats(self) -> dict:
+        """Cities fetched by another job instead of upstream, L1 usage"""
+
+        return {
+            "in_flight": len(self.in_flight),
+            "coalesced": self.coalesced,
+            "l1_cache": (
+                None if self.l1_cache is None else self.l1_cache.stats()
+            ),
+            "projection": (
+                self.data_cleaner.stats()
+                if isinstance(self.data_cleaner, Projection)
+                and self.data_cleaner.measure
+                else None
+            ),
+        }
+
+    async def _cached_cities(
+        self, cities_ids: list[int], stats: CacheStats | None = None
+    ) -> dict[int, dict]:
+        """
+        Cached cities data, from in-process cache first then one MGET per\
+            chunk of remaining cities. Stale cities are returned and\
+            revalidated in background.
+        """
+        result, stale = {}, []
+        cities_ids = list(dict.fromkeys(cities_ids))
+        if self.l1_cache is not None:
+            for city_id in cities_ids:
+                if (weather_data := self.l1_cache.get(city_id)) is not None:
+                    result[city_id] = weather_data
+
+            cities_ids = [
+                city_id for city_id in cities_ids if city_id not in result
+            ]
+            if stats is not None:
+                stats.l1_hits += len(result)
+
+        for chunk in chunk_stream(cities_ids, CACHE_MGET_SIZE):
+            keys = [
+                CITY_CACHE_KEY.format(city_id=city_id) for city_id in chunk
+            ]
+            if not self.stale_ttl and self.l1_cache is None:
+                values = await self.redis.mget(keys)
+                for city_id, cached in zip(chunk, values):
+                    if cached:
+                        result[city_id] = loads_payload(cached)
+
+                continue
+
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.mget(keys)
+                for key in keys:
+                    pipe.pttl(key)
+
+                values, *ttls = await pipe.execute()
+
+            for city_id, cached, ttl in zip(chunk, values, ttls):
+                if not cached:
+                    continue
+
+                if 0 <= ttl < self.stale_ttl * 1000:
+                    # not kept in process while revalidated
+                    result[city_id] = loads_payload(cached)
+                    stale.append(city_id)
+                else:
+                    result[city_id] = self._decode(
+                        city_id,
+                        cached,
+                        None if ttl < 0 else ttl / 1000 - self.stale_ttl,
+                    )
+
+        self._revalidate(stale)
+
+        return result
+
+    def _decode(
+        self, city_id: int, cached: bytes, fresh_for: float | None = None
+    ) -> dict:
+        """
+        Decode cached city keeping it in process cache, up to the seconds\
+            it is still fresh in redis
+        """
+        weather_data = loads_payload(cached)
+        if self.l1_cache is not None:
+            self.l1_cache.set(city_id, weather_data, len(cached), fresh_for)
 
         return weather_data
+
+    def _revalidate(self, cities_ids: list[int]) -> None:
+        """Refresh stale cities in background tasks"""
+        cities_ids = [
+            city_id for city_id in cities_ids if city_id not in self.in_flight
+        ]
+        for group in chunk_stream(cities_ids, self.group_size):
+            task = asyncio.create_task(self.fetch_city_group(group))
+            self.background.add(task)
+            task.add_done_callback(self._revalidated)
+
+    def _revalidated(self, task: asyncio.Task) -> None:
+        self.background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(
+                "Stale cities revalidation failed", exc_info=task.exception()
+            )
+
+    async def expiring_cities(
+        self, cities_ids: list[int], margin: float
+    ) -> list[int]:
+        """Cities missing in cache or fresh for less than margin seconds"""
+        result = []
+        for chunk in chunk_stream(cities_ids, CACHE_MGET_SIZE):
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for city_id in chunk:
+                    pipe.pttl(CITY_CACHE_KEY.format(city_id=city_id))
+
+                ttls = await pipe.execute()
+
+            result.extend(
+                city_id
+                for city_id, ttl in zip(chunk, ttls)
+                if ttl < (self.stale_ttl + margin) * 1000
+            )
+
+        return result
+
+    async def refresh_cities(self, cities_ids: list[int]) -> int:
+        """Fetch cities from upstream and cache them, ignoring cache"""
+        refreshed = 0
+        async for _ in self._fetch_misses(cities_ids, ordered=False):
+            refreshed += 1
+
+        return refreshed
+
+    async def _fetch_upstream(self, cities_ids: list[int]) -> dict[int, dict]:
+        """
+        Fetch cities with group request, one by one when group request is\
+            rejected. Throttled and unavailable upstream errors are raised,\
+            single requests would only multiply them.
+        """
+        result = {}
+        if len(cities_ids) > 1:
+            try:
+                result = await self.request_service.fetch_group(cities_ids)
+            except Exception as error:
+                if is_upstream_unavailable(error):
+                    raise
+
+                logger.warning(
+                    "Group request failed, fetching %s cities one by one",
+                    len(cities_ids),
+                    exc_info=True,
+                )
+
+        missing = [city_id for city_id in cities_ids if city_id not in result]
+        for city_id, weather_data in zip(
+            missing,
+            await asyncio.gather(
+                *map(self.request_service.fetch_city, missing)
+            ),
+        ):
+            result[city_id] = weather_data
+
+        return result
+
+
+def _cities_fetch_service_builder(
+    settings: ConsumerSettings, redis: aioredis.Redis
+) -> CitiesFetchApiService:
+    """Fetch service configured from settings, sharing upstream session"""
+    weather_api = RequestWeatherApiService(
+        settings,
+        # shared by every consumer and cache warmer process
+        rate_limiter=RedisTokenBucket(
+            redis,
+            settings.weather_api_rate_key,
+            settings.weather_api_rate,
+            settings.weather_api_burst,
+        ),
+    )
+    weather_api.open()
+    l1_cache = None
+    if settings.weather_cache_l1_size or settings.weather_cache_l1_bytes:
+        l1_cache = LruTtlCache(
+            settings.weather_cache_l1_size or sys.maxsize,
+            settings.weather_cache_l1_ttl,
+            settings.weather_cache_l1_bytes,
+        )
+
+    return CitiesFetchApiService(
+        weather_api,
+        redis,
+        concurrency=settings.weather_api_concurrency,
+        codec=get_codec(settings.weather_cache_codec),
+        group_size=weather_api.group_size,
+        lock_ttl=settings.weather_cache_lock_ttl,
+        cache_ttl=settings.weather_cache_ttl,
+        stale_ttl=settings.weather_cache_stale_ttl,
+        l1_cache=l1_cache,
+        write_delay=settings.weather_cache_write_delay,
+        data_cleaner=Projection(
+            settings.weather_api_projection,
+            settings.weather_api_projection_stats,
+        ),
+    )
+
+
+class CitiesCacheWarmer:
+    """
+    **CitiesCacheWarmer**: refresh every stored city in cache shortly\
+        before it expires, so user jobs never wait for upstream.
+
+    :param fetch_service: service used to refresh cities, its request\
+        service redis rate limiter is shared with consumers, keeping\
+        warmer in upstream quota.
+    :param city_info_repo: repository with all cities to refresh.
+    :param margin: seconds before expiration a city is refreshed.
+    """
+
+    def __init__(
+        self,
+        fetch_service: CitiesFetchApiService,
+        city_info_repo: CityInfoRepository,
+        margin: float = 60.0,
+    ) -> None:
+        self.fetch_service = fetch_service
+        self.city_info_repo = city_info_repo
+        self.margin = margin
+
+    async def warm(self) -> int:
+        """Refresh cities expiring in margin seconds, return refreshed"""
+        cities = await self.city_info_repo.all_cities()
+        expiring = await self.fetch_service.expiring_cities(
+            [city.api_id for city in cities], self.margin
+        )
+
+        return await self.fetch_service.refresh_cities(expiring)
+
+    async def run(self, stop: asyncio.Event) -> None:
+        """Warm cache every half margin seconds until stop is set"""
+        while not stop.is_set():
+            try:
+                refreshed = await self.warm()
+                logger.info("Cities cache warmer refreshed %s", refreshed)
+            except Exception:
+                logger.exception("Cities cache warmer failed")
+
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop.wait(), max(self.margin / 2, 1))
+
+
+class UserCitiesRequestService:
+    """
+    **UserCitiesRequestService**: process one user cities request, fetching\
+        weather from every stored city and saving it for the user.
+
+    :param fetch_service: service used to fetch cities weather.
+    :param user_repo: repository to update user request progress.
+    :param city_info_repo: repository with all cities to fetch.
+    :param user_city_data_repo: repository where results are stored.
+    :param buffer_size: registries buffered before write, job chunks are\
+        written at once. (default 50)
+    :param buffer_delay: max seconds a result waits write. (default 100ms)
+    :param job_ttl: seconds job chunks progress is kept. (default 3600)
+    """
+
+    def __init__(
+        self,
+        fetch_service: CitiesFetchApiService,
+        user_repo: UserRepository,
+        city_info_repo: CityInfoRepository,
+        user_city_data_repo: UserCityDataRepository,
+        buffer_size: int = 50,
+        buffer_delay: float = 0.1,
+        job_ttl: int = 3600,
+    ) -> None:
+        self.fetch_service = fetch_service
+        self.user_repo = user_repo
+        self.city_info_repo = city_info_repo
+        self.user_city_data_repo = user_city_data_repo
+        self.buffer_size = buffer_size
+        self.buffer_delay = buffer_delay
+        self.job_ttl = job_ttl
+
+    async def __call__(self, job: UserJob | User) -> None:
+        """
+        Process user request job, a whole request is processed from start\
+            to end, a chunk only stores its cities and the last one to\
+            complete the request marks it as processed. Jobs no longer in\
+            flight and chunks already completed are skipped.
+        """
+
+        if isinstance(job, User):
+            job = UserJob(user=job)
+
+        user = job.user
+        if job.job_id is not None and (
+            not await self.user_repo.is_current_job(user.index, job.job_id)
+            or job.cities is not None
+            and await self.user_repo.is_chunk_completed(
+                user.index, job.job_id, job.cities
+            )
+        ):
+            # duplicated message of a job or chunk already finished
+            await self.user_repo.skip_stale_job()
+            return
+
+        try:
+            await self._process(job)
+        except Exception:
+            if job.job_id is None:
+                raise
+
+            if job.cities is None:
+                await self.user_repo.release_job(user.index, job.job_id)
+                raise
+
+            # failed chunk is dropped, remaining chunks still finish the job
+            await self.user_repo.fail_chunk()
+            if await self.user_repo.complete_chunk(
+                user.index,
+                job.job_id,
+                job.cities,
+                job.total or 0,
+                self.job_ttl,
+            ):
+                await self._finish(job)
+
+            raise
+
+    async def _process(self, job: UserJob) -> None:
+        user = job.user
+        if job.cities is None:
+            await self.user_repo.start_processing(user)
+            await self.user_city_data_repo.remove_all_user_city_data(user)
+            cities = await self.city_info_repo.all_cities()
+            total = len(cities)
+        else:
+            cities = await self.city_info_repo.get_cities(*job.cities)
+            total = job.total
+
+        async def notify_progress(counters: dict[str, dict[str, int]]) -> None:
+            if (counter := counters.get(user.db_index())) is not None:
+                user.processed = counter["processed"]
+                await self.user_repo.notify_progress(
+                    user.index, user.processed
+                )
+
+        cache_stats = CacheStats()
+        weather = self.fetch_service.fetch_all_list_cities(
+            [city.api_id for city in cities], stats=cache_stats
+        )
+        if job.cities is not None and job.job_id is not None:
+            # stored along with its completion, a redelivered chunk (after a
+            # drain or a dead consumer) never writes its cities twice
+            registries = [
+                UserCityData.build_from(user.index, weather_data)
+                async for weather_data in weather
+            ]
+            finished = await self.user_repo.complete_chunk(
+                user.index,
+                job.job_id,
+                job.cities,
+                total or 0,
+                self.job_ttl,
+                registries,
+            )
+        else:
+            async with WriteBehindBuffer(
+                self.user_repo.database_manager,
+                self.buffer_size,
+                self.buffer_delay,
+                notify_progress,
+            ) as buffer:
+                async for weather_data in weather:
+                    await buffer.insert(
+                        UserCityData.build_from(user.index, weather_data)
+                    )
+                    await buffer.increment(User, user.index, "processed")
+
+            # whole request, or legacy chunk without job id counted by
+            # processed cities
+            finished = job.cities is None or (user.processed or 0) >= (
+                total or 0
+            )
+
+        logger.info(
+            "User %s job %s cities cache: %s",
+            user.index,
+            job.job_id,
+            cache_stats.stats(),
+        )
+        if finished:
+            await self._finish(job)
+
+    async def _finish(self, job: UserJob) -> None:
+        """
+        Mark user request processed and allow new requests, processed keeps\
+            the cities actually stored, failed chunks are not counted
+        """
+        await self.user_repo.finish_processing(job.user)
+        if job.job_id is not None:
+            await self.user_repo.release_job(job.user.index, job.job_id)
@@ -4,15 +4,44 @@ from functools import lru_cache
 from typing import Annotated
 
 from fastapi import Depends
-from pydantic import AmqpDsn, AnyUrl, Field, RedisDsn
+from pydantic import (
+    AmqpDsn,
+    AnyUrl,
+    Field,
+    RedisDsn,
+    field_validator,
+    model_validator,
+)
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
+RATE_LIMIT_PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+
+
 class ApiSettings(BaseSettings):
     app_env: str = "dev"
     redis_url: RedisDsn = Field(alias="REDIS_DSN")
-    amqp_url: AmqpDsn = Field(alias="AMQP_DSN")
+    amqp_url: AmqpDsn | None = Field(None, alias="AMQP_DSN")
     queue_name: str = Field(min_length=1)
+    queue_transport: str = Field("amqp", pattern="^(amqp|redis)$")
+    amqp_channel_pool_size: int = Field(4, ge=1)
+    amqp_prefetch_count: int = Field(10, ge=1)
+    queue_consumer_concurrency: int = Field(10, ge=1)
+    queue_drain_timeout: float = Field(30.0, ge=0)
+    queue_job_chunk_size: int = Field(0, ge=0)
+    queue_job_ttl: int = Field(3600, ge=1)
+    queue_load_delay: float = Field(0.005, ge=0)
+    queue_stream_group: str = Field("consumers", min_length=1)
+    queue_stream_block: float = Field(1.0, gt=0)
+    queue_stream_claim_idle: float = Field(60.0, gt=0)
+    queue_stream_maxlen: int = Field(0, ge=0)
+    redis_max_connections: int = Field(50, ge=1)
+    redis_socket_timeout: float = Field(5.0, gt=0)
+    redis_socket_connect_timeout: float = Field(5.0, gt=0)
+    redis_health_check_interval: int = Field(30, ge=0)
+    registry_cache_size: int = Field(1024, ge=0)
+    registry_cache_ttl: float = Field(2.0, ge=0)
+    registry_cache_channel: str = Field("registry:invalidate", min_length=1)
 
     @property
     def redis_dsn(self) -> str:
@@ -23,17 +52,90 @@ class ApiSettings(BaseSettings):
     def amqp_dsn(self) -> str:
         return str(self.amqp_url)
 
+    @model_validator(mode="after")
+    def check_queue_transport(self) -> "ApiSettings":
+        if self.queue_transport == "amqp" and self.amqp_url is None:
+            raise ValueError("AMQP_DSN is required by amqp queue transport")
+
+        return self
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
 
 class ConsumerSettings(ApiSettings):
     weather_api_endpoint: AnyUrl
+    weather_api_group_endpoint: AnyUrl | None = None
+    weather_api_group_size: int = Field(20, ge=1, le=20)
     weather_api_token: str = Field(min_length=1)
+    write_buffer_size: int = Field(50, ge=1)
+    write_buffer_delay: float = Field(0.1, gt=0)
+    weather_cache_codec: str = Field("zlib", pattern="^(hash|packed|zlib)$")
+    weather_cache_lock_ttl: float = Field(0.0, ge=0)
+    weather_cache_ttl: int = Field(300, ge=1)
+    weather_cache_stale_ttl: int = Field(0, ge=0)
+    weather_cache_refresh_margin: float = Field(60.0, gt=0)
+    weather_cache_write_delay: float = Field(0.005, ge=0)
+    weather_cache_l1_size: int = Field(0, ge=0)
+    weather_cache_l1_bytes: int = Field(0, ge=0)
+    weather_cache_l1_ttl: float = Field(30.0, gt=0)
+    weather_api_projection: list[str] = Field(
+        ["id", "name", "main.temp", "main.humidity"], min_length=1
+    )
+    weather_api_projection_stats: bool = False
+    weather_api_concurrency: int = Field(10, ge=1)
+    weather_api_rate_limit: str = Field(
+        "60/minute", pattern=r"^\d+(\.\d+)?/(second|minute|hour)$"
+    )
+    weather_api_burst: int = Field(1, ge=1)
+    weather_api_rate_key: str = Field("rate:weather_api", min_length=1)
+    weather_api_max_connections: int = Field(20, ge=1)
+    weather_api_connections_per_host: int = Field(10, ge=1)
+    weather_api_dns_cache_ttl: int = Field(300, ge=0)
+    weather_api_keepalive_timeout: float = Field(30.0, gt=0)
+    weather_api_timeout: float = Field(10.0, gt=0)
+    weather_api_connect_timeout: float = Field(3.0, gt=0)
+    weather_api_retries: int = Field(3, ge=0)
+    weather_api_throttle_timeout: float = Field(300.0, ge=0)
+    weather_api_backoff_base: float = Field(0.5, gt=0)
+    weather_api_backoff_max: float = Field(30.0, gt=0)
+    weather_api_breaker_threshold: int = Field(5, ge=1)
+    weather_api_breaker_reset: float = Field(30.0, gt=0)
 
     @property
     def weather_api_dsn(self) -> str:
         return str(self.weather_api_endpoint)
 
+    @property
+    def weather_api_group_dsn(self) -> str | None:
+        if self.weather_api_group_endpoint is None:
+            return None
+
+        return str(self.weather_api_group_endpoint)
+
+    @property
+    def weather_api_rate(self) -> float:
+        """Upstream quota as requests per second"""
+        amount, period = self.weather_api_rate_limit.split("/")
+        return float(amount) / RATE_LIMIT_PERIODS[period]
+
+    @model_validator(mode="after")
+    def check_l1_ttl(self) -> "ConsumerSettings":
+        l1_enabled = self.weather_cache_l1_size or self.weather_cache_l1_bytes
+        if l1_enabled and self.weather_cache_l1_ttl >= self.weather_cache_ttl:
+            raise ValueError(
+                "weather_cache_l1_ttl must be shorter than weather_cache_ttl"
+            )
+
+        return self
+
+    @field_validator("weather_api_rate_limit")
+    @classmethod
+    def check_rate_limit(cls, value: str) -> str:
+        if float(value.split("/")[0]) <= 0:
+            raise ValueError("weather_api_rate_limit amount must be positive")
+
+        return value
+
 
 @lru_cache
 def _api_settings_builder() -> ApiSettings:
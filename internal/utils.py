@@ -1,8 +1,10 @@
 import asyncio
 import functools
+import signal
+import time
 
 from concurrent.futures import ThreadPoolExecutor
-from typing import TypeVar, Callable, Iterable, Generator
+from typing import Awaitable, TypeVar, Callable, Hashable, Iterable, Generator
 
 
 CLS = TypeVar("CLS")
@@ -49,3 +51,197 @@ def chunk_stream(iterable: Iterable, chunk_size: int) -> Generator:
 
     if len(chunck) > 0:
         yield chunck
+
+
+def stop_on_signals(*signals: signal.Signals) -> asyncio.Event:
+    """Event set when running loop receives any of given signals"""
+
+    event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in signals or (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, event.set)
+
+    return event
+
+
+class BatchLoader:
+    """
+    Coalesce loads requested within delay seconds in one load_many call,\
+        load_many receives the keys and returns a dict of key to value.
+        Missing keys load None.
+    """
+
+    def __init__(
+        self,
+        load_many: Callable[[list], Awaitable[dict]],
+        delay: float = 0.0,
+    ) -> None:
+        self.load_many = load_many
+        self.delay = delay
+        self.pending: dict[Hashable, asyncio.Future] = {}
+        self._dispatcher: asyncio.Task | None = None
+
+    async def load(self, key: Hashable):
+        if key not in self.pending:
+            self.pending[key] = asyncio.get_running_loop().create_future()
+
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        # shielded, a cancelled caller must not cancel the others
+        return await asyncio.shield(self.pending[key])
+
+    async def _dispatch(self) -> None:
+        await asyncio.sleep(self.delay)
+        batch, self.pending, self._dispatcher = self.pending, {}, None
+        try:
+            values = await self.load_many(list(batch))
+        except Exception as error:
+            for future in batch.values():
+                future.set_exception(error)
+            return
+
+        for key, future in batch.items():
+            future.set_result(values.get(key))
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, refills rate tokens per second up to\
+        capacity (burst size). Waiters are served in arrival order.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """Wait until tokens are available and take them"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated_at) * self.rate,
+                )
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+TOKEN_BUCKET_SCRIPT = """
+redis.replicate_commands()
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated_at, 0) * rate)
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated_at", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket:
+    """
+    Token bucket rate limiter kept in redis, shared by every process using\
+        the same key. Refill uses redis clock, so hosts clocks may differ.
+    """
+
+    def __init__(
+        self, redis, key: str, rate: float, capacity: float = 1.0
+    ) -> None:
+        self.redis = redis
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """Wait until tokens are available and take them"""
+        while True:
+            wait = float(
+                await self.redis.eval(
+                    TOKEN_BUCKET_SCRIPT,
+                    1,
+                    self.key,
+                    self.rate,
+                    self.capacity,
+                    tokens,
+                )
+            )
+            if wait <= 0:
+                return
+
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker, opens after failure_threshold consecutive failures\
+        and fails fast for reset_timeout seconds. Then lets one trial call\
+        through (half open), closing on success and opening again on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self, failure_threshold: int = 5, reset_timeout: float = 30.0
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.state = self.CLOSED
+        self._trial = False
+
+    def allow(self) -> bool:
+        """Whether a call can be made now"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+
+            self.state = self.HALF_OPEN
+            self._trial = False
+
+        if self.state == self.HALF_OPEN:
+            if self._trial:
+                return False
+
+            self._trial = True
+
+        return True
+
+    def release(self) -> None:
+        """End a call, let another trial through if it left no outcome"""
+        self._trial = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.state = self.CLOSED
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if (
+            self.state == self.HALF_OPEN
+            or self.failures >= self.failure_threshold
+        ):
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
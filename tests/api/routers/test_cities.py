@@ -0,0 +1,285 @@
+import asyncio
+from itertools import count
+
+from fastapi import HTTPException
+import pytest
+from pytest_mock import MockerFixture
+
+from api.routers.cities import (
+    JOB_ID_HEADER,
+    get_user_citie_request_page,
+    request_start_process_cities,
+    request_start_process_cities_batch,
+    stream_request_processed_percentage,
+    stream_user_citie_request,
+)
+from internal.models import User, UserCityData
+from tests.internal.test_settings import api_settings_factory
+
+
+def build_user_repo(mocker: MockerFixture, *users: User):
+    """User repository keeping one in flight job per user, as redis does"""
+    held: dict[int, str] = {}
+    job_ids = count(1)
+    user_repo = mocker.AsyncMock()
+    user_repo.get_user.side_effect = lambda index: users[index - 1]
+    user_repo.get_users.side_effect = lambda *indexes: [
+        users[index - 1] for index in indexes
+    ]
+
+    async def acquire_jobs(users: list[User], ttl: int):
+        result = {}
+        for user in users:
+            is_new = user.index not in held
+            if is_new:
+                held[user.index] = f"job-{next(job_ids)}"
+
+            result[user.index] = (held[user.index], is_new)
+
+        return result
+
+    async def release_job(index: int, job_id: str) -> None:
+        if held.get(index) == job_id:
+            del held[index]
+
+    async def start_processing(user: User) -> None:
+        user.processed, user.processed_at = 0, None
+
+    user_repo.acquire_jobs.side_effect = acquire_jobs
+    user_repo.release_job.side_effect = release_job
+    user_repo.start_processing.side_effect = start_processing
+
+    return user_repo, held
+
+
+def test_request_start_process_cities_releases_job_on_failure(
+    mocker: MockerFixture,
+) -> None:
+    user = User(index=1, created_at="2024-02-02")
+    user_repo, held = build_user_repo(mocker, user)
+    queue_manager = mocker.AsyncMock()
+    queue_manager.enqueue_users.side_effect = [ConnectionError(), None]
+
+    async def request():
+        return await request_start_process_cities(
+            1,
+            api_settings_factory(),
+            user_repo,
+            mocker.AsyncMock(),
+            mocker.AsyncMock(),
+            queue_manager,
+        )
+
+    async def do_test():
+        with pytest.raises(ConnectionError):
+            await request()
+
+        # job never queued is not kept as in flight
+        assert {} == held
+
+        response = await request()
+        assert 2 == queue_manager.enqueue_users.await_count
+        assert held[1] == response.headers[JOB_ID_HEADER]
+
+    asyncio.run(do_test())
+
+
+def test_request_start_process_cities_resets_progress(
+    mocker: MockerFixture,
+) -> None:
+    user = User(
+        index=1, created_at="2024-02-02", processed=3, processed_at="2024"
+    )
+    user_repo, _ = build_user_repo(mocker, user)
+    queue_manager = mocker.AsyncMock()
+    settings = api_settings_factory()
+
+    async def request():
+        return await request_start_process_cities(
+            1,
+            settings,
+            user_repo,
+            mocker.AsyncMock(),
+            mocker.AsyncMock(),
+            queue_manager,
+        )
+
+    async def do_test():
+        response = await request()
+        assert 204 == response.status_code
+        # whole user jobs don't report previous request progress
+        assert (0, None) == (user.processed, user.processed_at)
+        user_repo.update_user.assert_awaited_once_with(user)
+        queue_manager.enqueue_users.assert_awaited_once_with(
+            [user], job_ids={1: response.headers[JOB_ID_HEADER]}
+        )
+
+        # repeated request while in flight gets the same job
+        repeated = await request()
+        assert (
+            response.headers[JOB_ID_HEADER] == repeated.headers[JOB_ID_HEADER]
+        )
+        queue_manager.enqueue_users.assert_awaited_once()
+        user_repo.start_processing.assert_awaited_once()
+
+    asyncio.run(do_test())
+
+
+def test_request_start_process_cities_batch(mocker: MockerFixture) -> None:
+    users = [User(index=idx, created_at="2024-02-02") for idx in (1, 2)]
+    user_repo, held = build_user_repo(mocker, *users)
+    user_city_data_repo = mocker.AsyncMock()
+    city_info_repo = mocker.AsyncMock()
+    city_info_repo.total_of_cities.return_value = 5
+    queue_manager = mocker.AsyncMock()
+    settings = api_settings_factory()
+    settings.queue_job_chunk_size = 2
+
+    async def do_test():
+        response = await request_start_process_cities_batch(
+            settings,
+            user_repo,
+            user_city_data_repo,
+            city_info_repo,
+            queue_manager,
+            [1, 2, 1],
+        )
+        assert 204 == response.status_code
+        user_repo.get_users.assert_awaited_once_with(1, 2)
+        assert 2 == user_repo.start_processing.await_count
+        assert 2 == user_city_data_repo.remove_all_user_city_data.await_count
+        queue_manager.enqueue_users.assert_awaited_once_with(users, 5, 2, held)
+
+        user_repo.get_users.side_effect = None
+        user_repo.get_users.return_value = users[:1]
+        with pytest.raises(HTTPException) as error:
+            await request_start_process_cities_batch(
+                settings,
+                user_repo,
+                user_city_data_repo,
+                city_info_repo,
+                queue_manager,
+                [1, 3],
+            )
+
+        assert 404 == error.value.status_code
+
+    asyncio.run(do_test())
+
+
+def test_stream_request_processed_percentage(mocker: MockerFixture) -> None:
+    user_repo = mocker.AsyncMock()
+    user_repo.get_user_with_total_cities.side_effect = [
+        (User(index=1, created_at="2024-02-02"), 4),
+        (User(index=1, created_at="2024-02-02", processed=2), 4),
+    ]
+
+    async def iter_progress(index: int):
+        for processed in (1, 1, None, 4):
+            yield processed
+
+        raise AssertionError("stream read after request was processed")
+
+    user_repo.iter_progress = iter_progress
+
+    async def do_test():
+        response = await stream_request_processed_percentage(1, user_repo)
+        assert "text/event-stream" == response.media_type
+        # repeated progress is sent once, heartbeats resync from database
+        assert [
+            "data: 0\n\n",
+            "data: 25\n\n",
+            ": keep-alive\n\n",
+            "data: 50\n\n",
+            "data: 100\n\n",
+        ] == [event async for event in response.body_iterator]
+
+    asyncio.run(do_test())
+
+
+def test_stream_request_processed_percentage_finished(
+    mocker: MockerFixture,
+) -> None:
+    user_repo = mocker.AsyncMock()
+    user_repo.get_user_with_total_cities.return_value = (
+        User(index=1, created_at="2024-02-02", processed=3, processed_at="x"),
+        4,
+    )
+    user_repo.iter_progress = mocker.MagicMock()
+
+    async def do_test():
+        response = await stream_request_processed_percentage(1, user_repo)
+        # finished with failed cities, closed without waiting progress
+        assert ["data: 75\n\n"] == [
+            event async for event in response.body_iterator
+        ]
+        user_repo.iter_progress.assert_not_called()
+
+    asyncio.run(do_test())
+
+
+def build_result_repos(mocker: MockerFixture, processed_at: str | None):
+    user_repo = mocker.AsyncMock()
+    user_repo.get_user.return_value = User(
+        index=1, created_at="2024-02-02", processed_at=processed_at
+    )
+    registries = [
+        UserCityData(
+            index=idx,
+            user_id=1,
+            request_time="2024-02-02",
+            payload={"id": idx},
+        )
+        for idx in (1, 2)
+    ]
+
+    return user_repo, mocker.AsyncMock(), registries
+
+
+def test_get_user_citie_request_page(mocker: MockerFixture) -> None:
+    user_repo, user_city_data, registries = build_result_repos(mocker, "x")
+    user_city_data.page_user_city_data.return_value = (registries, 3)
+
+    async def do_test():
+        page = await get_user_citie_request_page(
+            1, user_repo, user_city_data, 0, 2
+        )
+        assert registries == page.items
+        assert 3 == page.next_cursor
+        user_city_data.page_user_city_data.assert_awaited_once_with(
+            user_repo.get_user.return_value, 0, 2
+        )
+
+        user_repo.get_user.return_value.processed_at = None
+        with pytest.raises(HTTPException) as error:
+            await get_user_citie_request_page(
+                1, user_repo, user_city_data, 0, 2
+            )
+
+        assert 425 == error.value.status_code
+
+    asyncio.run(do_test())
+
+
+def test_stream_user_citie_request(mocker: MockerFixture) -> None:
+    user_repo, user_city_data, registries = build_result_repos(mocker, "x")
+
+    async def iter_user_city_data(user: User, chunk_size: int):
+        assert 50 == chunk_size
+        for registry in registries:
+            yield registry
+
+    user_city_data.iter_user_city_data = iter_user_city_data
+
+    async def do_test():
+        response = await stream_user_citie_request(
+            1, user_repo, user_city_data, 50
+        )
+        assert "application/x-ndjson" == response.media_type
+        lines = [line async for line in response.body_iterator]
+        assert [
+            registry.model_dump_json() + "\n" for registry in registries
+        ] == lines
+        assert '"data":"{\\"id\\": 1}"' in lines[0]
+
+    asyncio.run(do_test())
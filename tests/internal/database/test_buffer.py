@@ -0,0 +1,136 @@
+import asyncio
+
+from pytest_mock.plugin import MockerFixture
+
+from internal.database.buffer import WriteBehindBuffer
+from internal.models import User, UserCityData
+from tests.internal.database.test_manager import build_manager
+
+USER_KEY = f"{User.table_name()}_1"
+
+
+def build_buffer(mocker: MockerFixture, **kwargs) -> WriteBehindBuffer:
+    manager = mocker.MagicMock()
+    manager.write_batch = mocker.AsyncMock()
+    manager.write_batch.return_value = {}
+    manager._registry_index_factory = lambda model, idx: (
+        f"{model.table_name()}_{idx}"
+    )
+
+    return WriteBehindBuffer(manager, **kwargs)
+
+
+def user_city_data() -> UserCityData:
+    return UserCityData.build_from(1, {"hello": "world!"})
+
+
+def test_write_behind_buffer_flush_on_size(mocker: MockerFixture) -> None:
+    async def do_test():
+        buffer = build_buffer(mocker, max_size=2, max_delay=60)
+        first, second = user_city_data(), user_city_data()
+        await buffer.insert(first)
+        buffer.manager.write_batch.assert_not_called()
+        await buffer.insert(second)
+        buffer.manager.write_batch.assert_awaited_once_with(
+            [first, second], {}
+        )
+        assert len(buffer) == 0
+
+    asyncio.run(do_test())
+
+
+def test_write_behind_buffer_flush_on_deadline(mocker: MockerFixture) -> None:
+    async def do_test():
+        buffer = build_buffer(mocker, max_size=50, max_delay=0.01)
+        registry = user_city_data()
+        await buffer.insert(registry)
+        await buffer.increment(User, 1, "processed")
+        buffer.manager.write_batch.assert_not_called()
+        await asyncio.sleep(0.05)
+        buffer.manager.write_batch.assert_awaited_once_with(
+            [registry], {USER_KEY: {"processed": 1}}
+        )
+
+    asyncio.run(do_test())
+
+
+def test_write_behind_buffer_coalesce_increments(
+    mocker: MockerFixture,
+) -> None:
+    async def do_test():
+        async with build_buffer(mocker, max_delay=60) as buffer:
+            for _ in range(3):
+                await buffer.increment(User, 1, "processed")
+
+            assert len(buffer) == 1
+
+        buffer.manager.write_batch.assert_awaited_once_with(
+            [], {USER_KEY: {"processed": 3}}
+        )
+
+    asyncio.run(do_test())
+
+
+def test_manager_write_batch(mocker: MockerFixture) -> None:
+    async def do_test():
+        manager, redis, pipe = build_manager(mocker)
+        redis.hincrby = mocker.AsyncMock()
+        redis.hincrby.return_value = 1
+        pipe.hset = mocker.MagicMock()
+        pipe.hincrby = mocker.MagicMock()
+        pipe.execute.return_value = [1, 1, 4]
+        registry = user_city_data()
+        result = await manager.write_batch(
+            [registry], {USER_KEY: {"processed": 2}}
+        )
+        assert registry.index == 1
+        pipe.hincrby.assert_called_once_with(USER_KEY, "processed", 2)
+        assert result == {USER_KEY: {"processed": 4}}
+
+        redis.pipeline.reset_mock()
+        assert {} == await manager.write_batch([], {})
+        redis.pipeline.assert_not_called()
+
+    asyncio.run(do_test())
+
+
+def test_write_behind_buffer_on_flush(mocker: MockerFixture) -> None:
+    on_flush = mocker.AsyncMock()
+
+    async def do_test():
+        buffer = build_buffer(mocker, max_delay=60, on_flush=on_flush)
+        await buffer.flush()
+        on_flush.assert_not_called()
+
+        buffer.manager.write_batch.return_value = {USER_KEY: {"processed": 1}}
+        await buffer.increment(User, 1, "processed")
+        await buffer.close()
+        on_flush.assert_awaited_once_with({USER_KEY: {"processed": 1}})
+
+    asyncio.run(do_test())
+
+
+def test_write_behind_buffer_keeps_writes_on_failure(
+    mocker: MockerFixture,
+) -> None:
+    async def do_test():
+        buffer = build_buffer(mocker, max_size=10, max_delay=0.01)
+        buffer.manager.write_batch.side_effect = ConnectionError()
+        first = user_city_data()
+        await buffer.insert(first)
+        await buffer.increment(User, 1, "processed")
+        # deadline flush fails, its error is logged not lost
+        await asyncio.sleep(0.03)
+        assert buffer._timer is None
+
+        second = user_city_data()
+        await buffer.insert(second)
+        await buffer.increment(User, 1, "processed")
+        buffer.manager.write_batch.side_effect = None
+        await buffer.close()
+        buffer.manager.write_batch.assert_awaited_with(
+            [first, second], {USER_KEY: {"processed": 2}}
+        )
+        assert len(buffer) == 0
+
+    asyncio.run(do_test())
@@ -0,0 +1,70 @@
+import pytest
+
+from internal.database.codecs import (
+    BLOB_FIELD,
+    CODEC_FIELD,
+    CODECS,
+    decode_registry,
+    get_codec,
+    loads_payload,
+)
+
+PAYLOAD = {
+    "id": 3448439,
+    "name": "São Paulo",
+    "main": {"temp": 296.15, "humidity": 64, "pressure": 1017},
+    "weather": [{"id": 800, "main": "Clear"}],
+    "visibility": 10000,
+    "rain": None,
+    "big": 2**40,
+    "negative": -70000,
+    "flag": True,
+    "long": "x" * 300,
+}
+
+
+def stored(mapping: dict) -> dict[bytes, bytes]:
+    return {
+        key.encode(): (
+            value if isinstance(value, bytes) else str(value).encode()
+        )
+        for key, value in mapping.items()
+    }
+
+
+@pytest.mark.parametrize("name", list(CODECS))
+def test_codec_payload_roundtrip(name: str) -> None:
+    codec = get_codec(name)
+
+    assert PAYLOAD == codec.loads(codec.dumps(PAYLOAD))
+    assert PAYLOAD == loads_payload(codec.dumps(PAYLOAD))
+
+
+@pytest.mark.parametrize("name", list(CODECS))
+def test_codec_registry_roundtrip(name: str) -> None:
+    codec = get_codec(name)
+    registry = {"index": 1, "created_at": "2024-02-02", "processed_at": None}
+    result = decode_registry(stored(codec.encode(registry)))
+
+    assert {"index", "created_at"} == set(result)
+    assert "1" == str(result["index"])
+    assert "2024-02-02" == result["created_at"]
+
+
+@pytest.mark.parametrize("value", [2**63, -(2**63) - 1, 2**64, -(2**200)])
+def test_packed_codec_big_int_roundtrip(value: int) -> None:
+    codec = get_codec("packed")
+
+    assert {"big": value} == codec.loads(codec.dumps({"big": value}))
+
+
+def test_blob_codec_encode_single_field() -> None:
+    mapping = get_codec("zlib").encode({"index": 1, "data": "{}"})
+
+    assert {CODEC_FIELD, BLOB_FIELD} == set(mapping)
+    assert "zlib" == mapping[CODEC_FIELD]
+
+
+def test_get_codec_unknown() -> None:
+    with pytest.raises(ValueError):
+        get_codec("foo")
@@ -3,9 +3,18 @@ import asyncio
 from fastapi import HTTPException
 import pytest
 from pytest_mock.plugin import MockerFixture, MockType
-
-from internal.database.manager import AsyncDbManager, TABLE_DATA_ITEM_TOTAL_KEY
-from internal.models import User, CityInfo
+from redis.exceptions import WatchError
+
+from internal.database.cache import RegistryCache
+from internal.database.codecs import get_codec
+from internal.database.manager import (
+    AsyncDbManager,
+    FIELD_INDEX_KEY_PREFIX,
+    TABLE_DATA_ITEM_TOTAL_KEY,
+    RedisPool,
+)
+from internal.models import User, CityInfo, UserCityData
+from tests.internal.test_settings import api_settings_factory
 
 EXPECTED_KEY = f"table_data:{User.table_name()}"
 
@@ -27,6 +36,8 @@ def build_pipe_mock(mocker: MockerFixture, hget_return=None):
 
     pipe.hincrby = mocker.AsyncMock()
     pipe.hincrby.return_value = None
+    pipe.execute = mocker.AsyncMock()
+    pipe.execute.return_value = []
     pipe.__aenter__ = mocker.AsyncMock()
     pipe.__aenter__.return_value = pipe
     pipe.__aexit__ = mocker.AsyncMock()
@@ -43,6 +54,7 @@ def build_manager(
 
     manager = AsyncDbManager(redis)
     manager.redis = redis  # fix singleton issue
+    manager.cache = None
 
     return manager, redis, pipe
 
@@ -186,6 +198,46 @@ def test_insert_registry(mocker) -> None:
     asyncio.run(run_test(User(created_at="2012-09-08"), 5, 4))
 
 
+def test_insert_many(mocker: MockerFixture) -> None:
+    async def do_test():
+        manager, redis, pipe = build_manager(mocker)
+        redis.hincrby = mocker.AsyncMock()
+        redis.hincrby.return_value = 7
+        pipe.hset = mocker.MagicMock()
+        cities = [CityInfo(api_id=10), CityInfo(api_id=20)]
+        user_data = UserCityData(
+            user_id=7, request_time="2024-02-02T00:00", data="{}"
+        )
+        await manager.insert_many([*cities, user_data])
+
+        redis.hincrby.assert_any_await(
+            f"table_data:{CityInfo.table_name()}", TABLE_DATA_ITEM_TOTAL_KEY, 2
+        )
+        redis.hincrby.assert_any_await(
+            f"table_data:{UserCityData.table_name()}",
+            TABLE_DATA_ITEM_TOTAL_KEY,
+            1,
+        )
+        assert [6, 7] == [city.index for city in cities]
+        assert user_data.index == 7
+        redis.pipeline.assert_called_once_with()
+        pipe.hset.assert_any_call(
+            cities[0].db_index(), mapping={"index": 6, "api_id": 10}
+        )
+        assert pipe.hset.call_count == 3
+        pipe.zadd.assert_called_once_with(
+            f"{FIELD_INDEX_KEY_PREFIX}:{UserCityData.table_name()}:user_id:7",
+            {7: 7},
+        )
+        pipe.execute.assert_awaited_once()
+
+    asyncio.run(do_test())
+
+    manager, redis, _ = build_manager(mocker)
+    asyncio.run(manager.insert_many([]))
+    redis.pipeline.assert_not_called()
+
+
 TEST_SAMPLES = [
     "d086a6311049b1873e2ad839a961de50_1",
     "d086a6311049b1873e2ad839a961de50_2",
@@ -308,3 +360,451 @@ def test_find_all_by_field_from_model(mocker: MockerFixture) -> None:
         assert isinstance(result[0], CityInfo)
 
     asyncio.run(do_test())
+
+
+USER_CITY_DATA_INDEX_KEY = (
+    f"{FIELD_INDEX_KEY_PREFIX}:{UserCityData.table_name()}:user_id:7"
+)
+
+
+def stored_user_city_data(idx: int, user_id: int = 7) -> dict[bytes, bytes]:
+    """UserCityData as stored in redis by its codec"""
+    mapping = get_codec(UserCityData.storage_codec).encode(
+        UserCityData(
+            index=idx, user_id=user_id, request_time="2024-02-02", data="{}"
+        ).model_dump()
+    )
+
+    return {
+        key.encode(): value if isinstance(value, bytes) else value.encode()
+        for key, value in mapping.items()
+    }
+
+
+def test_field_index_key(mocker: MockerFixture) -> None:
+    manager, _, _ = build_manager(mocker)
+
+    assert USER_CITY_DATA_INDEX_KEY == manager._field_index_key(
+        UserCityData, "user_id", 7
+    )
+
+
+def test_insert_registry_updates_field_indexes(mocker: MockerFixture) -> None:
+    async def do_test():
+        manager, _, pipe = build_manager(mocker, b"2")
+        registry = UserCityData(
+            user_id=7, request_time="2024-02-02T00:00", data="{}"
+        )
+        await manager.insert_registry(registry)
+        assert registry.index == 3
+        pipe.zadd.assert_called_once_with(USER_CITY_DATA_INDEX_KEY, {3: 3})
+        pipe.zrem.assert_not_called()
+        pipe.execute.assert_awaited()
+
+    asyncio.run(do_test())
+
+
+def test_update_registry_moves_field_indexes(mocker: MockerFixture) -> None:
+    async def do_test():
+        manager, redis, pipe = build_manager(mocker)
+        redis.hgetall = mocker.AsyncMock()
+        redis.hgetall.return_value = stored_user_city_data(3, 5)
+        registry = UserCityData(
+            index=3, user_id=7, request_time="2024-02-02T00:00", data="{}"
+        )
+        await manager.update_registry(registry)
+        redis.hgetall.assert_awaited_with(registry.db_index())
+        pipe.zrem.assert_called_once_with(
+            USER_CITY_DATA_INDEX_KEY.replace(":7", ":5"), 3
+        )
+        pipe.zadd.assert_called_once_with(USER_CITY_DATA_INDEX_KEY, {3: 3})
+
+    asyncio.run(do_test())
+
+
+def test_remove_registries_cleans_field_indexes(mocker: MockerFixture) -> None:
+    async def do_test():
+        manager, redis, pipe = build_manager(mocker)
+        pipe.execute.return_value = [stored_user_city_data(1), {}]
+        await manager.remove_registries(UserCityData, 1, 2)
+        table = UserCityData.table_name()
+        pipe.hgetall.assert_any_call(f"{table}_1")
+        pipe.hgetall.assert_any_call(f"{table}_2")
+        pipe.delete.assert_called_once_with(f"{table}_1", f"{table}_2")
+        pipe.zrem.assert_called_once_with(USER_CITY_DATA_INDEX_KEY, 1)
+
+    asyncio.run(do_test())
+
+
+def test_find_all_by_field_from_index(mocker: MockerFixture) -> None:
+    async def do_test():
+        manager, redis, pipe = build_manager(mocker)
+        redis.zrange = mocker.AsyncMock()
+        redis.zrange.return_value = [b"1", b"4"]
+        redis.scan_iter = mocker.MagicMock()
+        pipe.execute.return_value = [
+            {
+                b"index": b"1",
+                b"user_id": b"7",
+                b"request_time": b"2024-02-02T00:00",
+                b"data": b"{}",
+            },
+            {},
+        ]
+        result = await manager.find_all_by_field(UserCityData, "user_id", 7)
+        redis.zrange.assert_awaited_with(USER_CITY_DATA_INDEX_KEY, 0, -1)
+        redis.scan_iter.assert_not_called()
+        table = UserCityData.table_name()
+        pipe.hgetall.assert_any_call(f"{table}_1")
+        pipe.hgetall.assert_any_call(f"{table}_4")
+        assert len(result) == 1
+        assert isinstance(result[0], UserCityData)
+        assert result[0].user_id == 7
+
+    asyncio.run(do_test())
+
+
+def test_rebuild_field_indexes(mocker: MockerFixture) -> None:
+    table = UserCityData.table_name()
+
+    async def scan_iter(pattern, count=None):
+        if pattern.startswith(FIELD_INDEX_KEY_PREFIX):
+            yield USER_CITY_DATA_INDEX_KEY.encode()
+            return
+
+        assert f"{table}_*" == pattern
+        yield f"{table}_1".encode()
+        yield f"{table}_2".encode()
+
+    async def do_test():
+        manager, redis, pipe = build_manager(mocker)
+        redis.scan_iter = scan_iter
+        redis.delete = mocker.AsyncMock()
+        pipe.execute.return_value = [
+            stored_user_city_data(1),
+            stored_user_city_data(2),
+        ]
+        assert 2 == await manager.rebuild_field_indexes(UserCityData)
+        redis.delete.assert_awaited_once_with(USER_CITY_DATA_INDEX_KEY)
+        pipe.zadd.assert_any_call(USER_CITY_DATA_INDEX_KEY, {1: 1})
+        pipe.zadd.assert_any_call(USER_CITY_DATA_INDEX_KEY, {2: 2})
+
+    asyncio.run(do_test())
+
+    manager, _, _ = build_manager(mocker)
+    assert 0 == asyncio.run(manager.rebuild_field_indexes(User))
+
+
+def user_city_data_hash(idx: int) -> dict[bytes, bytes]:
+    return {
+        b"index": str(idx).encode(),
+        b"user_id": b"7",
+        b"request_time": b"2024-02-02T00:00",
+        b"data": b"{}",
+    }
+
+
+def test_page_by_field(mocker: MockerFixture) -> None:
+    async def do_test():
+        manager, redis, pipe = build_manager(mocker)
+        redis.zrangebyscore = mocker.AsyncMock()
+        redis.zrangebyscore.return_value = [b"3", b"5"]
+        pipe.execute.return_value = [
+            user_city_data_hash(3),
+            user_city_data_hash(5),
+        ]
+        page, cursor = await manager.page_by_field(
+            UserCityData, "user_id", 7, 1, 2
+        )
+        redis.zrangebyscore.assert_awaited_with(
+            USER_CITY_DATA_INDEX_KEY, "(1", "+inf", start=0, num=2
+        )
+        assert [3, 5] == [registry.index for registry in page]
+        assert cursor == 5
+
+        page, cursor = await manager.page_by_field(
+            UserCityData, "user_id", 7, 5, 3
+        )
+        assert cursor is None
+
+    asyncio.run(do_test())
+
+    manager, _, _ = build_manager(mocker)
+    with pytest.raises(HTTPException):
+        asyncio.run(manager.page_by_field(CityInfo, "api_id", 1))
+
+
+def test_iter_all_by_field_from_index(mocker: MockerFixture) -> None:
+    async def do_test():
+        manager, redis, pipe = build_manager(mocker)
+        redis.zrangebyscore = mocker.AsyncMock()
+        redis.zrangebyscore.side_effect = [[b"1", b"2"], [b"3"]]
+        pipe.execute.side_effect = [
+            [user_city_data_hash(1), user_city_data_hash(2)],
+            [user_city_data_hash(3)],
+        ]
+        result = [
+            registry.index
+            async for registry in manager.iter_all_by_field(
+                UserCityData, "user_id", 7, 2
+            )
+        ]
+        assert [1, 2, 3] == result
+        assert redis.zrangebyscore.await_count == 2
+        redis.zrangebyscore.assert_awaited_with(
+            USER_CITY_DATA_INDEX_KEY, "(2", "+inf", start=0, num=2
+        )
+
+    asyncio.run(do_test())
+
+
+def test_redis_pool_lifecycle() -> None:
+    RedisPool.instance = None
+    redis_pool = RedisPool(api_settings_factory())
+
+    async def do_test():
+        assert redis_pool.stats()["max_connections"] == 0
+        pool = redis_pool.open()
+        assert pool is redis_pool.open()
+        assert redis_pool.client().connection_pool is pool
+        assert redis_pool.client().connection_pool is pool
+        assert redis_pool.stats() == {
+            "max_connections": 50,
+            "in_use": 0,
+            "available": 50,
+        }
+        await redis_pool.close()
+        assert redis_pool.pool is None
+
+    asyncio.run(do_test())
+    RedisPool.instance = None
+
+
+def test_redis_pool_counts_connections(mocker: MockerFixture) -> None:
+    RedisPool.instance = None
+    redis_pool = RedisPool(api_settings_factory())
+
+    async def do_test():
+        pool = redis_pool.open()
+        mocker.patch.object(pool, "ensure_connection", mocker.AsyncMock())
+        connection = await pool.get_connection("GET")
+        assert redis_pool.stats()["in_use"] == 1
+        assert redis_pool.stats()["available"] == 49
+        held = await pool.get_connection("GET")
+        pool.ensure_connection.side_effect = ConnectionError()
+        with pytest.raises(ConnectionError):
+            await pool.get_connection("GET")
+
+        # a failed checkout doesn't discount connections still held
+        assert redis_pool.stats()["in_use"] == 2
+        await pool.release(connection)
+        await pool.release(held)
+        assert redis_pool.stats()["in_use"] == 0
+        await redis_pool.close()
+
+    asyncio.run(do_test())
+    RedisPool.instance = None
+
+
+def test_find_registry_read_through_cache(mocker: MockerFixture) -> None:
+    manager, redis, _ = build_manager(mocker)
+    manager.cache = RegistryCache(10, 60, "invalidate")
+    redis.hgetall = mocker.AsyncMock()
+    redis.hgetall.return_value = {b"index": b"1", b"created_at": b"2024-02-02"}
+    redis.publish = mocker.AsyncMock()
+    redis.hmget = mocker.AsyncMock()
+
+    async def do_test():
+        first = await manager.find_registry(User, 1)
+        second = await manager.find_registry(User, 1)
+        redis.hgetall.assert_awaited_once()
+        assert first == second
+        assert first is not second
+
+        await manager.update_registry(first)
+        redis.publish.assert_awaited_with("invalidate", first.db_index())
+        await manager.find_registry(User, 1)
+        assert redis.hgetall.await_count == 2
+
+    asyncio.run(do_test())
+    manager.cache = None
+
+
+def test_model_total_registries_cache(mocker: MockerFixture) -> None:
+    manager, redis, pipe = build_manager(mocker)
+    manager.cache = RegistryCache(10, 60, "invalidate")
+    redis.hget = mocker.AsyncMock()
+    redis.hget.return_value = b"3"
+    redis.publish = mocker.AsyncMock()
+
+    async def do_test():
+        assert 3 == await manager.model_total_registries(User)
+        assert 3 == await manager.model_total_registries(User)
+        redis.hget.assert_awaited_once()
+
+        await manager.insert_registry(User(created_at="2024-02-02"))
+        redis.publish.assert_awaited_with("invalidate", EXPECTED_KEY)
+        assert 3 == await manager.model_total_registries(User)
+        assert redis.hget.await_count == 2
+        assert manager.cache.stats()["hits"] == 1
+
+    asyncio.run(do_test())
+    manager.cache = None
+
+
+def test_migrate_codec(mocker: MockerFixture) -> None:
+    table = UserCityData.table_name()
+
+    async def scan_iter(pattern, count=None):
+        assert f"{table}_*" == pattern
+        for idx in (1, 2, 3):
+            yield f"{table}_{idx}".encode()
+
+    async def do_test():
+        manager, redis, pipe = build_manager(mocker)
+        manager.cache = RegistryCache(10, 60, "invalidate")
+        manager.cache.set(f"{table}_1", "cached")
+        manager.cache.set(f"{table}_2", "cached")
+        redis.publish = mocker.AsyncMock()
+        redis.scan_iter = scan_iter
+        pipe.hset = mocker.MagicMock()
+        pipe.execute.return_value = [
+            user_city_data_hash(1),
+            stored_user_city_data(2),
+            {},
+        ]
+        assert 1 == await manager.migrate_codec(UserCityData)
+        pipe.delete.assert_called_once_with(f"{table}_1")
+        pipe.hset.assert_called_once()
+        key, mapping = pipe.hset.call_args.args[0], pipe.hset.call_args.kwargs
+        assert key == f"{table}_1"
+        assert mapping["mapping"]["_codec"] == "zlib"
+        # migrated registries are not served from stale cached copies
+        assert manager.cache.get(f"{table}_1") is None
+        assert manager.cache.get(f"{table}_2") == "cached"
+        redis.publish.assert_awaited_once_with("invalidate", f"{table}_1")
+        manager.cache = None
+
+    asyncio.run(do_test())
+
+
+def test_increment_field_requires_hash_codec(mocker: MockerFixture) -> None:
+    manager, _, _ = build_manager(mocker)
+
+    with pytest.raises(HTTPException):
+        asyncio.run(manager.increment_field(UserCityData, 1, "user_id"))
+
+
+def test_find_registry_with_total(mocker: MockerFixture) -> None:
+    async def do_test():
+        manager, _, pipe = build_manager(mocker)
+        pipe.hget = mocker.MagicMock()
+        pipe.execute.return_value = [
+            {b"index": b"1", b"created_at": b"2024-02-02", b"processed": b"2"},
+            b"4",
+        ]
+        user, total = await manager.find_registry_with_total(User, 1, CityInfo)
+        pipe.hgetall.assert_called_once_with(f"{User.table_name()}_1")
+        pipe.hget.assert_called_once_with(
+            f"table_data:{CityInfo.table_name()}", TABLE_DATA_ITEM_TOTAL_KEY
+        )
+        pipe.execute.assert_awaited_once()
+        assert user.processed == 2
+        assert total == 4
+
+        pipe.execute.return_value = [{}, None]
+        with pytest.raises(HTTPException):
+            await manager.find_registry_with_total(User, 1, CityInfo)
+
+    asyncio.run(do_test())
+
+
+def test_set_fields(mocker: MockerFixture) -> None:
+    async def do_test():
+        manager, _, pipe = build_manager(mocker)
+        pipe.hset = mocker.MagicMock()
+        await manager.set_fields(User, 1, processed=0, processed_at=None)
+        pipe.hset.assert_called_once_with(
+            f"{User.table_name()}_1", mapping={"processed": 0}
+        )
+        pipe.hdel.assert_called_once_with(
+            f"{User.table_name()}_1", "processed_at"
+        )
+        pipe.execute.assert_awaited_once()
+
+        with pytest.raises(HTTPException):
+            await manager.set_fields(UserCityData, 1, data="{}")
+
+    asyncio.run(do_test())
+
+
+def test_write_batch_once(mocker: MockerFixture) -> None:
+    async def do_test():
+        manager, redis, pipe = build_manager(mocker)
+        redis.hincrby = mocker.AsyncMock()
+        redis.hincrby.return_value = 4
+        pipe.hset = mocker.MagicMock()
+        pipe.hincrby = mocker.MagicMock()
+        pipe.sadd = mocker.MagicMock()
+        pipe.expire = mocker.MagicMock()
+        pipe.smembers = mocker.MagicMock()
+        pipe.sismember = mocker.AsyncMock()
+        pipe.sismember.return_value = 0
+        pipe.execute.return_value = [1, True, {b"a", b"b"}, 1, 1, 9]
+        registry = UserCityData(
+            user_id=7, request_time="2024-02-02T00:00", data="{}"
+        )
+        increments = {"user_7": {"processed": 1}}
+        assert (
+            True,
+            {"a", "b"},
+            {"user_7": {"processed": 9}},
+        ) == await manager.write_batch_once(
+            "k", "a", 60, [registry], increments
+        )
+        assert 4 == registry.index
+        pipe.watch.assert_awaited_once_with("k")
+        pipe.multi.assert_called_once()
+        pipe.sadd.assert_called_once_with("k", "a")
+        pipe.expire.assert_called_once_with("k", 60)
+        pipe.hset.assert_called_once()
+        pipe.hincrby.assert_called_once_with("user_7", "processed", 1)
+
+        # already added member writes nothing
+        pipe.sismember.return_value = 1
+        pipe.smembers = mocker.AsyncMock()
+        pipe.smembers.return_value = {b"a"}
+        assert (False, {"a"}, {}) == await manager.write_batch_once(
+            "k", "a", 60, [registry], increments
+        )
+        pipe.execute.assert_awaited_once()
+
+        # member added by another delivery while batch was queued
+        pipe.sismember.return_value = 0
+        pipe.smembers = mocker.MagicMock()
+        pipe.execute.side_effect = WatchError()
+        redis.smembers = mocker.AsyncMock()
+        redis.smembers.return_value = {b"a"}
+        assert (False, {"a"}, {}) == await manager.write_batch_once(
+            "k", "a", 60, [registry], increments
+        )
+
+        redis.sismember = mocker.AsyncMock()
+        redis.sismember.return_value = 0
+        assert not await manager.is_set_member("k", "c")
+
+    asyncio.run(do_test())
+
+
+def test_set_many_if_absent(mocker: MockerFixture) -> None:
+    async def do_test():
+        manager, redis, pipe = build_manager(mocker)
+        pipe.set = mocker.MagicMock()
+        pipe.get = mocker.MagicMock()
+        pipe.execute.return_value = [True, b"a", None, b"old"]
+        result = await manager.set_many_if_absent({"k1": "a", "k2": "b"}, 60)
+        assert {"k1": (True, "a"), "k2": (False, "old")} == result
+        pipe.set.assert_any_call("k2", "b", nx=True, ex=60)
+        redis.pipeline.assert_called_with(transaction=True)
+
+    asyncio.run(do_test())
@@ -0,0 +1,81 @@
+"""Module for test pub/sub hub"""
+
+import asyncio
+from contextlib import aclosing
+
+from pytest_mock import MockerFixture
+
+from internal.database.pubsub import PubSubHub
+
+
+def build_hub(mocker: MockerFixture, messages: list[dict]):
+    redis = mocker.MagicMock()
+    pubsub = mocker.MagicMock()
+    pubsub.subscribe = mocker.AsyncMock()
+    pubsub.unsubscribe = mocker.AsyncMock()
+    pubsub.aclose = mocker.AsyncMock()
+
+    async def get_message(**_):
+        await asyncio.sleep(0.001)
+        return messages.pop(0) if messages else None
+
+    pubsub.get_message = get_message
+    redis.pubsub.return_value = pubsub
+
+    return PubSubHub(redis, queue_size=2), redis, pubsub
+
+
+def test_pubsub_hub_fans_out_one_connection(mocker: MockerFixture) -> None:
+    messages = []
+    hub, redis, pubsub = build_hub(mocker, messages)
+
+    async def collect(channel: str, count: int) -> list[str | None]:
+        result = []
+        async with aclosing(hub.subscribe(channel, timeout=0.05)) as stream:
+            async for message in stream:
+                result.append(message)
+                if len(result) == count:
+                    return result
+
+    async def do_test():
+        first = asyncio.create_task(collect("foo", 2))
+        second = asyncio.create_task(collect("foo", 1))
+        await asyncio.sleep(0.005)
+        assert {"channels": 1, "subscribers": 2} == hub.stats()
+        messages.extend(
+            [
+                {"type": "message", "channel": b"bar", "data": b"x"},
+                {"type": "message", "channel": b"foo", "data": b"1"},
+            ]
+        )
+        assert ["1"] == await second
+        # heartbeat when nothing is published
+        assert ["1", None] == await first
+        assert {"channels": 0, "subscribers": 0} == hub.stats()
+        await hub.close()
+
+    asyncio.run(do_test())
+    redis.pubsub.assert_called_once()
+    pubsub.subscribe.assert_awaited_once_with("foo")
+    pubsub.unsubscribe.assert_awaited_once_with("foo")
+    pubsub.aclose.assert_awaited_once()
+
+
+def test_pubsub_hub_drops_oldest_for_slow_subscriber(
+    mocker: MockerFixture,
+) -> None:
+    messages = [
+        {"type": "message", "channel": b"foo", "data": str(idx).encode()}
+        for idx in range(4)
+    ]
+    hub, _, _ = build_hub(mocker, messages)
+
+    async def do_test():
+        stream = hub.subscribe("foo", timeout=0.05)
+        assert "0" == await anext(stream)
+        await asyncio.sleep(0.02)
+        assert ["2", "3"] == [await anext(stream), await anext(stream)]
+        await stream.aclose()
+        await hub.close()
+
+    asyncio.run(do_test())
@@ -7,6 +7,7 @@ from pytest_mock.plugin import MockerFixture
 from internal.models import CityInfo, User, UserCityData
 from internal.database.manager import AsyncDbManager
 from internal.database.repositories import (
+    USER_JOB_STATS_KEY,
     BaseRepository,
     CityInfoRepository,
     UserRepository,
@@ -79,16 +80,9 @@ def test_user_city_data_repository_get_all_user_city_data(
 
 
 def test_city_info_repository_new_cities(mocker: MockerFixture) -> None:
-    counter = 0
-
-    async def mocked_insert_registry(value):
-        nonlocal counter
-        counter += 1
-        assert isinstance(value, CityInfo)
-        assert value.api_id == counter
-
     manager = mocker.MagicMock()
-    manager.insert_registry = mocked_insert_registry
+    manager.insert_many = mocker.AsyncMock()
+    manager.insert_registry = mocker.AsyncMock()
     repo = CityInfoRepository(manager)
 
     async def do_assert():
@@ -99,7 +93,8 @@ def test_city_info_repository_new_cities(mocker: MockerFixture) -> None:
             assert isinstance(result[i], CityInfo)
             assert result[i].api_id == i + 1
 
-        assert counter == 3
+        manager.insert_many.assert_awaited_once_with(result)
+        manager.insert_registry.assert_not_called()
 
     asyncio.run(do_assert())
 
@@ -117,3 +112,188 @@ def test_city_info_repository_total_of_cities(mocker: MockerFixture) -> None:
         manager.model_total_registries.assert_awaited_with(CityInfo)
 
     asyncio.run(do_assert())
+
+
+def test_user_repository_increment_processed(mocker: MockerFixture) -> None:
+    manager = mocker.MagicMock()
+    manager.increment_field = mocker.AsyncMock()
+    manager.increment_field.return_value = 3
+    manager.publish = mocker.AsyncMock()
+    repo = UserRepository(manager)
+    user = User(index=1, created_at="2021-02-02")
+
+    async def do_assert():
+        assert 3 == await repo.increment_processed(user, 2)
+        assert user.processed == 3
+        manager.increment_field.assert_awaited_with(User, 1, "processed", 2)
+        manager.publish.assert_awaited_with("progress:1", "3")
+
+    asyncio.run(do_assert())
+
+
+def test_user_city_data_repository_page_user_city_data(
+    mocker: MockerFixture,
+) -> None:
+    manager = mocker.MagicMock()
+    manager.page_by_field = mocker.AsyncMock()
+    manager.page_by_field.return_value = ([], None)
+    repo = UserCityDataRepository(manager)
+
+    async def do_test():
+        result = await repo.page_user_city_data(
+            User(index=1, created_at="2021-02-02"), 10, 20
+        )
+        assert result == ([], None)
+        manager.page_by_field.assert_awaited_with(
+            UserCityData, "user_id", 1, 10, 20
+        )
+
+    asyncio.run(do_test())
+
+
+def test_user_repository_get_user_with_total_cities(
+    mocker: MockerFixture,
+) -> None:
+    manager = mocker.MagicMock()
+    manager.find_registry_with_total = mocker.AsyncMock()
+    manager.find_registry_with_total.return_value = (None, 3)
+    repo = UserRepository(manager)
+
+    async def do_assert():
+        assert (None, 3) == await repo.get_user_with_total_cities(1)
+        manager.find_registry_with_total.assert_awaited_with(User, 1, CityInfo)
+
+    asyncio.run(do_assert())
+
+
+def test_user_repository_iter_progress(mocker: MockerFixture) -> None:
+    async def subscribe(channel, timeout):
+        assert channel == "progress:1"
+        for message in ("1", None, "2"):
+            yield message
+
+    manager = mocker.MagicMock()
+    manager.subscribe = subscribe
+    repo = UserRepository(manager)
+
+    async def do_assert():
+        result = [processed async for processed in repo.iter_progress(1)]
+        assert [1, None, 2] == result
+
+    asyncio.run(do_assert())
+
+
+def test_user_repository_start_and_finish_processing(
+    mocker: MockerFixture,
+) -> None:
+    manager = mocker.MagicMock()
+    manager.set_fields = mocker.AsyncMock()
+    repo = UserRepository(manager)
+    user = User(index=1, created_at="2021-02-02", processed=3)
+
+    async def do_assert():
+        await repo.start_processing(user)
+        assert user.processed == 0
+        manager.set_fields.assert_awaited_with(
+            User, 1, processed=0, processed_at=None
+        )
+        await repo.finish_processing(user)
+        assert user.processed_at is not None
+        manager.set_fields.assert_awaited_with(
+            User, 1, processed_at=user.processed_at
+        )
+
+    asyncio.run(do_assert())
+
+
+def test_city_info_repository_all_cities(mocker: MockerFixture) -> None:
+    manager = mocker.MagicMock()
+    manager.model_total_registries = mocker.AsyncMock()
+    manager.model_total_registries.return_value = 3
+    manager.find_registries = mocker.AsyncMock()
+    manager.find_registries.return_value = []
+    repo = CityInfoRepository(manager)
+
+    async def do_assert():
+        await repo.all_cities(2)
+        manager.find_registries.assert_any_await(CityInfo, 1, 2)
+        manager.find_registries.assert_any_await(CityInfo, 3)
+
+    asyncio.run(do_assert())
+
+
+def test_user_repository_complete_chunk(mocker: MockerFixture) -> None:
+    manager = mocker.MagicMock()
+    manager.write_batch_once = mocker.AsyncMock()
+    manager.is_set_member = mocker.AsyncMock()
+    manager.publish = mocker.AsyncMock()
+    manager._registry_index_factory = lambda model, idx: f"user_{idx}"
+    repo = UserRepository(manager)
+
+    async def do_assert():
+        manager.write_batch_once.return_value = (
+            True,
+            {"1-2", "3-3"},
+            {"user_1": {"processed": 3}},
+        )
+        registries = [UserCityData.build_from(1, {"id": 30})]
+        assert await repo.complete_chunk(1, "job", [3], 3, 60, registries)
+        manager.write_batch_once.assert_awaited_once_with(
+            "user_job:1:chunks:job",
+            "3-3",
+            60,
+            registries,
+            {"user_1": {"processed": 1}},
+        )
+        manager.publish.assert_awaited_once_with("progress:1", "3")
+        # redelivered chunk never completes job again
+        manager.write_batch_once.return_value = (False, {"1-2", "3-3"}, {})
+        assert not await repo.complete_chunk(1, "job", [3], 3, 60)
+        manager.write_batch_once.assert_awaited_with(
+            "user_job:1:chunks:job", "3-3", 60, [], {}
+        )
+        manager.write_batch_once.return_value = (True, {"1-2"}, {})
+        assert not await repo.complete_chunk(1, "job", [1, 2], 3, 60)
+        manager.publish.assert_awaited_once()
+
+        await repo.is_chunk_completed(1, "job", [1, 2])
+        manager.is_set_member.assert_awaited_once_with(
+            "user_job:1:chunks:job", "1-2"
+        )
+
+    asyncio.run(do_assert())
+
+
+def test_user_repository_acquire_jobs(mocker: MockerFixture) -> None:
+    manager = mocker.MagicMock()
+    manager.set_many_if_absent = mocker.AsyncMock()
+    manager.set_many_if_absent.return_value = {
+        "user_job:1": (True, "new"),
+        "user_job:2": (False, "old"),
+    }
+    manager.increment_counters = mocker.AsyncMock()
+    manager.get_counters = mocker.AsyncMock()
+    manager.get_counters.return_value = {"requested": 4, "deduplicated": 1}
+    repo = UserRepository(manager)
+    users = [
+        User(index=1, created_at="2021-02-02"),
+        User(index=2, created_at="2021-02-02"),
+    ]
+
+    async def do_assert():
+        result = await repo.acquire_jobs(users, 60)
+        assert {1: ("new", True), 2: ("old", False)} == result
+        keys = manager.set_many_if_absent.call_args.args[0]
+        assert ["user_job:1", "user_job:2"] == list(keys)
+        manager.increment_counters.assert_awaited_once_with(
+            USER_JOB_STATS_KEY, requested=2, deduplicated=1
+        )
+        stats = await repo.job_stats()
+        assert 0.25 == stats["dedupe_ratio"]
+        assert 0 == stats["skipped"]
+        await repo.fail_chunk()
+        manager.increment_counters.assert_awaited_with(
+            USER_JOB_STATS_KEY, failed_chunks=1
+        )
+
+    asyncio.run(do_assert())
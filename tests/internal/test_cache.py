@@ -0,0 +1,81 @@
+import time
+
+from internal.cache import LruTtlCache
+
+
+def test_lru_ttl_cache_get_set() -> None:
+    cache = LruTtlCache(2, 60)
+
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.get("b", 2) == 2
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["hit_ratio"] == 1 / 3
+
+
+def test_lru_ttl_cache_evict_least_recently_used() -> None:
+    cache = LruTtlCache(2, 60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_lru_ttl_cache_expire_entries() -> None:
+    cache = LruTtlCache(2, 0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_lru_ttl_cache_entry_ttl() -> None:
+    cache = LruTtlCache(3, 60)
+    cache.set("a", 1, ttl=0.01)
+    cache.set("b", 2, ttl=120)
+    cache.set("c", 3, ttl=0)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.get("c") is None
+    # entry ttl only shortens cache ttl
+    assert cache._data["b"][0] - time.monotonic() <= 60
+
+
+def test_lru_ttl_cache_invalidate() -> None:
+    cache = LruTtlCache(3, 60)
+    for key in "abc":
+        cache.set(key, key)
+
+    cache.invalidate("a", "b", "z")
+    assert len(cache) == 1
+    cache.clear()
+    assert len(cache) == 0
+
+    disabled = LruTtlCache(0, 60)
+    disabled.set("a", 1)
+    assert disabled.get("a") is None
+
+
+def test_lru_ttl_cache_max_bytes() -> None:
+    cache = LruTtlCache(max_size=10, ttl=60, max_bytes=10)
+    cache.set("a", 1, 4)
+    cache.set("b", 2, 4)
+    cache.set("a", 3, 4)
+    assert 8 == cache.bytes
+    cache.set("c", 4, 4)
+    assert cache.get("b") is None
+    assert 3 == cache.get("a")
+    assert 8 == cache.stats()["bytes"]
+    cache.clear()
+    assert 0 == cache.bytes
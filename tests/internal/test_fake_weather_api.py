@@ -0,0 +1,87 @@
+"""Module for test fake weather api"""
+
+import asyncio
+
+from aiohttp.test_utils import TestServer
+from fastapi import HTTPException
+import pytest
+
+from internal.fake_weather_api import (
+    GROUP_PATH,
+    WEATHER_PATH,
+    FakeWeatherApi,
+    city_payload,
+)
+from internal.services import RequestWeatherApiService
+from tests.internal.test_settings import (
+    TEST_WEATHER_API_TOKEN,
+    consumer_settings_factory,
+)
+
+
+def test_city_payload() -> None:
+    payload = city_payload(10)
+    assert payload["id"] == 10
+    assert payload["main"] == city_payload(10)["main"]
+    assert payload["main"] != city_payload(20)["main"]
+
+
+def test_fake_weather_api_serves_request_service() -> None:
+    RequestWeatherApiService.instance = None
+    api = FakeWeatherApi(token=TEST_WEATHER_API_TOKEN, rate=1000, burst=10)
+
+    async def do_test():
+        async with TestServer(api.build_app()) as server:
+            settings = consumer_settings_factory()
+            settings.weather_api_endpoint = str(server.make_url(WEATHER_PATH))
+            settings.weather_api_group_endpoint = str(
+                server.make_url(GROUP_PATH)
+            )
+            service = RequestWeatherApiService(settings)
+            assert (await service.fetch_city(10))["main"] == city_payload(10)[
+                "main"
+            ]
+            assert [1, 2] == sorted(await service.fetch_group([1, 2]))
+
+            service.api_token = "wrong"
+            with pytest.raises(HTTPException) as error:
+                await service.fetch_city(10)
+
+            assert 401 == error.value.status_code
+            await service.close()
+
+    asyncio.run(do_test())
+    assert 3 == api.requests
+    RequestWeatherApiService.instance = None
+
+
+def test_fake_weather_api_failures() -> None:
+    RequestWeatherApiService.instance = None
+    api = FakeWeatherApi(rate=1, burst=1)
+
+    async def do_test():
+        async with TestServer(api.build_app()) as server:
+            settings = consumer_settings_factory()
+            settings.weather_api_endpoint = str(server.make_url(WEATHER_PATH))
+            settings.weather_api_retries = 0
+            settings.weather_api_throttle_timeout = 0
+            service = RequestWeatherApiService(settings)
+            await service.fetch_city(10)
+            with pytest.raises(HTTPException) as error:
+                await service.fetch_city(10)
+
+            assert 429 == error.value.status_code
+            assert "1" == error.value.headers["Retry-After"]
+
+            api.rate, api.error_rate = 0, 1.0
+            service.paused_until = 0.0
+            with pytest.raises(HTTPException) as error:
+                await service.fetch_city(10)
+
+            assert 500 == error.value.status_code
+            await service.close()
+
+    asyncio.run(do_test())
+    assert 1 == api.throttled
+    assert 1 == api.errors
+    RequestWeatherApiService.instance = None
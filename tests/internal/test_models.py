@@ -74,3 +74,21 @@ def test_user_city_property_payload() -> None:
     assert result.payload is not None
     assert isinstance(result.payload, dict)
     assert result.payload == {"hello": "world!"}
+
+
+def test_user_city_storage_keeps_payload_decoded() -> None:
+    result = UserCityData.build_from(1, {"hello": "world!"})
+    stored = result.storage_dump()
+
+    assert {"hello": "world!"} == stored["payload"]
+    assert "data" not in stored
+    assert result == UserCityData(**stored)
+    assert "payload" not in result.model_dump()
+
+
+def test_user_city_accepts_json_data() -> None:
+    result = UserCityData(
+        user_id=1, request_time="2024-02-02", data='{"hello": "world!"}'
+    )
+
+    assert {"hello": "world!"} == result.payload
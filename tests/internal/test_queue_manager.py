@@ -5,8 +5,14 @@ from typing import Callable
 import asyncio
 from pytest_mock import MockerFixture
 
-from internal.models import User
-from internal.queue_manager import QueueManager, QueueConn, USER_QUEUE
+from internal.models import User, UserJob
+from internal.queue_manager import (
+    ConsumerStats,
+    QueueManager,
+    QueueConn,
+    USER_QUEUE,
+)
+from tests.internal.test_settings import api_settings_factory
 
 
 DATA_POINT = User(index=1, created_at="2022-01-01")
@@ -20,10 +26,10 @@ def test_queue_manager_enqueue_user(mocker: MockerFixture) -> None:
     async def do():
         manager = QueueManager(queue_conn)
 
-        await manager.enqueue_user(DATA_POINT)
+        await manager.enqueue_user(DATA_POINT, job_id="abc")
         queue_conn.send_message.assert_called_once()
         queue_conn.send_message.assert_awaited_with(
-            USER_QUEUE, DATA_POINT.model_dump_json()
+            USER_QUEUE, '{"u":1,"j":"abc"}'
         )
 
     asyncio.run(do())
@@ -51,3 +57,178 @@ def test_queue_manager_process_user_queue_message(
         await manager.process_user_queue_message(test_func)
 
     asyncio.run(do_assert())
+
+
+def test_queue_manager_enqueue_users(mocker: MockerFixture) -> None:
+    queue_conn = mocker.MagicMock(QueueConn)
+    queue_conn.send_messages = mocker.AsyncMock()
+    users = [DATA_POINT, User(index=2, created_at="2022-01-02")]
+
+    async def do():
+        manager = QueueManager(queue_conn)
+
+        await manager.enqueue_users(users)
+        queue_conn.send_messages.assert_awaited_once_with(
+            USER_QUEUE, ['{"u":1}', '{"u":2}']
+        )
+
+    asyncio.run(do())
+
+
+def test_queue_manager_enqueue_user_chunks(mocker: MockerFixture) -> None:
+    queue_conn = mocker.MagicMock(QueueConn)
+    queue_conn.send_messages = mocker.AsyncMock()
+
+    async def do():
+        manager = QueueManager(queue_conn)
+
+        await manager.enqueue_user(DATA_POINT, 5, 2)
+        queue_name, messages = queue_conn.send_messages.call_args.args
+        assert USER_QUEUE == queue_name
+        assert [
+            '{"u":1,"c":[1,3],"t":5}',
+            '{"u":1,"c":[3,5],"t":5}',
+            '{"u":1,"c":[5,6],"t":5}',
+        ] == messages
+
+    asyncio.run(do())
+
+
+def test_queue_manager_process_user_job_message(
+    mocker: MockerFixture,
+) -> None:
+    income = [
+        DATA_POINT.model_dump_json(),
+        UserJob(user=DATA_POINT, cities=[1, 2], total=4).model_dump_json(),
+        '{"u":1,"j":"abc","c":[3,5],"t":4}',
+        '{"u":2}',
+    ]
+
+    async def my_process_manager(queue_name, func) -> None:
+        await asyncio.gather(*(func(message) for message in income))
+
+    queue_conn = mocker.MagicMock(QueueConn)
+    queue_conn.process_message = my_process_manager
+    load_users = mocker.AsyncMock()
+    load_users.return_value = [DATA_POINT]
+    jobs = []
+
+    async def test_func(job: UserJob) -> None:
+        jobs.append(job)
+
+    asyncio.run(
+        QueueManager(queue_conn).process_user_job_message(
+            test_func, load_users
+        )
+    )
+    load_users.assert_awaited_once_with(1, 2)
+    assert [None, [1, 2], [3, 4]] == [job.cities for job in jobs]
+    assert [None, None, "abc"] == [job.job_id for job in jobs]
+    assert all(job.user == DATA_POINT for job in jobs)
+
+
+def test_queue_conn_send_messages(mocker: MockerFixture) -> None:
+    QueueConn.instance = None
+    conn = QueueConn(api_settings_factory())
+    channel = mocker.MagicMock()
+    channel.declare_queue = mocker.AsyncMock()
+    channel.default_exchange.publish = mocker.AsyncMock()
+    pool = mocker.MagicMock()
+    pool.acquire.return_value.__aenter__ = mocker.AsyncMock()
+    pool.acquire.return_value.__aenter__.return_value = channel
+    pool.acquire.return_value.__aexit__ = mocker.AsyncMock()
+    pool.acquire.return_value.__aexit__.return_value = False
+    conn.conn, conn.channels = mocker.MagicMock(), pool
+
+    async def do():
+        await conn.send_messages(USER_QUEUE, ["a", "b"])
+        await conn.send_message(USER_QUEUE, "c")
+        channel.declare_queue.assert_awaited_once_with(USER_QUEUE)
+        assert channel.default_exchange.publish.await_count == 3
+        assert pool.acquire.call_count == 2
+
+    asyncio.run(do())
+    QueueConn.instance = None
+
+
+def build_consumer_conn(mocker: MockerFixture):
+    QueueConn.instance = None
+    conn = QueueConn(api_settings_factory())
+    conn.settings.queue_drain_timeout = 0.05
+    channel = mocker.MagicMock()
+    channel.set_qos = mocker.AsyncMock()
+    channel.close = mocker.AsyncMock()
+    queue = mocker.MagicMock()
+    queue.consume = mocker.AsyncMock()
+    queue.consume.return_value = "tag"
+    queue.cancel = mocker.AsyncMock()
+    channel.declare_queue = mocker.AsyncMock()
+    channel.declare_queue.return_value = queue
+    conn.conn = mocker.MagicMock()
+    conn.conn.channel = mocker.AsyncMock()
+    conn.conn.channel.return_value = channel
+    QueueConn.instance = None
+
+    return conn, channel, queue
+
+
+def build_incoming_message(mocker: MockerFixture, body: str):
+    message = mocker.MagicMock()
+    message.body = body.encode()
+    message.ack = mocker.AsyncMock()
+    message.nack = mocker.AsyncMock()
+    message.reject = mocker.AsyncMock()
+
+    return message
+
+
+def test_queue_conn_process_message_concurrently(
+    mocker: MockerFixture,
+) -> None:
+    conn, channel, queue = build_consumer_conn(mocker)
+    running, max_running = 0, 0
+
+    async def func(body: str) -> None:
+        nonlocal running, max_running
+        if body == "fail":
+            raise ValueError(body)
+
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01 if body != "slow" else 10)
+        running -= 1
+
+    async def do():
+        stop, stats = asyncio.Event(), ConsumerStats()
+        consumer = asyncio.create_task(
+            conn.process_message(
+                USER_QUEUE, func, 5, 2, stop=stop, stats=stats
+            )
+        )
+        await asyncio.sleep(0)
+        on_message = queue.consume.call_args.args[0]
+        messages = [
+            build_incoming_message(mocker, body)
+            for body in ("a", "b", "c", "fail", "slow")
+        ]
+        for message in messages:
+            await on_message(message)
+
+        await asyncio.sleep(0.1)
+        stop.set()
+        await consumer
+
+        channel.set_qos.assert_awaited_with(prefetch_count=5)
+        queue.cancel.assert_awaited_with("tag")
+        assert max_running == 2
+        for message in messages[:3]:
+            message.ack.assert_awaited_once()
+
+        messages[3].reject.assert_awaited_once_with(requeue=False)
+        messages[4].nack.assert_awaited_once_with(requeue=True)
+        assert stats.stats()["processed"] == 3
+        assert stats.stats()["failed"] == 1
+        assert stats.stats()["requeued"] == 1
+        assert stats.stats()["in_flight"] == 0
+
+    asyncio.run(do())
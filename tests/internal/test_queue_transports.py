@@ -0,0 +1,179 @@
+"""Module for test queue transports"""
+
+import asyncio
+
+import pytest
+from pytest_mock import MockerFixture
+from redis.exceptions import ResponseError
+
+from internal.queue_manager import (
+    QueueConn,
+    _queue_transport_di_factory,
+)
+from internal.queue_transports import (
+    ConsumerStats,
+    MemoryTransport,
+    QueueTransport,
+    RedisStreamTransport,
+)
+from tests.internal.test_settings import api_settings_factory
+
+
+def test_queue_transport_di_factory() -> None:
+    settings = api_settings_factory()
+    _queue_transport_di_factory.instance = None
+    settings.queue_transport = "redis"
+    assert isinstance(
+        _queue_transport_di_factory(settings), RedisStreamTransport
+    )
+
+    _queue_transport_di_factory.instance = None
+    QueueConn.instance = None
+    settings.queue_transport = "amqp"
+    assert _queue_transport_di_factory(settings) is QueueConn(settings)
+    _queue_transport_di_factory.instance = None
+    QueueConn.instance = None
+
+
+def test_memory_transport_send_and_process() -> None:
+    settings = api_settings_factory()
+    settings.queue_drain_timeout = 0.05
+    transport = MemoryTransport(settings)
+    received = []
+
+    async def func(body: str) -> None:
+        if body == "fail":
+            raise ValueError(body)
+
+        if body == "slow":
+            await asyncio.sleep(10)
+
+        received.append(body)
+
+    async def do():
+        stop, stats = asyncio.Event(), ConsumerStats()
+        await transport.send_messages("foo", ["a", "b", "fail", "slow"])
+        consumer = asyncio.create_task(
+            transport.process_message("foo", func, 2, 2, stop, stats)
+        )
+        await asyncio.sleep(0.05)
+        stop.set()
+        await consumer
+
+        assert ["a", "b"] == received
+        assert stats.stats()["processed"] == 2
+        assert stats.stats()["failed"] == 1
+        assert stats.stats()["requeued"] == 1
+        assert transport.queues["foo"].get_nowait() == "slow"
+
+    asyncio.run(do())
+
+
+def build_stream_transport(mocker: MockerFixture):
+    redis = mocker.MagicMock()
+    pipe = mocker.MagicMock()
+    pipe.execute = mocker.AsyncMock()
+    redis.pipeline.return_value.__aenter__ = mocker.AsyncMock()
+    redis.pipeline.return_value.__aenter__.return_value = pipe
+    redis.pipeline.return_value.__aexit__ = mocker.AsyncMock()
+    redis.pipeline.return_value.__aexit__.return_value = False
+    redis.xgroup_create = mocker.AsyncMock()
+    redis.xautoclaim = mocker.AsyncMock()
+    redis.xreadgroup = mocker.AsyncMock()
+    redis.xack = mocker.AsyncMock()
+    settings = api_settings_factory()
+    settings.queue_stream_block = 0.01
+
+    return RedisStreamTransport(settings, redis), redis, pipe
+
+
+def test_redis_stream_transport_send_messages(mocker: MockerFixture) -> None:
+    transport, _, pipe = build_stream_transport(mocker)
+
+    asyncio.run(transport.send_messages("foo", ["a", "b"]))
+    assert pipe.xadd.call_count == 2
+    assert pipe.xadd.call_args.args == ("foo", {"body": "b"})
+    pipe.execute.assert_awaited_once()
+
+
+def test_redis_stream_transport_process_message(
+    mocker: MockerFixture,
+) -> None:
+    transport, redis, _ = build_stream_transport(mocker)
+    redis.xgroup_create.side_effect = ResponseError("BUSYGROUP exists")
+    claims = [[b"0-0", [(b"1-0", {b"body": b"stuck"})], []]]
+    reads = [
+        [[b"foo", [(b"2-0", {b"body": b"a"}), (b"3-0", {b"body": b"fail"})]]]
+    ]
+    redis.xautoclaim.side_effect = lambda *_, **__: (
+        claims.pop() if claims else [b"0-0", [], []]
+    )
+
+    async def xreadgroup(*_, **__):
+        await asyncio.sleep(0)
+        return reads.pop() if reads else []
+
+    redis.xreadgroup.side_effect = xreadgroup
+    received = []
+    stop, stats = asyncio.Event(), ConsumerStats()
+
+    async def func(body: str) -> None:
+        if body == "fail":
+            raise ValueError(body)
+
+        received.append(body)
+        if len(received) == 2:
+            stop.set()
+
+    asyncio.run(transport.process_message("foo", func, 5, 2, stop, stats))
+    assert ["stuck", "a"] == received
+    assert redis.xautoclaim.await_args_list[0].kwargs["count"] == 5
+    acked = [call.args[2] for call in redis.xack.await_args_list]
+    assert [b"1-0", b"2-0", b"3-0"] == sorted(acked)
+    assert stats.stats()["processed"] == 2
+    assert stats.stats()["failed"] == 1
+
+
+def test_redis_stream_transport_heartbeat_and_requeue(
+    mocker: MockerFixture,
+) -> None:
+    transport, redis, pipe = build_stream_transport(mocker)
+    transport.settings.queue_stream_claim_idle = 0.03
+    transport.settings.queue_drain_timeout = 0.01
+    redis.xclaim = mocker.AsyncMock()
+    redis.xautoclaim.return_value = [b"0-0", [], []]
+    reads = [[[b"foo", [(b"1-0", {b"body": b"slow"})]]]]
+
+    async def xreadgroup(*_, **__):
+        await asyncio.sleep(0.005)
+        return reads.pop() if reads else []
+
+    redis.xreadgroup.side_effect = xreadgroup
+
+    async def func(_: str) -> None:
+        await asyncio.sleep(10)
+
+    async def do():
+        stop, stats = asyncio.Event(), ConsumerStats()
+        consumer = asyncio.create_task(
+            transport.process_message("foo", func, 5, 2, stop, stats)
+        )
+        await asyncio.sleep(0.05)
+        stop.set()
+        await consumer
+
+        assert stats.stats()["requeued"] == 1
+
+    asyncio.run(do())
+    # in-flight message kept owned while handler runs
+    assert redis.xclaim.await_args.args[4] == [b"1-0"]
+    assert redis.xclaim.await_args.kwargs["justid"]
+    # drained message moved to stream tail and acked
+    assert pipe.xadd.call_args.args == ("foo", {"body": "slow"})
+    assert pipe.xack.call_args.args == ("foo", "consumers", b"1-0")
+    redis.xack.assert_not_awaited()
+
+
+def test_queue_transport_is_abstract() -> None:
+    with pytest.raises(TypeError):
+        QueueTransport(api_settings_factory())
@@ -0,0 +1,925 @@
+import asyncio
+import time
+
+from fastapi import HTTPException
+import pytest
+from pytest_mock import MockerFixture
+
+from internal.cache import LruTtlCache
+from internal.database.manager import DELETE_IF_EQUAL_SCRIPT
+from internal.models import CityInfo, User, UserCityData, UserJob
+from internal.services import (
+    CacheStats,
+    CitiesCacheWarmer,
+    CitiesFetchApiService,
+    Projection,
+    RequestWeatherApiService,
+    UserCitiesRequestService,
+    city_response_data_cleaner,
+    parse_retry_after,
+)
+from tests.internal.test_settings import consumer_settings_factory
+
+WEATHER_DATA = {
+    "id": 10,
+    "name": "Foo",
+    "main": {"temp": 296.15, "humidity": 64, "pressure": 1017},
+    "wind": {"speed": 3.6},
+}
+
+
+def test_city_response_data_cleaner() -> None:
+    assert {
+        "id": 10,
+        "name": "Foo",
+        "temp": 296.15,
+        "humidity": 64,
+    } == city_response_data_cleaner(WEATHER_DATA)
+
+
+def test_projection() -> None:
+    projection = Projection(
+        ["id", "main.temp", "wind_speed=wind.speed", "rain.1h", "id.foo"],
+        measure=True,
+    )
+
+    assert {
+        "id": 10,
+        "temp": 296.15,
+        "wind_speed": 3.6,
+        "1h": None,
+        "foo": None,
+    } == projection(WEATHER_DATA)
+    stats = projection.stats()
+    assert stats["payloads"] == 1
+    assert stats["bytes_in"] > stats["bytes_out"]
+    assert (
+        stats["bytes_saved_per_payload"]
+        == stats["bytes_in"] - stats["bytes_out"]
+    )
+    assert Projection(["id"]).stats()["bytes_saved_per_payload"] == 0.0
+
+
+def test_user_cities_request_service(mocker: MockerFixture) -> None:
+    user = User(index=1, created_at="2024-02-02")
+
+    async def fetch_all_list_cities(cities_list, stats=None):
+        assert [10, 20] == cities_list
+        for city_id in cities_list:
+            yield {**WEATHER_DATA, "id": city_id}
+
+    fetch_service = mocker.MagicMock()
+    fetch_service.fetch_all_list_cities = fetch_all_list_cities
+    user_repo = mocker.AsyncMock()
+    user_repo.database_manager = mocker.MagicMock()
+    user_repo.database_manager.write_batch = mocker.AsyncMock()
+    user_repo.database_manager.write_batch.return_value = {
+        user.db_index(): {"processed": 2}
+    }
+    user_repo.database_manager._registry_index_factory = (
+        lambda model, idx: f"{model.table_name()}_{idx}"
+    )
+    city_info_repo = mocker.AsyncMock()
+    city_info_repo.all_cities.return_value = [
+        CityInfo(index=1, api_id=10),
+        CityInfo(index=2, api_id=20),
+    ]
+    user_city_data_repo = mocker.AsyncMock()
+    service = UserCitiesRequestService(
+        fetch_service, user_repo, city_info_repo, user_city_data_repo, 50, 60
+    )
+
+    async def do_test():
+        await service(user)
+        user_repo.start_processing.assert_awaited_once_with(user)
+        user_city_data_repo.remove_all_user_city_data.assert_awaited_once_with(
+            user
+        )
+        write_batch = user_repo.database_manager.write_batch
+        write_batch.assert_awaited_once()
+        registries, increments = write_batch.call_args.args
+        assert 2 == len(registries)
+        assert all(isinstance(r, UserCityData) for r in registries)
+        assert {user.db_index(): {"processed": 2}} == increments
+        user_repo.notify_progress.assert_awaited_once_with(1, 2)
+        user_repo.finish_processing.assert_awaited_once_with(user)
+
+    asyncio.run(do_test())
+
+
+def test_user_cities_request_service_chunk(mocker: MockerFixture) -> None:
+    user = User(index=1, created_at="2024-02-02", processed=0)
+
+    async def fetch_all_list_cities(cities_list, stats=None):
+        assert [20] == cities_list
+        for city_id in cities_list:
+            yield {**WEATHER_DATA, "id": city_id}
+
+    fetch_service = mocker.MagicMock()
+    fetch_service.fetch_all_list_cities = fetch_all_list_cities
+    user_repo = mocker.AsyncMock()
+    user_repo.database_manager = mocker.MagicMock()
+    user_repo.database_manager.write_batch = mocker.AsyncMock()
+    user_repo.database_manager.write_batch.return_value = {
+        user.db_index(): {"processed": 2}
+    }
+    city_info_repo = mocker.AsyncMock()
+    city_info_repo.get_cities.return_value = [CityInfo(index=2, api_id=20)]
+    user_city_data_repo = mocker.AsyncMock()
+    service = UserCitiesRequestService(
+        fetch_service, user_repo, city_info_repo, user_city_data_repo, 50, 60
+    )
+
+    async def do_test():
+        await service(UserJob(user=user, cities=[2], total=3))
+        city_info_repo.get_cities.assert_awaited_once_with(2)
+        user_repo.start_processing.assert_not_awaited()
+        user_city_data_repo.remove_all_user_city_data.assert_not_awaited()
+        user_repo.notify_progress.assert_awaited_once_with(1, 2)
+        user_repo.finish_processing.assert_not_awaited()
+
+        # last chunk completes the request
+        user_repo.database_manager.write_batch.return_value = {
+            user.db_index(): {"processed": 3}
+        }
+        await service(UserJob(user=user, cities=[2], total=3))
+        user_repo.finish_processing.assert_awaited_once_with(user)
+
+    asyncio.run(do_test())
+
+
+def test_user_cities_request_service_chunk_job(
+    mocker: MockerFixture,
+) -> None:
+    user = User(index=1, created_at="2024-02-02", processed=0)
+
+    async def fetch_all_list_cities(cities_list, stats=None):
+        for city_id in cities_list:
+            yield {**WEATHER_DATA, "id": city_id}
+
+    fetch_service = mocker.MagicMock()
+    fetch_service.fetch_all_list_cities = fetch_all_list_cities
+    user_repo = mocker.AsyncMock()
+    user_repo.is_current_job.return_value = True
+    user_repo.is_chunk_completed.return_value = False
+    user_repo.complete_chunk.return_value = True
+    user_repo.database_manager = mocker.MagicMock()
+    user_repo.database_manager.write_batch = mocker.AsyncMock()
+    user_repo.database_manager.write_batch.return_value = {
+        user.db_index(): {"processed": 4}
+    }
+    city_info_repo = mocker.AsyncMock()
+    city_info_repo.get_cities.return_value = [CityInfo(index=2, api_id=20)]
+    service = UserCitiesRequestService(
+        fetch_service,
+        user_repo,
+        city_info_repo,
+        mocker.AsyncMock(),
+        job_ttl=60,
+    )
+    job = UserJob(user=user, job_id="job", cities=[2], total=3)
+
+    async def do_test():
+        await service(job)
+        user_repo.complete_chunk.assert_awaited_once()
+        args = user_repo.complete_chunk.call_args.args
+        assert (1, "job", [2], 3, 60) == args[:5]
+        # chunk cities are stored along with its completion
+        assert [20] == [registry.payload["id"] for registry in args[5]]
+        user_repo.database_manager.write_batch.assert_not_awaited()
+        user_repo.finish_processing.assert_awaited_once_with(user)
+        user_repo.release_job.assert_awaited_once_with(1, "job")
+
+        user_repo.is_chunk_completed.return_value = True
+        await service(job)
+        user_repo.skip_stale_job.assert_awaited_once()
+        city_info_repo.get_cities.assert_awaited_once()
+
+    asyncio.run(do_test())
+
+
+def test_user_cities_request_service_failed_job(
+    mocker: MockerFixture,
+) -> None:
+    user = User(index=1, created_at="2024-02-02", processed=0)
+
+    async def fetch_all_list_cities(cities_list, stats=None):
+        raise HTTPException(500)
+        yield
+
+    fetch_service = mocker.MagicMock()
+    fetch_service.fetch_all_list_cities = fetch_all_list_cities
+    user_repo = mocker.AsyncMock()
+    user_repo.is_current_job.return_value = True
+    user_repo.is_chunk_completed.return_value = False
+    user_repo.complete_chunk.return_value = False
+    user_repo.database_manager = mocker.MagicMock()
+    user_repo.database_manager.write_batch = mocker.AsyncMock()
+    user_repo.database_manager.write_batch.return_value = {}
+    city_info_repo = mocker.AsyncMock()
+    service = UserCitiesRequestService(
+        fetch_service, user_repo, city_info_repo, mocker.AsyncMock()
+    )
+
+    async def do_test():
+        # failed chunk keeps job for the remaining chunks
+        with pytest.raises(HTTPException):
+            await service(
+                UserJob(user=user, job_id="job", cities=[2], total=3)
+            )
+
+        user_repo.fail_chunk.assert_awaited_once()
+        user_repo.complete_chunk.assert_awaited_once_with(
+            1, "job", [2], 3, 3600
+        )
+        user_repo.release_job.assert_not_awaited()
+        user_repo.finish_processing.assert_not_awaited()
+
+        # failed last chunk still finishes the job
+        user_repo.complete_chunk.return_value = True
+        with pytest.raises(HTTPException):
+            await service(
+                UserJob(user=user, job_id="job", cities=[3], total=3)
+            )
+
+        user_repo.finish_processing.assert_awaited_once_with(user)
+        user_repo.release_job.assert_awaited_once_with(1, "job")
+
+        # a later chunk finishing the job keeps failed cities uncounted
+        async def fetch_ok(cities_list, stats=None):
+            for city_id in cities_list:
+                yield {**WEATHER_DATA, "id": city_id}
+
+        fetch_service.fetch_all_list_cities = fetch_ok
+        city_info_repo.get_cities.return_value = [CityInfo(index=1, api_id=10)]
+        user_repo.finish_processing.reset_mock()
+        user.processed = 1
+        await service(UserJob(user=user, job_id="job", cities=[1], total=3))
+        user_repo.finish_processing.assert_awaited_once_with(user)
+        assert 1 == user.processed
+
+        fetch_service.fetch_all_list_cities = fetch_all_list_cities
+        user_repo.release_job.reset_mock()
+        with pytest.raises(HTTPException):
+            await service(UserJob(user=user, job_id="whole"))
+
+        user_repo.release_job.assert_awaited_once_with(1, "whole")
+
+    asyncio.run(do_test())
+
+
+def test_user_cities_request_service_skip_stale_job(
+    mocker: MockerFixture,
+) -> None:
+    user_repo = mocker.AsyncMock()
+    user_repo.is_current_job.return_value = False
+    city_info_repo = mocker.AsyncMock()
+    service = UserCitiesRequestService(
+        mocker.MagicMock(), user_repo, city_info_repo, mocker.AsyncMock()
+    )
+    user = User(index=1, created_at="2024-02-02")
+
+    asyncio.run(service(UserJob(user=user, job_id="old")))
+    user_repo.is_current_job.assert_awaited_once_with(1, "old")
+    user_repo.skip_stale_job.assert_awaited_once()
+    user_repo.start_processing.assert_not_awaited()
+    city_info_repo.all_cities.assert_not_awaited()
+
+
+def build_redis_mock(mocker: MockerFixture, cached: dict):
+    redis = mocker.MagicMock()
+    redis.mget = mocker.AsyncMock()
+    redis.mget.side_effect = lambda keys: [cached.get(key) for key in keys]
+    pipe = mocker.MagicMock()
+    pipe.execute = mocker.AsyncMock()
+    redis.pipeline.return_value.__aenter__ = mocker.AsyncMock()
+    redis.pipeline.return_value.__aenter__.return_value = pipe
+    redis.pipeline.return_value.__aexit__ = mocker.AsyncMock()
+    redis.pipeline.return_value.__aexit__.return_value = False
+
+    return redis, pipe
+
+
+def test_cities_fetch_api_service_fetch_all_list_cities(
+    mocker: MockerFixture,
+) -> None:
+    running, max_running = 0, 0
+
+    async def fetch_city(city_id: int) -> dict:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep({1: 0.03, 2: 0.01, 3: 0.06, 4: 0.01}[city_id])
+        running -= 1
+        return {"id": city_id}
+
+    redis, pipe = build_redis_mock(mocker, {})
+    request_service = mocker.MagicMock()
+    request_service.fetch_city = fetch_city
+    service = CitiesFetchApiService(
+        request_service, redis, lambda data: data, concurrency=2
+    )
+
+    async def collect(ordered: bool) -> list[int]:
+        return [
+            data["id"]
+            async for data in service.fetch_all_list_cities(
+                [1, 2, 3, 4], ordered
+            )
+        ]
+
+    assert [2, 1, 4, 3] == asyncio.run(collect(False))
+    assert 2 == max_running
+    assert [1, 2, 3, 4] == asyncio.run(collect(True))
+
+
+def test_request_weather_api_service_shared_session(
+    mocker: MockerFixture,
+) -> None:
+    RequestWeatherApiService.instance = None
+    responses = [{"id": 10}, HTTPException(404)]
+
+    async def request(*_):
+        assert 1 == service.stats()["in_use"]
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+
+        return response
+
+    request_function = mocker.AsyncMock(side_effect=request)
+    service = RequestWeatherApiService(
+        consumer_settings_factory(), request_function
+    )
+
+    async def do_test():
+        session = service.open()
+        assert service.open() is session
+        assert {"id": 10} == await service.fetch_city(10)
+        request_function.assert_awaited_once_with(
+            session, service.build_endpoint(10)
+        )
+        with pytest.raises(HTTPException):
+            await service.fetch_city(20)
+
+        stats = service.stats()
+        assert 2 == stats["requests"]
+        assert 1 == stats["failures"]
+        assert 20 == stats["max_connections"]
+        assert 0 == stats["in_use"]
+        await service.close()
+        assert service.session is None
+
+    asyncio.run(do_test())
+    RequestWeatherApiService.instance = None
+
+
+def test_request_weather_api_service_retries(mocker: MockerFixture) -> None:
+    RequestWeatherApiService.instance = None
+    settings = consumer_settings_factory()
+    settings.weather_api_backoff_base = 0.001
+    request_function = mocker.AsyncMock()
+    request_function.side_effect = [
+        HTTPException(502),
+        asyncio.TimeoutError(),
+        HTTPException(429, headers={"Retry-After": "0.02"}),
+        {"id": 10},
+    ]
+    rate_limiter = mocker.MagicMock()
+    rate_limiter.acquire = mocker.AsyncMock()
+    service = RequestWeatherApiService(
+        settings, request_function, rate_limiter
+    )
+
+    async def do_test():
+        start = time.monotonic()
+        assert {"id": 10} == await service.fetch_city(10)
+        assert time.monotonic() - start >= 0.02
+        stats = service.stats()
+        assert 4 == stats["requests"]
+        assert 3 == stats["retries"]
+        # retries take quota as any request
+        assert 4 == rate_limiter.acquire.await_count
+        assert 1 == stats["throttled"]
+        assert "closed" == stats["circuit"]
+
+        request_function.side_effect = HTTPException(500)
+        with pytest.raises(HTTPException):
+            await service.fetch_city(10)
+
+        assert 8 == service.requests
+        await service.close()
+
+    asyncio.run(do_test())
+    RequestWeatherApiService.instance = None
+
+
+def test_request_weather_api_service_throttled_retries(
+    mocker: MockerFixture,
+) -> None:
+    RequestWeatherApiService.instance = None
+    settings = consumer_settings_factory()
+    settings.weather_api_retries = 1
+    throttled = HTTPException(429, headers={"Retry-After": "0"})
+    request_function = mocker.AsyncMock()
+    request_function.side_effect = [throttled] * 5 + [{"id": 10}]
+    service = RequestWeatherApiService(settings, request_function)
+
+    async def do_test():
+        # throttling doesn't use up the failures retries
+        assert {"id": 10} == await service.fetch_city(10)
+        assert 5 == service.stats()["throttled"]
+
+        settings.weather_api_throttle_timeout = 0
+        request_function.side_effect = [throttled, {"id": 10}]
+        with pytest.raises(HTTPException) as error:
+            await service.fetch_city(10)
+
+        assert 429 == error.value.status_code
+        await service.close()
+
+    asyncio.run(do_test())
+    RequestWeatherApiService.instance = None
+
+
+def test_request_weather_api_service_circuit_breaker(
+    mocker: MockerFixture,
+) -> None:
+    RequestWeatherApiService.instance = None
+    settings = consumer_settings_factory()
+    settings.weather_api_retries = 0
+    settings.weather_api_breaker_threshold = 2
+    request_function = mocker.AsyncMock()
+    request_function.side_effect = HTTPException(500)
+    service = RequestWeatherApiService(settings, request_function)
+
+    async def do_test():
+        for _ in range(2):
+            with pytest.raises(HTTPException):
+                await service.fetch_city(10)
+
+        with pytest.raises(HTTPException) as error:
+            await service.fetch_city(10)
+
+        assert 503 == error.value.status_code
+        assert 2 == request_function.await_count
+        assert "open" == service.stats()["circuit"]
+        await service.close()
+
+    asyncio.run(do_test())
+    RequestWeatherApiService.instance = None
+
+
+def test_request_weather_api_service_half_open_recovers(
+    mocker: MockerFixture,
+) -> None:
+    RequestWeatherApiService.instance = None
+    settings = consumer_settings_factory()
+    settings.weather_api_retries = 0
+    settings.weather_api_throttle_timeout = 0
+    settings.weather_api_breaker_threshold = 1
+    settings.weather_api_breaker_reset = 0.01
+    responses = [
+        HTTPException(500),
+        HTTPException(429, headers={"Retry-After": "0"}),
+        None,
+        {"id": 10},
+    ]
+
+    async def request_function(*_):
+        response = responses.pop(0)
+        if response is None:
+            await asyncio.sleep(10)
+
+        if isinstance(response, Exception):
+            raise response
+
+        return response
+
+    service = RequestWeatherApiService(settings, request_function)
+
+    async def do_test():
+        with pytest.raises(HTTPException):
+            await service.fetch_city(10)
+
+        # throttled trial opens circuit again
+        await asyncio.sleep(0.015)
+        with pytest.raises(HTTPException) as error:
+            await service.fetch_city(10)
+
+        assert 429 == error.value.status_code
+        assert "open" == service.stats()["circuit"]
+
+        # cancelled trial lets the next call through
+        await asyncio.sleep(0.015)
+        task = asyncio.create_task(service.fetch_city(10))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert {"id": 10} == await service.fetch_city(10)
+        assert "closed" == service.stats()["circuit"]
+        await service.close()
+
+    asyncio.run(do_test())
+    RequestWeatherApiService.instance = None
+
+
+def test_cities_fetch_api_service_cancels_unconsumed_groups(
+    mocker: MockerFixture,
+) -> None:
+    cancelled = []
+
+    async def fetch_city(city_id):
+        try:
+            await asyncio.sleep(0 if city_id == 1 else 10)
+        except asyncio.CancelledError:
+            cancelled.append(city_id)
+            raise
+
+        return {"id": city_id}
+
+    redis, _ = build_redis_mock(mocker, {})
+    request_service = mocker.MagicMock()
+    request_service.fetch_city = fetch_city
+    service = CitiesFetchApiService(request_service, redis, lambda data: data)
+
+    async def do_test():
+        stream = service.fetch_all_list_cities([1, 2, 3])
+        assert {"id": 1} == await anext(stream)
+        await stream.aclose()
+        # cancelled groups are awaited before the stream closes
+        assert [2, 3] == sorted(cancelled)
+
+    asyncio.run(do_test())
+
+
+def test_cities_fetch_api_service_close(mocker: MockerFixture) -> None:
+    redis, _ = build_redis_mock(mocker, {})
+    request_service = mocker.MagicMock()
+    request_service.close = mocker.AsyncMock()
+    service = CitiesFetchApiService(request_service, redis)
+
+    async def do_test():
+        task = asyncio.create_task(asyncio.sleep(10))
+        service.background.add(task)
+        await service.close()
+        assert task.cancelled()
+        request_service.close.assert_awaited_once()
+
+    asyncio.run(do_test())
+
+
+def test_parse_retry_after() -> None:
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("foo") is None
+    assert 3.0 == parse_retry_after("3")
+    assert 0.0 == parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT")
+
+
+def test_cities_fetch_api_service_group_fallback(
+    mocker: MockerFixture,
+) -> None:
+    redis, pipe = build_redis_mock(mocker, {"city:cache:3": b'{"id": 3}'})
+    request_service = mocker.MagicMock()
+    request_service.fetch_group = mocker.AsyncMock()
+    request_service.fetch_group.side_effect = [
+        {1: {"id": 1}},
+        HTTPException(400),
+    ]
+    request_service.fetch_city = mocker.AsyncMock()
+    request_service.fetch_city.side_effect = lambda city_id: {"id": city_id}
+    service = CitiesFetchApiService(
+        request_service, redis, lambda data: data, group_size=2
+    )
+
+    async def collect() -> list[int]:
+        return [
+            data["id"]
+            async for data in service.fetch_all_list_cities(
+                [1, 2, 3, 4, 5], ordered=True
+            )
+        ]
+
+    assert [1, 2, 3, 4, 5] == asyncio.run(collect())
+    request_service.fetch_group.assert_any_await([1, 2])
+    request_service.fetch_group.assert_any_await([4, 5])
+    # city 2 missing in group response, group [4, 5] failed
+    assert [2, 4, 5] == sorted(
+        call.args[0] for call in request_service.fetch_city.await_args_list
+    )
+    assert 4 == pipe.setex.call_count
+    redis.mget.assert_awaited_once_with(
+        [f"city:cache:{city_id}" for city_id in range(1, 6)]
+    )
+
+
+def test_cities_fetch_api_service_group_no_fallback_when_throttled(
+    mocker: MockerFixture,
+) -> None:
+    redis, _ = build_redis_mock(mocker, {})
+    request_service = mocker.MagicMock()
+    request_service.fetch_group = mocker.AsyncMock()
+    request_service.fetch_city = mocker.AsyncMock()
+    service = CitiesFetchApiService(
+        request_service, redis, lambda data: data, group_size=2
+    )
+
+    async def collect() -> list[dict]:
+        return [data async for data in service.fetch_all_list_cities([1, 2])]
+
+    for error in (
+        HTTPException(429),
+        HTTPException(500),
+        HTTPException(503),
+        asyncio.TimeoutError(),
+    ):
+        request_service.fetch_group.side_effect = error
+        with pytest.raises(type(error)):
+            asyncio.run(collect())
+
+    request_service.fetch_city.assert_not_awaited()
+
+
+def test_request_weather_api_service_fetch_group(
+    mocker: MockerFixture,
+) -> None:
+    RequestWeatherApiService.instance = None
+    settings = consumer_settings_factory()
+    settings.weather_api_group_endpoint = "https://foo.com/group"
+    request_function = mocker.AsyncMock()
+    request_function.return_value = {
+        "cnt": 2,
+        "list": [{"id": 10, "name": "Foo"}, {"id": 20, "name": "Bar"}],
+    }
+    service = RequestWeatherApiService(settings, request_function)
+
+    async def do_test():
+        result = await service.fetch_group([10, 20])
+        assert {10, 20} == set(result)
+        assert "Bar" == result[20]["name"]
+        request_function.assert_awaited_once_with(
+            service.session, "https://foo.com/group?id=10,20&appid=bar"
+        )
+        assert 20 == service.group_size
+        await service.close()
+
+    asyncio.run(do_test())
+    RequestWeatherApiService.instance = None
+
+
+def test_cities_fetch_api_service_bulk_cache_lookup(
+    mocker: MockerFixture,
+) -> None:
+    redis, pipe = build_redis_mock(
+        mocker, {"city:cache:1": b'{"id": 1}', "city:cache:3": b'{"id": 3}'}
+    )
+    request_service = mocker.MagicMock()
+    request_service.fetch_city = mocker.AsyncMock()
+    request_service.fetch_city.side_effect = lambda city_id: {"id": city_id}
+    service = CitiesFetchApiService(request_service, redis, lambda data: data)
+    stats = CacheStats()
+
+    async def collect(ordered: bool) -> list[int]:
+        return [
+            data["id"]
+            async for data in service.fetch_all_list_cities(
+                [1, 2, 3, 4], ordered, stats
+            )
+        ]
+
+    unordered = asyncio.run(collect(False))
+    # hits first, misses as fetched
+    assert [1, 3] == unordered[:2]
+    assert [2, 4] == sorted(unordered[2:])
+    assert [1, 2, 3, 4] == asyncio.run(collect(True))
+    assert {
+        "hits": 4,
+        "l1_hits": 0,
+        "redis_hits": 4,
+        "misses": 4,
+        "hit_ratio": 0.5,
+        "l1_hit_ratio": 0.0,
+    } == stats.stats()
+    assert 2 == redis.mget.await_count
+    # both groups misses are cached in one pipeline per run
+    assert 2 == pipe.execute.await_count
+    assert 4 == pipe.setex.call_count
+
+
+def test_cities_fetch_api_service_coalesces_cache_writes(
+    mocker: MockerFixture,
+) -> None:
+    redis, pipe = build_redis_mock(mocker, {})
+
+    async def fetch_city(city_id: int) -> dict:
+        await asyncio.sleep(0.01 * city_id)
+        return {"id": city_id}
+
+    request_service = mocker.MagicMock()
+    request_service.fetch_city = fetch_city
+    service = CitiesFetchApiService(
+        request_service, redis, lambda data: data, write_delay=0.05
+    )
+
+    async def do_test():
+        fetched = [
+            data["id"]
+            async for data in service.fetch_all_list_cities([1, 2, 3])
+        ]
+        assert [1, 2, 3] == sorted(fetched)
+
+    asyncio.run(do_test())
+    # groups done at different times are written back in one pipeline
+    pipe.execute.assert_awaited_once()
+    assert 3 == pipe.setex.call_count
+    assert {} == service.unwritten
+
+
+def test_cities_fetch_api_service_single_flight(
+    mocker: MockerFixture,
+) -> None:
+    redis, pipe = build_redis_mock(mocker, {})
+    calls = []
+
+    async def fetch_city(city_id: int) -> dict:
+        calls.append(city_id)
+        await asyncio.sleep(0.01)
+        return {"id": city_id}
+
+    request_service = mocker.MagicMock()
+    request_service.fetch_city = fetch_city
+    service = CitiesFetchApiService(request_service, redis, lambda data: data)
+
+    async def do_test():
+        result = await asyncio.gather(
+            service.fetch_city_group([1]),
+            service.fetch_city_group([1]),
+            service.fetch_city(1),
+        )
+        assert [[{"id": 1}]] * 2 + [{"id": 1}] == result
+        assert [1] == calls
+        assert {
+            "in_flight": 0,
+            "coalesced": 2,
+            "l1_cache": None,
+            "projection": None,
+        } == service.stats()
+
+    asyncio.run(do_test())
+
+
+def test_cities_fetch_api_service_distributed_lock(
+    mocker: MockerFixture,
+) -> None:
+    # city 2 is being fetched by another process, cached meanwhile
+    redis, pipe = build_redis_mock(mocker, {"city:cache:2": b'{"id": 2}'})
+    redis.mget.side_effect = [[None, None], [b'{"id": 2}']]
+    pipe.execute.side_effect = [[True, False], [], [1]]
+    request_service = mocker.MagicMock()
+    request_service.fetch_city = mocker.AsyncMock()
+    request_service.fetch_city.side_effect = lambda city_id: {"id": city_id}
+    service = CitiesFetchApiService(
+        request_service, redis, lambda data: data, group_size=2, lock_ttl=1
+    )
+
+    async def collect() -> list[int]:
+        return [
+            data["id"]
+            async for data in service.fetch_all_list_cities([1, 2], True)
+        ]
+
+    assert [1, 2] == asyncio.run(collect())
+    request_service.fetch_city.assert_awaited_once_with(1)
+    token = pipe.set.call_args.args[1]
+    pipe.set.assert_any_call("city:lock:2", token, nx=True, px=1000)
+    # only the lock still holding our token is released
+    pipe.eval.assert_called_once_with(
+        DELETE_IF_EQUAL_SCRIPT, 1, "city:lock:1", token
+    )
+
+
+def test_cities_fetch_api_service_lock_released_on_failure(
+    mocker: MockerFixture,
+) -> None:
+    redis, pipe = build_redis_mock(mocker, {})
+    pipe.execute.side_effect = [[True], [1]]
+    request_service = mocker.MagicMock()
+    request_service.fetch_city = mocker.AsyncMock()
+    request_service.fetch_city.side_effect = HTTPException(500)
+    service = CitiesFetchApiService(
+        request_service, redis, lambda data: data, lock_ttl=1
+    )
+
+    async def collect() -> list[dict]:
+        return [data async for data in service.fetch_all_list_cities([1])]
+
+    with pytest.raises(HTTPException):
+        asyncio.run(collect())
+
+    token = pipe.set.call_args.args[1]
+    pipe.eval.assert_called_once_with(
+        DELETE_IF_EQUAL_SCRIPT, 1, "city:lock:1", token
+    )
+
+
+def test_cities_fetch_api_service_stale_while_revalidate(
+    mocker: MockerFixture,
+) -> None:
+    redis, pipe = build_redis_mock(mocker, {})
+    # city 1 fresh, city 2 stale, city 3 missing
+    pipe.execute.side_effect = [
+        [[b'{"id": 1}', b'{"id": 2}', None], 90_000, 5_000, -2],
+        [],
+        [],
+    ]
+    request_service = mocker.MagicMock()
+    request_service.fetch_city = mocker.AsyncMock()
+    request_service.fetch_city.side_effect = lambda city_id: {"id": city_id}
+    service = CitiesFetchApiService(
+        request_service, redis, lambda data: data, cache_ttl=60, stale_ttl=30
+    )
+
+    async def collect() -> list[int]:
+        result = [
+            data["id"]
+            async for data in service.fetch_all_list_cities([1, 2, 3], True)
+        ]
+        await asyncio.gather(*service.background)
+        return result
+
+    assert [1, 2, 3] == asyncio.run(collect())
+    assert [2, 3] == sorted(
+        call.args[0] for call in request_service.fetch_city.await_args_list
+    )
+    pipe.setex.assert_any_call("city:cache:2", 90, b'{"id":2}')
+
+
+def test_cities_cache_warmer(mocker: MockerFixture) -> None:
+    fetch_service = mocker.AsyncMock()
+    fetch_service.expiring_cities.return_value = [20]
+    fetch_service.refresh_cities.return_value = 1
+    city_info_repo = mocker.AsyncMock()
+    city_info_repo.all_cities.return_value = [
+        CityInfo(index=1, api_id=10),
+        CityInfo(index=2, api_id=20),
+    ]
+    warmer = CitiesCacheWarmer(fetch_service, city_info_repo, 30)
+
+    async def do_test():
+        stop = asyncio.Event()
+        stop.set()
+        await warmer.run(stop)
+        fetch_service.expiring_cities.assert_not_awaited()
+        assert 1 == await warmer.warm()
+        fetch_service.expiring_cities.assert_awaited_once_with([10, 20], 30)
+        fetch_service.refresh_cities.assert_awaited_once_with([20])
+
+    asyncio.run(do_test())
+
+
+def test_cities_fetch_api_service_expiring_cities(
+    mocker: MockerFixture,
+) -> None:
+    redis, pipe = build_redis_mock(mocker, {})
+    pipe.execute.return_value = [100_000, 60_000, -2]
+    service = CitiesFetchApiService(
+        mocker.MagicMock(), redis, cache_ttl=60, stale_ttl=30
+    )
+
+    # fresh for more than 40s + 30s stale window
+    assert [2, 3] == asyncio.run(service.expiring_cities([1, 2, 3], 40))
+
+
+def test_cities_fetch_api_service_l1_cache(mocker: MockerFixture) -> None:
+    redis, pipe = build_redis_mock(mocker, {})
+    # city 1 fresh in redis for 2 more seconds, city 2 missing
+    pipe.execute.side_effect = [[[b'{"id": 1}', None], 2_000, -2], []]
+    request_service = mocker.MagicMock()
+    request_service.fetch_city = mocker.AsyncMock()
+    request_service.fetch_city.side_effect = lambda city_id: {"id": city_id}
+    service = CitiesFetchApiService(
+        request_service, redis, lambda data: data, l1_cache=LruTtlCache(10, 5)
+    )
+
+    async def collect(stats: CacheStats) -> list[int]:
+        return [
+            data["id"]
+            async for data in service.fetch_all_list_cities(
+                [1, 2], True, stats
+            )
+        ]
+
+    first, second = CacheStats(), CacheStats()
+    assert [1, 2] == asyncio.run(collect(first))
+    assert [1, 2] == asyncio.run(collect(second))
+    assert (1, 0, 1) == (first.hits, first.l1_hits, first.misses)
+    assert (2, 2, 0) == (second.hits, second.l1_hits, second.misses)
+    # second job needs no redis round trip
+    assert 2 == pipe.execute.await_count
+    request_service.fetch_city.assert_awaited_once_with(2)
+    # l1 entry never outlives redis entry
+    assert service.l1_cache._data[1][0] - time.monotonic() <= 2
+    assert service.l1_cache._data[2][0] - time.monotonic() > 4
+    assert 2 == service.stats()["l1_cache"]["size"]
@@ -35,8 +35,67 @@ def test_api_settings_ampq_dsn_property() -> None:
     assert api_settings_factory().amqp_dsn == TEST_AMQP_DSN
 
 
+def test_api_settings_amqp_transport_requires_dsn() -> None:
+    with pytest.raises(ValueError):
+        ApiSettings(
+            REDIS_DSN=TEST_REDIS_DSN,
+            queue_name=TEST_QUEUE_NAME,
+            queue_transport="amqp",
+        )
+
+    assert (
+        ApiSettings(
+            REDIS_DSN=TEST_REDIS_DSN,
+            queue_name=TEST_QUEUE_NAME,
+            queue_transport="redis",
+        ).amqp_url
+        is None
+    )
+
+
+def test_api_settings_rejects_memory_transport() -> None:
+    with pytest.raises(ValueError):
+        ApiSettings(
+            REDIS_DSN=TEST_REDIS_DSN,
+            queue_name=TEST_QUEUE_NAME,
+            queue_transport="memory",
+        )
+
+
 def test_consumer_settings_weather_api_dsn() -> None:
     assert (
         consumer_settings_factory().weather_api_dsn
         == TEST_WEATHER_API_ENDPOINT
     )
+
+
+def test_consumer_settings_l1_ttl_shorter_than_cache_ttl() -> None:
+    options = dict(
+        REDIS_DSN=TEST_REDIS_DSN,
+        AMQP_DSN=TEST_AMQP_DSN,
+        queue_name=TEST_QUEUE_NAME,
+        weather_api_endpoint=TEST_WEATHER_API_ENDPOINT,
+        weather_api_token=TEST_WEATHER_API_TOKEN,
+        weather_cache_ttl=30,
+        weather_cache_l1_ttl=30,
+    )
+    # disabled l1 cache ttl is not checked
+    assert ConsumerSettings(**options).weather_cache_l1_ttl == 30
+    with pytest.raises(ValueError):
+        ConsumerSettings(**options, weather_cache_l1_size=10)
+
+
+def test_consumer_settings_weather_api_rate() -> None:
+    settings = consumer_settings_factory()
+    assert settings.weather_api_rate == 1.0
+    settings.weather_api_rate_limit = "30/second"
+    assert settings.weather_api_rate == 30.0
+    with pytest.raises(ValueError):
+        ConsumerSettings(
+            REDIS_DSN=TEST_REDIS_DSN,
+            AMQP_DSN=TEST_AMQP_DSN,
+            queue_name=TEST_QUEUE_NAME,
+            weather_api_endpoint=TEST_WEATHER_API_ENDPOINT,
+            weather_api_token=TEST_WEATHER_API_TOKEN,
+            weather_api_rate_limit="0/second",
+        )
@@ -66,3 +66,80 @@ def test_chunked_stream_chunck_itens_integrety() -> None:
 
     for chk_sz in range(15, 1, -1):
         test_chunk_stream(chk_sz)
+
+
+def test_batch_loader() -> None:
+    calls = []
+
+    async def load_many(keys: list) -> dict:
+        calls.append(keys)
+        return {key: key * 2 for key in keys if key != 3}
+
+    async def do():
+        loader = utils.BatchLoader(load_many)
+        result = await asyncio.gather(
+            loader.load(1), loader.load(2), loader.load(1), loader.load(3)
+        )
+        assert [2, 4, 2, None] == result
+        assert [[1, 2, 3]] == calls
+        assert 10 == await loader.load(5)
+        assert [[1, 2, 3], [5]] == calls
+
+    asyncio.run(do())
+
+
+def test_token_bucket() -> None:
+    async def do():
+        bucket = utils.TokenBucket(rate=100, capacity=2)
+        start = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+
+        # 2 burst tokens, then 2 refilled at 100/s
+        assert 0.015 <= time.monotonic() - start < 0.1
+
+    asyncio.run(do())
+
+
+def test_circuit_breaker() -> None:
+    breaker = utils.CircuitBreaker(failure_threshold=2, reset_timeout=0.01)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.015)
+    # a single trial call when half open
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+
+    time.sleep(0.015)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED
+    assert breaker.allow()
+
+
+def test_redis_token_bucket() -> None:
+    calls = []
+
+    class Redis:
+        async def eval(self, *args):
+            calls.append(args)
+            return b"0.01" if len(calls) == 1 else b"0"
+
+    async def do():
+        bucket = utils.RedisTokenBucket(Redis(), "rate:foo", 100, 2)
+        start = time.monotonic()
+        await bucket.acquire()
+
+        # waited for redis to refill one token
+        assert 0.01 <= time.monotonic() - start < 0.1
+
+    asyncio.run(do())
+    assert 2 == len(calls)
+    assert (1, "rate:foo", 100, 2, 1.0) == calls[0][1:]